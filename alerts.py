@@ -0,0 +1,192 @@
+import sys
+import json
+import time
+import array
+import queue
+import logging
+import threading
+import urllib.request
+from collections import namedtuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# TODO: Add price to alert
+ALERT_MSG = "{symbol} trade opportunity @ {date} {time}: {open_state} -> {close_state}"
+
+# A trade opportunity. `created` is the time.perf_counter() of the bar that raised it, for latency measurement
+class AlertRecord(namedtuple("AlertRecord", ["symbol", "datetime", "open_state", "close_state", "created"])):
+    __slots__ = ()
+
+    def message(self):
+        return ALERT_MSG.format(symbol=self.symbol, date=self.datetime.date(), time=self.datetime.time(),
+                                open_state=self.open_state, close_state=self.close_state)
+
+    def to_dict(self):
+        return dict(symbol=self.symbol, datetime=self.datetime.isoformat(),
+                    open_state=self.open_state, close_state=self.close_state)
+
+
+def latency_summary(latencies):
+    """ Count, mean, median, 90th and 99th percentiles and max of latencies in seconds """
+    values = np.asarray(latencies, dtype=np.float64)
+    if not len(values):
+        return dict(count=0, mean=np.NaN, p50=np.NaN, p90=np.NaN, p99=np.NaN, max=np.NaN)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return dict(count=len(values), mean=float(values.mean()), p50=float(p50), p90=float(p90), p99=float(p99),
+                max=float(values.max()))
+
+
+class AlertSink(object):
+    """ Destination of alert batches. write() is only called from the dispatcher's thread """
+
+    def write(self, records):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class LogSink(AlertSink):
+    def __init__(self, logger=log, level=logging.WARNING):
+        self.logger = logger
+        self.level = level
+
+    def write(self, records):
+        for record in records:
+            self.logger.log(self.level, record.message())
+
+class StreamSink(AlertSink):
+    """ One message per line, stdout by default """
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, records):
+        stream = self.stream or sys.stdout
+        stream.write("".join(record.message() + "\n" for record in records))
+        stream.flush()
+
+class FileSink(AlertSink):
+    """ Appends the alerts to `path` as json lines """
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, records):
+        self.file.write("".join(json.dumps(record.to_dict()) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class WebhookSink(AlertSink):
+    """ POSTs each batch to `url` as a json list """
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def write(self, records):
+        body = json.dumps([record.to_dict() for record in records]).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+_STOP = object()
+
+class AlertDispatcher(object):
+    """ Hands alerts to `sink` from a background thread, started by start()
+
+    emit() only puts the record on a queue of `maxsize` alerts. When the sink falls behind and the queue is
+    full, emit() waits at most `block_timeout` seconds for room and otherwise drops the alert, counting it
+    in `dropped`. The consumer writes whatever is queued, up to `batch_size` alerts per sink call, and records
+    the latency from each alert's creation to the end of its write. close() waits at most `close_timeout`
+    seconds for the queued alerts to be written.
+    """
+
+    def __init__(self, sink, maxsize=1024, batch_size=64, block_timeout=0.0, close_timeout=5.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.close_timeout = close_timeout
+        self.emitted = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.failed = 0
+        self.batches = 0
+        self.latencies = array.array("d")
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def start(self):
+        """ Starts the consumer thread, alerts emitted before are kept queued until then """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alerts", daemon=True)
+            self._thread.start()
+        return self
+
+    def emit(self, record):
+        """ Queues `record`, returns False if it was dropped """
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.emitted += 1
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self.sink.write(batch)
+        except Exception:
+            log.exception("alert sink failed, {} alerts lost".format(len(batch)))
+            self.failed += len(batch)
+            return
+        now = time.perf_counter()
+        self.latencies.extend(now - record.created for record in batch)
+        self.delivered += len(batch)
+        self.batches += 1
+
+    def close(self):
+        """ Writes the queued alerts, then stops the consumer and closes the sink
+
+        If the sink is stuck, the consumer is left behind after `close_timeout` seconds with the sink open,
+        and the alerts still queued are counted in `dropped`.
+        """
+        if self._thread is None:
+            self.start()
+        elif not self._thread.is_alive():
+            return
+        deadline = time.perf_counter() + self.close_timeout
+        try:
+            self._queue.put(_STOP, timeout=self.close_timeout)
+        except queue.Full:
+            pass
+        self._thread.join(max(deadline - time.perf_counter(), 0.0))
+        if self._thread.is_alive():
+            queued = self._queue.qsize()
+            log.error("alert sink stuck, closing with {} alerts queued".format(queued))
+            self.dropped += queued
+            return
+        self.sink.close()
+
+    def stats(self):
+        return dict(emitted=self.emitted, dropped=self.dropped, delivered=self.delivered, failed=self.failed,
+                    batches=self.batches, latency=latency_summary(self.latencies))
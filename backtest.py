@@ -0,0 +1,146 @@
+import numpy as np
+
+from manager import TRADE_DTYPE, ValueAreaManager, VA_NULL, price_region
+
+STATES = ValueAreaManager.states
+IDLE = STATES.index("idle")
+VALUE_BUY = STATES.index("value_buy")
+VALUE_BUY_HOLD = STATES.index("value_buy_hold")
+VALUE_SELL = STATES.index("value_sell")
+VALUE_SELL_HOLD = STATES.index("value_sell_hold")
+
+
+def _dest_table(trigger):
+    """ [state index, open region * 32 + close region] -> destination state index of `trigger`, -1 if none """
+    table = np.full((len(STATES), 1024), -1, dtype=np.int8)
+    for (state, o, c), transition in ValueAreaManager._compiled[trigger].items():
+        if transition is not None:
+            table[STATES.index(state), o * 32 + c] = STATES.index(transition[0])
+    return table
+
+_NEXT = _dest_table("next")
+_FILLED = _dest_table("order_filled")
+
+
+def _next_index(mask):
+    """ For every k in 0..n, the first index >= k where `mask` is set (n if there is none) """
+    n = len(mask)
+    result = np.empty(n + 1, dtype=np.int64)
+    result[n] = n
+    result[:n] = np.minimum.accumulate(np.where(mask, np.arange(n), n)[::-1])[::-1]
+    return result
+
+
+def value_area_trades(open, high, low, close, VAL, VAH, window, closing, stop_percent=1.0):
+    """ TRADE_DTYPE array of the trades of a ValueAreaManager over the bars, without running it bar by bar
+
+    The manager is handed the bars of `window` and every position and order is closed on the bars of
+    `closing`, like ValueAreaTradingStrategy does with its session timers. Fills follow backtrader's broker:
+    orders work from the bar after they are placed, limit and stop orders fill at their price or at a
+    better (limit) / worse (stop) open, and the target is checked before the stop. Forced exits are at
+    the close of the bar.
+
+    The manager's orders only depend on its state, so instead of stepping through every bar this jumps
+    from one bar where something can happen (a transition, an order touched or a closing bar) to the next,
+    using precomputed "next such bar" indexes.
+    """
+    bars = np.flatnonzero(np.asarray(window) | np.asarray(closing))
+    o, h, l, c = (np.asarray(a, dtype=np.float64)[bars] for a in (open, high, low, close))
+    VAL = np.asarray(VAL, dtype=np.float64)[bars]
+    VAH = np.asarray(VAH, dtype=np.float64)[bars]
+    closing = np.asarray(closing)[bars]
+    n = len(bars)
+
+    va = np.where(np.isnan(VAL) | np.isnan(VAH), VA_NULL, 0)
+    keys = (price_region(VAL, VAH, o) | va) * 32 + (price_region(VAL, VAH, c) | va)
+    long_stops = VAL * (1 - stop_percent / 100)
+    short_stops = VAH * (1 + stop_percent / 100)
+
+    next_closing = _next_index(closing)
+    fill_masks = {
+        VALUE_BUY: lambda: l <= VAL,
+        VALUE_SELL: lambda: h >= VAH,
+        VALUE_BUY_HOLD: lambda: (h >= VAH) | (l <= long_stops),
+        VALUE_SELL_HOLD: lambda: (l <= VAL) | (h >= short_stops),
+    }
+    next_event = {}
+    def next_event_index(state):
+        if state not in next_event:
+            dest = _NEXT[state][keys]
+            mask = (dest != -1) & (dest != state)
+            if state in fill_masks:
+                mask |= fill_masks[state]()
+            next_event[state] = _next_index(mask)
+        return next_event[state]
+
+    trades = []
+    state = IDLE
+    side = 0
+    entry = entry_bar = target = stop = np.NaN
+    i = 0
+    while i < n:
+        j = min(next_event_index(state)[i], next_closing[i])
+        if j >= n:
+            break
+        filled = True
+        exit = None
+        if state == VALUE_BUY and l[j] <= entry:
+            entry, entry_bar, side = min(o[j], entry), j, 1
+            target, stop = VAH[j], long_stops[j]
+        elif state == VALUE_SELL and h[j] >= entry:
+            entry, entry_bar, side = max(o[j], entry), j, -1
+            target, stop = VAL[j], short_stops[j]
+        elif state == VALUE_BUY_HOLD and h[j] >= target:
+            exit = max(o[j], target)
+        elif state == VALUE_BUY_HOLD and l[j] <= stop:
+            exit = min(o[j], stop)
+        elif state == VALUE_SELL_HOLD and l[j] <= target:
+            exit = min(o[j], target)
+        elif state == VALUE_SELL_HOLD and h[j] >= stop:
+            exit = max(o[j], stop)
+        else:
+            filled = False
+        if filled:
+            dest = _FILLED[state][keys[j]]
+            state = dest if dest != -1 else state
+        if exit is not None:
+            trades.append((bars[entry_bar], bars[j], side, entry, exit, (exit - entry) * side))
+            side = 0
+
+        if closing[j]:
+            if side:
+                trades.append((bars[entry_bar], bars[j], side, entry, c[j], (c[j] - entry) * side))
+                side = 0
+            state = IDLE
+            i = j + 1
+            continue
+
+        dest = _NEXT[state][keys[j]]
+        if dest != -1 and dest != state:
+            if dest == IDLE and side:
+                # the value area went away, the position is closed
+                trades.append((bars[entry_bar], bars[j], side, entry, c[j], (c[j] - entry) * side))
+                side = 0
+            elif dest == VALUE_BUY:
+                entry = VAL[j]
+            elif dest == VALUE_SELL:
+                entry = VAH[j]
+            state = dest
+        i = j + 1
+
+    return np.array(trades, dtype=TRADE_DTYPE)
+
+
+def summarize(trades):
+    """ Trade statistics of a TRADE_DTYPE array, in the format of sweep.simulate_value_area """
+    pnls = trades["pnl"]
+    return dict(trades=len(pnls), wins=int((pnls > 0).sum()), pnl=float(pnls.sum()),
+                average=float(pnls.mean()) if len(pnls) else 0.0)
+
+
+def backtest_value_area(data, open_offset=30, close_offset=30, stop_percent=1.0):
+    """ Trade statistics of the value area strategy over a sweep.SweepData, usable as a sweep objective """
+    window, closing = data.trading_window(open_offset, close_offset)
+    trades = value_area_trades(data.open, data.high, data.low, data.close, data.VAL, data.VAH,
+                               window, closing, stop_percent=stop_percent)
+    return summarize(trades)
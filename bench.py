@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+import backtrader as bt
+
+import levels
+from alerts import AlertSink
+from datafeeds import BAR_DTYPE, BarArrayData, date2nums
+from intraday import MarketOpenTimer, OutputEventTimer
+from manager import ValueAreaManager
+from replay import SimulatedOrderClient
+from scratch import CompositeValueAreaIndicator, ValueAreaIndicator, ValueAreaStrategy
+from sessions import get_session_schedule
+from volume_profile import compute_levels
+
+log = logging.getLogger(__name__)
+
+# Scales of the synthetic data, in exchange sessions
+SCALES = OrderedDict([("1d", 1), ("1w", 5), ("1m", 21), ("1y", 252), ("10y", 2520)])
+
+FIRST_SESSION = datetime.date(2008, 1, 2)
+
+# Dependencies of the backtests and of the transitions reference machine, which the modules below must not
+# load when imported
+HEAVY_MODULES = ("backtrader", "pandas", "pandas_market_calendars", "transitions")
+
+# Import time budgets in seconds, numpy included, of the modules used by the sweep workers and live processes
+IMPORT_BUDGETS = OrderedDict([("levels", 0.5), ("manager", 0.5), ("sessions", 0.5), ("volume_profile", 0.5),
+                              ("journal", 0.5), ("sweep", 0.5)])
+
+
+def synthetic_bars(sessions, seed=0, exchange="NYSE", start=FIRST_SESSION, tick_size=0.25, price=2000.0):
+    """ BAR_DTYPE minute bars of a random walk over the first `sessions` sessions of `exchange` from `start`
+
+    Bars are stamped from each session's open to one minute before its close (exchange-local naive times,
+    like the csv feeds), so the session timers fire on them exactly. The same seed gives the same bars.
+    """
+    schedule = get_session_schedule(exchange)
+    first = start.toordinal()
+    schedule.ensure(first, first + sessions * 7 // 5 + 30)
+    i = np.searchsorted(schedule.dates, first)
+    opens = schedule.open_local[i:i + sessions].astype("datetime64[m]")
+    closes = schedule.close_local[i:i + sessions].astype("datetime64[m]")
+    if len(opens) < sessions:
+        raise ValueError("only {} sessions from {}".format(len(opens), start))
+    minutes = ((closes - opens) // np.timedelta64(1, "m")).astype(np.int64)
+    offsets = np.arange(minutes.sum()) - np.repeat(np.cumsum(minutes) - minutes, minutes)
+    times = np.repeat(opens, minutes) + offsets.astype("timedelta64[m]")
+    n = len(times)
+
+    rng = np.random.default_rng(seed)
+    close = price + np.cumsum(rng.integers(-2, 3, n)) * tick_size
+    open = np.r_[price, close[:-1]]
+    bars = np.empty(n, dtype=BAR_DTYPE)
+    bars["time"] = times
+    bars["datetime"] = date2nums(times)
+    bars["open"] = open
+    bars["close"] = close
+    bars["high"] = np.maximum(open, close) + rng.integers(0, 3, n) * tick_size
+    bars["low"] = np.minimum(open, close) - rng.integers(0, 3, n) * tick_size
+    bars["volume"] = rng.integers(100, 1000, n)
+    bars["openinterest"] = 0.0
+    return bars
+
+
+class SyntheticMarket(object):
+    """ Synthetic bars of symbols SYN0, SYN1, ... with their value areas installed in levels.VALUE_AREAS
+
+    Bars and value areas are generated once per (scale, symbol) and kept for the following benchmarks.
+    """
+
+    def __init__(self, seed=0, exchange="NYSE"):
+        self.seed = seed
+        self.exchange = exchange
+        self._bars = {}
+
+    def feeds(self, scale, symbols):
+        """ [(symbol, bars)] of `symbols` symbols over `scale`, with the value areas of these bars installed """
+        feeds = []
+        for k in range(symbols):
+            bars, symbol_levels = self.bars(scale, k)
+            levels.VALUE_AREAS[self.symbol(k)] = symbol_levels
+            feeds.append((self.symbol(k), bars))
+        return feeds
+
+    def symbol(self, k):
+        return "SYN{}".format(k)
+
+    def bars(self, scale, k):
+        """ (bars, SymbolLevels) of the k-th symbol over `scale` """
+        key = (scale, k)
+        if key not in self._bars:
+            bars = synthetic_bars(SCALES[scale], seed=self.seed + k, exchange=self.exchange, price=2000.0 + 100 * k)
+            self._bars[key] = (bars, compute_levels(bars["time"], bars["high"], bars["low"], bars["volume"],
+                                                    exchange=self.exchange))
+        return self._bars[key]
+
+
+class _TimerStrategy(bt.Strategy):
+    def __init__(self):
+        self.marketOpen = MarketOpenTimer()
+        self.openTimer = OutputEventTimer(offset=0)
+        self.closeTimer = OutputEventTimer(base="close", offset=-30)
+
+
+class _IndicatorStrategy(bt.Strategy):
+    params = (
+        ("symbol", ""),
+    )
+
+    def __init__(self):
+        self.valueArea = ValueAreaIndicator(symbol=self.p.symbol)
+
+
+class _CompositeStrategy(bt.Strategy):
+    def __init__(self):
+        self.valueArea = CompositeValueAreaIndicator()
+
+
+class _NullSink(AlertSink):
+    def write(self, records):
+        pass
+
+
+def _run_cerebro(bars, strategy, stdstats=False, **kwargs):
+    cerebro = bt.Cerebro(stdstats=stdstats)
+    cerebro.adddata(BarArrayData(bars=bars, timeframe=bt.TimeFrame.Minutes))
+    cerebro.addstrategy(strategy, **kwargs)
+    cerebro.run()
+
+
+def bench_manager(feeds):
+    """ ValueAreaManager.handleNext over every bar, value areas looked up beforehand """
+    inputs = []
+    for symbol, bars in feeds:
+        VAL, VAH = levels.VALUE_AREAS[symbol].lookup(bars["datetime"].astype(np.int64))
+        inputs.append(list(zip(VAL.tolist(), VAH.tolist(), bars["open"].tolist(), bars["close"].tolist())))
+    start = time.perf_counter()
+    for rows in inputs:
+        handle = ValueAreaManager(orderClient=SimulatedOrderClient()).handleNext
+        for row in rows:
+            handle(*row)
+    return time.perf_counter() - start
+
+
+def bench_timers(feeds):
+    """ Cerebro run of the MarketOpenTimer and open/close OutputEventTimer calendar lookups """
+    start = time.perf_counter()
+    for symbol, bars in feeds:
+        _run_cerebro(bars, _TimerStrategy)
+    return time.perf_counter() - start
+
+
+def bench_indicator(feeds):
+    """ Cerebro run of ValueAreaIndicator's value area lookups """
+    start = time.perf_counter()
+    for symbol, bars in feeds:
+        _run_cerebro(bars, _IndicatorStrategy, symbol=symbol)
+    return time.perf_counter() - start
+
+
+def bench_composite(feeds):
+    """ Cerebro run of CompositeValueAreaIndicator's prior, composite and developing value areas """
+    start = time.perf_counter()
+    for symbol, bars in feeds:
+        _run_cerebro(bars, _CompositeStrategy)
+    return time.perf_counter() - start
+
+
+def bench_strategy(feeds):
+    """ Full Cerebro run of ValueAreaStrategy, alerts discarded """
+    start = time.perf_counter()
+    for symbol, bars in feeds:
+        _run_cerebro(bars, ValueAreaStrategy, stdstats=True, symbol=symbol, alert_sink=_NullSink())
+    return time.perf_counter() - start
+
+
+BENCHMARKS = OrderedDict([
+    ("manager", bench_manager),
+    ("timers", bench_timers),
+    ("indicator", bench_indicator),
+    ("composite", bench_composite),
+    ("strategy", bench_strategy),
+])
+
+
+def run_suite(scales=("1d", "1m", "1y"), symbols=(1, 4), benchmarks=None, repeat=3, seed=0):
+    """ Runs every benchmark at every (scale, symbol count) and returns the results keyed by
+    "<benchmark>/<scale>/<symbols>", each with the best of `repeat` times """
+    market = SyntheticMarket(seed=seed)
+    results = OrderedDict()
+    for scale in scales:
+        for count in symbols:
+            feeds = market.feeds(scale, count)
+            n = sum(len(bars) for symbol, bars in feeds)
+            for name in benchmarks or BENCHMARKS:
+                times = [BENCHMARKS[name](feeds) for i in range(repeat)]
+                best = min(times)
+                key = "{}/{}/{}".format(name, scale, count)
+                results[key] = dict(benchmark=name, scale=scale, symbols=count, bars=n, seconds=best,
+                                    bars_per_s=n / best if best else np.NaN, times=times)
+                log.info("{}: {:.4f}s, {:.0f} bars/s".format(key, best, results[key]["bars_per_s"]))
+    return results
+
+
+def import_profile(module):
+    """ (seconds, heavy modules loaded) of importing `module` in a fresh interpreter, timed by -X importtime """
+    code = "import sys, {}; print(' '.join(m for m in {!r} if m in sys.modules))".format(module, HEAVY_MODULES)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    for line in process.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module and not fields[2][1:].startswith(" "):
+            return int(fields[1]) / 1e6, process.stdout.split()
+    raise ValueError("no import time reported for {}".format(module))
+
+
+def check_imports(budgets=IMPORT_BUDGETS, repeat=3):
+    """ Rows of the best import time of each module of `budgets` against its budget
+
+    `status` is "heavy" if the import loads one of HEAVY_MODULES, "slow" if it is over budget, else "ok".
+    """
+    rows = []
+    for module, budget in budgets.items():
+        profiles = [import_profile(module) for i in range(repeat)]
+        seconds = min(seconds for seconds, heavy in profiles)
+        heavy = profiles[0][1]
+        status = "heavy" if heavy else "slow" if seconds > budget else "ok"
+        rows.append(dict(module=module, seconds=seconds, budget=budget, heavy=heavy, status=status))
+    return rows
+
+
+def format_imports(rows):
+    lines = ["{:<16} {:>8} {:>8}  {}".format("module", "seconds", "budget", "status")]
+    for row in rows:
+        lines.append("{:<16} {:>8.3f} {:>8.3f}  {}{}".format(
+            row["module"], row["seconds"], row["budget"], row["status"],
+            " ({})".format(", ".join(row["heavy"])) if row["heavy"] else ""))
+    return "\n".join(lines)
+
+
+def environment():
+    return dict(python=platform.python_version(), numpy=np.__version__, backtrader=bt.__version__,
+                machine=platform.machine(), platform=platform.platform())
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(dict(created=datetime.datetime.now().isoformat(), environment=environment(),
+                       results=results), f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def compare(baseline, results, threshold=0.1):
+    """ Rows comparing the benchmarks present in both runs
+
+    `ratio` is the new time over the baseline's. A benchmark more than `threshold` slower is a "regression",
+    one faster by the same factor an "improvement".
+    """
+    rows = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before, after = baseline[key]["seconds"], result["seconds"]
+        ratio = after / before if before else np.NaN
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append(dict(key=key, baseline=before, seconds=after, ratio=ratio, status=status))
+    return rows
+
+
+def format_results(results):
+    lines = ["{:<28} {:>9} {:>10} {:>12}".format("benchmark", "bars", "seconds", "bars/s")]
+    for key, result in results.items():
+        lines.append("{:<28} {:>9} {:>10.4f} {:>12.0f}".format(key, result["bars"], result["seconds"],
+                                                                result["bars_per_s"]))
+    return "\n".join(lines)
+
+
+def format_comparison(rows):
+    lines = ["{:<28} {:>10} {:>10} {:>7}  {}".format("benchmark", "baseline", "seconds", "ratio", "status")]
+    for row in rows:
+        lines.append("{:<28} {:>10.4f} {:>10.4f} {:>7.2f}  {}".format(
+            row["key"], row["baseline"], row["seconds"], row["ratio"], row["status"]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the backtest pipeline on synthetic minute bars")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["1d", "1m", "1y"])
+    parser.add_argument("--symbols", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this json file, e.g. as a new baseline")
+    parser.add_argument("--compare", help="baseline json file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--imports", action="store_true",
+                        help="check the import times against IMPORT_BUDGETS instead of running the benchmarks")
+    args = parser.parse_args()
+
+    if args.imports:
+        rows = check_imports(repeat=args.repeat)
+        print(format_imports(rows))
+        if any(row["status"] != "ok" for row in rows):
+            sys.exit(1)
+        return
+
+    results = run_suite(scales=args.scales, symbols=args.symbols, benchmarks=args.benchmarks,
+                        repeat=args.repeat, seed=args.seed)
+    print(format_results(results))
+    if args.save:
+        save_results(args.save, results)
+    if args.compare:
+        rows = compare(load_results(args.compare), results, threshold=args.threshold)
+        print(format_comparison(rows))
+        if any(row["status"] == "regression" for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,273 @@
+import json
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+from manager import ValueAreaOrderClient
+
+log = logging.getLogger(__name__)
+
+# Requests and responses are json objects, one per line. Every request has an "id" and an "op" (a
+# ValueAreaOrderClient method name) plus "side" and "price" for the updates; the broker answers
+# {"id": ..., "ok": true/false} for each, in order.
+
+# Default seconds AsyncOrderClient.flush waits for the broker's answers
+FLUSH_TIMEOUT = 10.0
+
+
+class LoopThread(object):
+    """ An asyncio event loop running in a daemon thread """
+
+    def __init__(self, name="asyncio"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        """ Runs `coro` on the loop and waits for its result, cancelling it after `timeout` seconds """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
+
+
+class SimulatedBroker(object):
+    """ Local stand-in for a broker's order gateway
+
+    Requests are applied as soon as they arrive and answered `latency` seconds later, like a network round
+    trip, so pipelined requests overlap. The resulting orders are kept in `entry` ((side, price) or None),
+    `exit_limit` and `exit_stop` (price or None); `requests` lists every request received.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.entry = None
+        self.exit_limit = None
+        self.exit_stop = None
+        self.closed = 0 # close_all_positions requests
+        self.requests = []
+        self.port = None
+        self._server = None
+        self._writers = set()
+
+    def apply(self, request):
+        op = request["op"]
+        if op == "update_entry_order":
+            self.entry = (request["side"], request["price"])
+        elif op == "cancel_entry_order":
+            self.entry = None
+        elif op == "update_exit_limit":
+            self.exit_limit = request["price"]
+        elif op == "update_exit_stop":
+            self.exit_stop = request["price"]
+        elif op == "cancel_exit_orders":
+            self.exit_limit = None
+            self.exit_stop = None
+        elif op == "close_all_positions":
+            self.closed += 1
+        else:
+            return False
+        return True
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        self._writers.add(writer)
+        def respond(data):
+            if not writer.is_closing():
+                writer.write(data)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            self.requests.append(request)
+            ok = self.apply(request)
+            data = (json.dumps(dict(id=request["id"], ok=ok)) + "\n").encode("utf-8")
+            if self.latency:
+                loop.call_later(self.latency, respond, data)
+            else:
+                respond(data)
+        self._writers.discard(writer)
+        writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def disconnect(self):
+        """ Drops every client connection, as a gateway going down would """
+        for writer in list(self._writers):
+            writer.close()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+class AsyncOrderClient(ValueAreaOrderClient):
+    """ ValueAreaOrderClient sending the orders to a broker gateway without blocking the caller
+
+    Each call only records the request as pending for its order (the entry, the exit limit, the exit stop,
+    or both exits/the positions for the cancel/close calls) and returns. A request replacing one that is still
+    pending takes its place, so only the latest price of an order is sent (counted in `coalesced`). Pending
+    requests are written to the connection as soon as fewer than `max_in_flight` are awaiting an answer,
+    without waiting for the previous ones. Use flush() to wait until the broker has answered everything.
+    If the connection is lost, the requests left unanswered are dropped (counted in `lost`) and flush()
+    and the following calls raise ConnectionError.
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, max_in_flight=16):
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.rejected = 0
+        self.lost = 0
+        self.connected = False
+        self._thread = None
+
+    def connect(self):
+        self._thread = LoopThread(name="orders")
+        self._thread.run(self._connect())
+        return self
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._next_id = 0
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._send_loop()), asyncio.ensure_future(self._read_loop())]
+        self.connected = True
+
+    def close(self):
+        """ Sends the pending requests, if still connected, then disconnects. Requests lost with the
+        connection are only counted in `lost` """
+        if self._thread is None:
+            return
+        try:
+            if self.connected:
+                self.flush()
+        except ConnectionError:
+            pass
+        finally:
+            self._thread.run(self._close())
+            self._thread.stop()
+            self._thread = None
+
+    async def _close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._writer.close()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """ Waits until every request made so far has been answered, raises TimeoutError after `timeout`
+        seconds (None: no limit) and ConnectionError if the connection was lost """
+        self._thread.run(self._idle.wait(), timeout)
+        if not self.connected:
+            raise ConnectionError("broker connection lost, {} requests unanswered".format(self.lost))
+
+    def _submit(self, key, request, replaces=()):
+        if self._thread is None:
+            raise RuntimeError("order client is not connected")
+        if not self.connected:
+            raise ConnectionError("broker connection lost, {} requests unanswered".format(self.lost))
+        self.submitted += 1
+        self._thread.call(self._enqueue, key, request, replaces)
+
+    def _enqueue(self, key, request, replaces):
+        if not self.connected: # lost since it was submitted
+            self.lost += 1
+            return
+        for k in (key,) + replaces:
+            if self._pending.pop(k, None) is not None:
+                self.coalesced += 1
+        self._pending[key] = request
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def _send_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                await self._slots.acquire()
+                if not self._pending: # coalesced away while waiting
+                    self._slots.release()
+                    break
+                key, request = self._pending.popitem(last=False)
+                self._next_id += 1
+                request["id"] = self._next_id
+                self._in_flight[self._next_id] = request
+                self._writer.write((json.dumps(request) + "\n").encode("utf-8"))
+                self.sent += 1
+            try:
+                await self._writer.drain()
+            except OSError:
+                return # the read loop sees the connection go too
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                request = self._in_flight.pop(response["id"])
+                self._slots.release()
+                if not response["ok"]:
+                    self.rejected += 1
+                    log.error("broker rejected {}".format(request))
+                if not self._in_flight and not self._pending:
+                    self._idle.set()
+        except OSError as e:
+            log.error("broker connection failed: {}".format(e))
+        self._disconnected()
+
+    def _disconnected(self):
+        """ Drops the unanswered requests and wakes up flush() """
+        self.lost += len(self._in_flight) + len(self._pending)
+        if self.lost:
+            log.error("broker connection closed with {} requests unanswered".format(self.lost))
+        self._in_flight.clear()
+        self._pending.clear()
+        self.connected = False
+        self._tasks[0].cancel()
+        self._idle.set()
+
+    def update_entry_order(self, buyOrSell, price):
+        self._submit("entry", dict(op="update_entry_order", side=buyOrSell, price=float(price)))
+
+    def cancel_entry_order(self):
+        self._submit("entry", dict(op="cancel_entry_order"))
+
+    def update_exit_limit(self, buyOrSell, price):
+        self._submit("exit_limit", dict(op="update_exit_limit", side=buyOrSell, price=float(price)))
+
+    def update_exit_stop(self, buyOrSell, price):
+        self._submit("exit_stop", dict(op="update_exit_stop", side=buyOrSell, price=float(price)))
+
+    def cancel_exit_orders(self):
+        self._submit("exits", dict(op="cancel_exit_orders"), replaces=("exit_limit", "exit_stop"))
+
+    def close_all_positions(self):
+        self._submit("positions", dict(op="close_all_positions"))
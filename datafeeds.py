@@ -0,0 +1,170 @@
+import os
+import math
+import array
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+log = logging.getLogger(__name__)
+
+_EPOCH_ORDINAL = 719163 # datetime.date(1970, 1, 1).toordinal()
+
+# One row per bar. `time` is the naive bar time and `datetime` the same time as a backtrader date2num value
+BAR_DTYPE = np.dtype([
+    ("time", "datetime64[us]"), ("datetime", np.float64),
+    ("open", np.float64), ("high", np.float64), ("low", np.float64), ("close", np.float64),
+    ("volume", np.float64), ("openinterest", np.float64),
+])
+
+
+def _days_from_civil(year, month, day):
+    """ Days since 1970-01-01 of proleptic Gregorian dates (vectorized) """
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse_datetimes(values):
+    """ (datetime64[us] times, date2num values) of "YYYYMMDD  HH:MM:SS" strings, without per-row parsing """
+    raw = np.asarray(values, dtype="S18")
+    digits = raw.view(np.uint8).reshape(-1, 18).astype(np.int64) - ord("0")
+    if len(raw) and (np.any(raw.view(np.uint8).reshape(-1, 18)[:, [8, 9]] != ord(" ")) or
+                     np.any(raw.view(np.uint8).reshape(-1, 18)[:, [12, 15]] != ord(":"))):
+        raise ValueError("datetimes are not in the 'YYYYMMDD  HH:MM:SS' format")
+
+    def number(*columns):
+        value = np.zeros(len(raw), dtype=np.int64)
+        for c in columns:
+            value = value * 10 + digits[:, c]
+        return value
+
+    days = _days_from_civil(number(0, 1, 2, 3), number(4, 5), number(6, 7))
+    hour, minute, second = number(10, 11), number(13, 14), number(16, 17)
+    times = (days * 86400 + hour * 3600 + minute * 60 + second).astype("datetime64[s]").astype("datetime64[us]")
+    return times, _date2num(days, hour, minute, second)
+
+
+# Ordinals in [2 ** 19, 2 ** 20) (years 1436 to 2871) all have the same float spacing
+_ORDINAL_BINADE = (2 ** 19, 2 ** 20)
+
+
+def _date2num(days, hour, minute, second):
+    """ date2num values of (days since 1970-01-01, hour, minute, second) arrays """
+    # backtrader's date2num is an exactly rounded math.fsum of these terms, keep the feed bit-identical to it.
+    # With the ordinal in _ORDINAL_BINADE the rounding of the sum only depends on the time of day: it is
+    # the ordinal plus the time of day's fraction rounded at the spacing of the binade, which fsum gives for
+    # the binade's first ordinal. So fsum is only called once per distinct time of day.
+    ordinals = days + _EPOCH_ORDINAL
+    hour, minute, second = (np.asarray(a, dtype=np.int64) for a in (hour, minute, second))
+    if len(ordinals) and (ordinals.min() < _ORDINAL_BINADE[0] or ordinals.max() >= _ORDINAL_BINADE[1]):
+        terms = zip(ordinals.tolist(), (hour / 24.0).tolist(), (minute / 1440.0).tolist(),
+                    (second / 86400.0).tolist())
+        return np.fromiter(map(math.fsum, terms), dtype=np.float64, count=len(days))
+    time_of_day = (hour * 60 + minute) * 60 + second
+    fractions = np.zeros(max(86400, int(time_of_day.max()) + 1) if len(days) else 0)
+    base = float(_ORDINAL_BINADE[0])
+    for t in np.flatnonzero(np.bincount(time_of_day, minlength=len(fractions))).tolist():
+        fractions[t] = math.fsum((base, t // 3600 / 24.0, t // 60 % 60 / 1440.0, t % 60 / 86400.0)) - base
+    return ordinals.astype(np.float64) + fractions[time_of_day]
+
+
+def date2nums(times):
+    """ date2num values of a datetime64 array of naive times (whole seconds) """
+    seconds = np.asarray(times).astype("datetime64[s]").astype(np.int64)
+    days, seconds = np.divmod(seconds, 86400)
+    return _date2num(days, seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def read_csv_bars(path):
+    """ BAR_DTYPE array of an ES-style csv file (datetime,high,low,open,close,volume header) """
+    df = pd.read_csv(path, dtype={"datetime": str})
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars["time"], bars["datetime"] = parse_datetimes(df["datetime"].values)
+    for field in ("open", "high", "low", "close", "volume"):
+        bars[field] = df[field].values
+    bars["openinterest"] = df["openinterest"].values if "openinterest" in df else np.NaN
+    return bars
+
+
+def cache_path(path):
+    return path + ".npy"
+
+
+def load_bars(path, cache=True):
+    """ BAR_DTYPE array of the bars in csv file `path`
+
+    The parsed bars are saved next to the csv (see cache_path) and memory-mapped by later calls, until the
+    csv is modified again.
+    """
+    if not cache:
+        return read_csv_bars(path)
+    cached = cache_path(path)
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        return np.load(cached, mmap_mode="r")
+
+    log.info("parsing {}".format(path))
+    bars = read_csv_bars(path)
+    # a temporary file of its own, other processes may be caching the same csv
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached) or ".", prefix=os.path.basename(cached) + ".",
+                               suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, bars)
+        os.replace(tmp, cached)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return bars
+
+
+class BarArrayData(bt.feed.DataBase):
+    """ Data feed over a BAR_DTYPE array
+
+    Preloading copies every column into the line buffers at once instead of loading bar by bar, unless
+    filters or timezone conversions need the regular path.
+    """
+    params = (
+        ("bars", None),
+    )
+
+    _columns = ("datetime", "open", "high", "low", "close", "volume", "openinterest")
+
+    def start(self):
+        super(BarArrayData, self).start()
+        self._idx = 0
+
+    def _load(self):
+        if self._idx >= len(self.p.bars):
+            return False
+        row = self.p.bars[self._idx]
+        for name in self._columns:
+            getattr(self.lines, name)[0] = row[name]
+        self._idx += 1
+        return True
+
+    def preload(self):
+        if self._filters or self._ffilters or self._tzinput is not None or self._barstack:
+            return super(BarArrayData, self).preload()
+
+        bars = self.p.bars[self._idx:]
+        datetimes = bars["datetime"]
+        first = np.searchsorted(datetimes, self.fromdate, side="left")
+        last = np.searchsorted(datetimes, self.todate, side="right")
+        bars = bars[first:last]
+        for name in self._columns:
+            line = getattr(self.lines, name)
+            line.array.extend(array.array("d", np.ascontiguousarray(bars[name], dtype=np.float64).tobytes()))
+        self._idx = len(self.p.bars)
+
+        self._last()
+        self.home()
+
+
+def get_bar_data(path, **kwargs):
+    """ backtrader feed of csv file `path`, through the binary cache """
+    return BarArrayData(bars=load_bars(path), **kwargs)
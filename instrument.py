@@ -0,0 +1,244 @@
+import json
+import time
+import array
+import functools
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Instrumentation is opt-in: enable() wraps the per-bar methods of the strategies, indicators and manager
+# with timing wrappers and disable() puts the original functions back, so nothing is paid while disabled.
+
+_active = None
+
+
+def default_targets():
+    """ (class, method name) of every hot-path method timed by default """
+    import backtrader as bt
+    import intraday
+    import manager
+    import scratch
+    return [
+        (bt.Strategy, "_next"), # one call per bar in next mode
+        (bt.Strategy, "_oncepost"), # one call per bar in runonce mode
+        (intraday.StandardIntradayStrategy, "next"),
+        (scratch.ValueAreaStrategy, "next"),
+        (scratch.ValueAreaTradingStrategy, "next"),
+        (scratch.ValueAreaIndicator, "next"),
+        (scratch.ValueAreaIndicator, "once"),
+        (intraday.MarketOpenTimer, "next"),
+        (intraday.MarketOpenTimer, "once"),
+        (intraday.EventTimer, "next"),
+        (intraday.EventTimer, "once"),
+        (intraday.RangeEventTimer, "next"),
+        (intraday.RangeEventTimer, "once"),
+        (manager.ValueAreaManager, "next"),
+        (manager.ValueAreaManager, "order_filled"),
+        (manager.ValueAreaManager, "order_cancelled"),
+        (manager.ValueAreaManager, "handleNext"),
+        (manager.ValueAreaManager, "handleBatch"),
+        (manager.ValueAreaManager, "simulate"),
+    ]
+
+
+def _summary(durations):
+    values = np.frombuffer(durations, dtype=np.float64)
+    if not len(values):
+        return dict(calls=0, total=0.0, mean=np.NaN, p50=np.NaN, p90=np.NaN, p99=np.NaN, max=np.NaN)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return dict(calls=len(values), total=float(values.sum()), mean=float(values.mean()),
+                p50=float(p50), p90=float(p90), p99=float(p99), max=float(values.max()))
+
+
+class Profiler(object):
+    """ Timings of the instrumented methods, manager transition counts and bar throughput
+
+    Every call of a timed method records its start and duration. Bars are counted per backtrader
+    strategy bar ("strategy") and per bar handed to the manager's handle*/simulate methods ("manager").
+    """
+
+    def __init__(self):
+        self.starts = defaultdict(lambda: array.array("d"))
+        self.durations = defaultdict(lambda: array.array("d"))
+        self.transitions = Counter()
+        self.bars = Counter()
+        self.started = None
+        self.stopped = None
+
+    def timed(self, name, func):
+        starts, durations = self.starts[name], self.durations[name]
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                starts.append(start)
+                durations.append(clock() - start)
+        return wrapper
+
+    def counting_fire(self, func):
+        """ Wraps ValueAreaManager._fire to count the transitions taken """
+        transitions = self.transitions
+
+        @functools.wraps(func)
+        def wrapper(manager, trigger):
+            source = manager.state
+            taken = func(manager, trigger)
+            if taken:
+                transitions["{}->{}".format(source, manager.state)] += 1
+            return taken
+        return wrapper
+
+    def counting_batch(self, func):
+        """ Wraps ValueAreaManager.handleBatch to count its transitions from the states and events it returns """
+        transitions, bars = self.transitions, self.bars
+
+        @functools.wraps(func)
+        def wrapper(manager, *args, **kwargs):
+            initial = manager.states.index(manager.state)
+            result = func(manager, *args, **kwargs)
+            states = np.r_[initial, result[0]]
+            taken = states[1:] != states[:-1]
+            # self-transitions leave the state unchanged, the callbacks they run are in the event log
+            taken[result[1]["bar"]] = True
+            taken = np.flatnonzero(taken)
+            for (source, dest), count in Counter(zip(states[taken].tolist(),
+                                                     states[taken + 1].tolist())).items():
+                transitions["{}->{}".format(manager.states[source], manager.states[dest])] += count
+            bars["manager"] += len(result[0])
+            return result
+        return wrapper
+
+    def counting_bars(self, kind, func, length=None):
+        bars = self.bars
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bars[kind] += len(args[length]) if length is not None else 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.stopped or time.perf_counter()) - self.started
+
+    def throughput(self):
+        """ Bars per second of wall time while enabled, per kind of bar """
+        elapsed = self.elapsed
+        return dict((kind, count / elapsed if elapsed else np.NaN) for kind, count in self.bars.items())
+
+    def report(self):
+        return dict(
+            elapsed=self.elapsed,
+            bars=dict(self.bars),
+            throughput=self.throughput(),
+            components=dict((name, _summary(durations)) for name, durations in sorted(self.durations.items())),
+            transitions=dict(self.transitions.most_common()),
+        )
+
+    def format(self):
+        lines = ["{:<40} {:>9} {:>10} {:>10} {:>10} {:>10}".format(
+            "component", "calls", "total s", "p50 us", "p99 us", "max us")]
+        components = self.report()["components"]
+        for name, stats in sorted(components.items(), key=lambda item: -item[1]["total"]):
+            lines.append("{:<40} {:>9} {:>10.4f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                name, stats["calls"], stats["total"], stats["p50"] * 1e6, stats["p99"] * 1e6, stats["max"] * 1e6))
+        for kind, rate in sorted(self.throughput().items()):
+            lines.append("{} bars/s: {:.0f}".format(kind, rate))
+        for transition, count in self.transitions.most_common():
+            lines.append("{:<40} {:>9}".format(transition, count))
+        return "\n".join(lines)
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def chrome_trace(self):
+        """ The timed calls as complete ("X") events of the Chrome trace event format """
+        events = []
+        origin = self.started or 0.0
+        for name, starts in self.starts.items():
+            durations = self.durations[name]
+            category = name.split(".")[0]
+            for start, duration in zip(starts, durations):
+                events.append(dict(name=name, cat=category, ph="X", pid=1, tid=1,
+                                   ts=(start - origin) * 1e6, dur=duration * 1e6))
+        events.sort(key=lambda event: (event["ts"], -event["dur"]))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+_patched = [] # (class, name, original function)
+
+def _patch(cls, name, wrapper):
+    _patched.append((cls, name, cls.__dict__[name]))
+    setattr(cls, name, wrapper)
+
+
+def enable(targets=None):
+    """ Starts instrumenting `targets` (default_targets() by default) and returns the new Profiler """
+    global _active
+    import manager
+    if _active is not None:
+        disable()
+    profiler = Profiler()
+    for cls, name in targets or default_targets():
+        if name not in cls.__dict__:
+            continue
+        func = cls.__dict__[name]
+        if cls is manager.ValueAreaManager and name == "handleBatch":
+            func = profiler.counting_batch(func)
+        elif cls is manager.ValueAreaManager and name == "handleNext":
+            func = profiler.counting_bars("manager", func)
+        elif cls is manager.ValueAreaManager and name == "simulate":
+            func = profiler.counting_bars("manager", func, length=1)
+        elif name in ("_next", "_oncepost") and cls.__name__ == "Strategy":
+            func = profiler.counting_bars("strategy", func)
+        _patch(cls, name, profiler.timed("{}.{}".format(cls.__name__, name), func))
+    _patch(manager.ValueAreaManager, "_fire", profiler.counting_fire(manager.ValueAreaManager._fire))
+    profiler.started = time.perf_counter()
+    _active = profiler
+    return profiler
+
+
+def disable():
+    """ Restores the original methods, returns the profiler that was active """
+    global _active
+    while _patched:
+        cls, name, original = _patched.pop()
+        setattr(cls, name, original)
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stopped = time.perf_counter()
+    return profiler
+
+
+def active():
+    return _active
+
+
+class profile(object):
+    """ Context manager enabling the instrumentation inside the block
+
+        with instrument.profile() as profiler:
+            cerebro.run()
+        profiler.save_chrome_trace("trace.json")
+    """
+
+    def __init__(self, targets=None):
+        self.targets = targets
+
+    def __enter__(self):
+        return enable(self.targets)
+
+    def __exit__(self, *exc):
+        disable()
+        return False
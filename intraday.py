@@ -1,53 +1,74 @@
 import datetime
-import pandas as pd
+import numpy as np
 from backtrader.indicator import Indicator
 from backtrader import Strategy
 
-from pandas_market_calendars import get_calendar
+from sessions import get_session_schedule
+
+def _line_array(line):
+    """ Zero-copy float64 view of the buffer behind a line (used by the once/vectorized modes) """
+    return np.frombuffer(line.array, dtype=np.float64)
 
 class StandardIntradayStrategy(Strategy):
-    """ automatically closes all positions at end of day """
+    """ automatically closes all positions at end of day
+
+    Every data feed is traded on its own, with the hooks called with the feed. Feeds on the same exchange
+    (`exchanges[i]`, NYSE by default) share the session timers.
+    """
     params = (
         ('open_offset', 30),
         ('close_offset', 30),
+        ('exchanges', None), # exchange of each data feed
     )
 
     def __init__(self):
-        self.openTimer = OutputEventTimer(offset=self.p.open_offset)
-        self.openTimer.plotinfo.plot = False
-        self.closeTimer = OutputEventTimer(base='close', offset=-self.p.close_offset)
-        self.closeTimer.plotinfo.plot = False
+        self.timers = SessionTimers(self.datas, self.p.exchanges, open=dict(offset=self.p.open_offset),
+                                    close=dict(base='close', offset=-self.p.close_offset))
+        self.openTimer = self.timers.timer(0, 'open')
+        self.closeTimer = self.timers.timer(0, 'close')
+        self._lengths = [0] * len(self.datas)
 
-    def tobps(self, value):
-        return value / self.data0.close * 10000
+    def tobps(self, value, data=None):
+        return value / (data if data is not None else self.data0).close * 10000
 
     def nextstart(self):
-        self.order = None
+        self.orders = [None] * len(self.datas)
+        self._feeds = dict((id(data), i) for i, data in enumerate(self.datas))
         self.next()
 
     def next(self):
-        if self.order:
+        for i, data in enumerate(self.datas):
+            if len(data) == self._lengths[i]:
+                # no new bar on this feed
+                continue
+            self._lengths[i] = len(data)
+            self.next_feed(i, data)
+
+    def next_feed(self, i, data):
+        if self.orders[i]:
             # Already have pending order
             return
 
-        self.compute_factors()
+        self.compute_factors(data)
 
-        if self.openTimer.lines.event[0]:
-            self.handle_open()
+        open_event, open_phase = self.timers.state(i, data, 'open')
+        close_event, close_phase = self.timers.state(i, data, 'close')
+        if open_event:
+            self.handle_open(data)
 
-        if not self.position:
+        if not self.getposition(data):
 
-            if self.openTimer.lines.phase[0] and not self.closeTimer.lines.phase[0]:
+            if open_phase and not close_phase:
 
-                if self.check_for_entry():
-                    self.order = self.buy()
+                if self.check_for_entry(data):
+                    self.orders[i] = self.buy(data=data)
         else:
 
-            if self.closeTimer.lines.event[0]:
-                self.order = self.close()
+            if close_event:
+                self.orders[i] = self.close(data=data)
 
-            elif self.check_for_stop():
-                self.order = self.close()
+            elif self.check_for_stop(data):
+                self.orders[i] = self.close(data=data)
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
@@ -55,21 +76,21 @@ class StandardIntradayStrategy(Strategy):
             return
 
         # The order was either completed or failed in some way
-        self.order = None
+        self.orders[self._feeds[id(order.data)]] = None
 
-    def handle_open(self):
+    def handle_open(self, data):
         """ Called when the market is open """
         pass
 
-    def compute_factors(self):
+    def compute_factors(self, data):
         """ Method for calculating intermediate factors """
         pass
 
-    def check_for_entry(self):
+    def check_for_entry(self, data):
         """ True if entry signal is triggered, else False """
         return False
 
-    def check_for_stop(self):
+    def check_for_stop(self, data):
         """ True if exit signal is triggered, else False """
         return False
 
@@ -80,30 +101,44 @@ class MarketOpenTimer(Indicator):
     )
 
     def __init__(self):
-        self.calendar = get_calendar(self.p.exchange)
-        self.lastdate = datetime.date.min  # use this as a cache
+        # the schedule is shared by every timer on the same exchange
+        self.schedule = get_session_schedule(self.p.exchange)
+        self.calendar = self.schedule.calendar
 
     def convert_naive_ts(self, ts):
+        import pandas as pd
         try:
             return pd.Timestamp.tz_convert(pd.Timestamp.tz_localize(ts, 'utc'), self.calendar.tz)
         except TypeError:
             return pd.Timestamp.tz_convert(ts, self.calendar.tz)
 
-
     def next(self):
-        curdate = self.data.datetime.date()
-        if curdate > self.lastdate:
-            self.lastdate = curdate
-            curdt = curdate.isoformat()
-            schedule = self.calendar.schedule(start_date=curdt, end_date=curdt)
-            self.open_dt = self.convert_naive_ts(schedule.iloc[0, 0])
-            self.close_dt = self.convert_naive_ts(schedule.iloc[0, 1])
+        curdate = int(self.data.datetime[0])
+        self.schedule.ensure_for_data(self.data, curdate)
+        i = self.schedule.index(curdate)
+        if i < 0:
+            # exchange is closed on this date
+            self.lines.open[0] = np.NaN
+            self.lines.close[0] = np.NaN
+        else:
+            self.lines.open[0] = self.schedule.open[i]
+            self.lines.close[0] = self.schedule.close[i]
 
-        self.lines.open[0] = self.data.date2num(self.open_dt)
-        self.lines.close[0] = self.data.date2num(self.close_dt)
+    def once(self, start, end):
+        sessions = _line_array(self.data.datetime)[start:end].astype(np.int64)
+        if len(sessions):
+            self.schedule.ensure(int(sessions.min()), int(sessions.max()))
+        i = self.schedule.indices(sessions)
+        _line_array(self.lines.open)[start:end] = self.schedule.take(self.schedule.open, i)
+        _line_array(self.lines.close)[start:end] = self.schedule.take(self.schedule.close, i)
 
 
 class EventTimer(Indicator):
+    """ Fires hooks relative to an offset from the market open or close
+
+    Trigger times are precomputed per session as date2num values in the exchange's local time, so
+    each bar is a plain float comparison against the (naive, exchange-local) data feed datetime.
+    """
     params = (
         ('exchange', 'NYSE'),
         ('base', 'open'),
@@ -111,26 +146,59 @@ class EventTimer(Indicator):
     )
 
     def __init__(self):
-        self.marketTimer = MarketOpenTimer(self.data, exchange=self.p.exchange)
+        self.schedule = get_session_schedule(self.p.exchange)
+        self._session = None
+        self._trigger_dt = np.NaN
 
     def get_offset_delta(self):
         return datetime.timedelta(minutes=self.p.offset)
 
+    def get_trigger_times(self):
+        """ date2num trigger time of every session in the schedule """
+        return self.schedule.event_times(self.p.base, self.get_offset_delta())
+
+    def trigger_time(self, curdatetime):
+        """ date2num trigger time of the session of `curdatetime`, NaN if the exchange is closed """
+        session = int(curdatetime)
+        self.schedule.ensure_for_data(self.data, session)
+        i = self.schedule.index(session)
+        return self.get_trigger_times()[i] if i >= 0 else np.NaN
+
     def next(self):
-        base_value = getattr(self.marketTimer.lines, self.p.base)[0]
-        base_dt = self.marketTimer.convert_naive_ts(pd.Timestamp(self.data.num2date(base_value)))
-        trigger_dt = base_dt + self.get_offset_delta()
-        curdatetime = pd.Timestamp(self.data.datetime.datetime()).tz_localize(
-            self.marketTimer.calendar.tz)
-        if curdatetime == trigger_dt:
+        curdatetime = self.data.datetime[0]
+        session = int(curdatetime)
+        if session != self._session:
+            self._session = session
+            self.schedule.ensure_for_data(self.data, session)
+            i = self.schedule.index(session)
+            self._trigger_dt = self.get_trigger_times()[i] if i >= 0 else np.NaN
+
+        if curdatetime == self._trigger_dt:
             self.trigger_start()
 
-        elif curdatetime > trigger_dt:
+        elif curdatetime > self._trigger_dt:
             self.trigger()
 
         else:
             self.off()
 
+    def once(self, start, end):
+        curdatetime = _line_array(self.data.datetime)[start:end]
+        sessions = curdatetime.astype(np.int64)
+        if len(sessions):
+            self.schedule.ensure(int(sessions.min()), int(sessions.max()))
+        i = self.schedule.indices(sessions)
+        trigger_dt = self.schedule.take(self.get_trigger_times(), i)
+        self.once_trigger(start, end, curdatetime == trigger_dt, curdatetime >= trigger_dt)
+
+    def once_trigger(self, start, end, started, triggered):
+        """ Vectorized counterpart of the hooks. `started`/`triggered` are masks over bars start:end
+
+        `started` is set where trigger_start would have been called, `triggered` where either
+        trigger_start or trigger would have been called, every other bar is off.
+        """
+        pass
+
     def trigger_start(self):
         self.trigger()
 
@@ -159,25 +227,149 @@ class OutputEventTimer(EventTimer):
         self.lines.event[0] = self.p.off
         self.lines.phase[0] = self.p.off
 
+    def once_trigger(self, start, end, started, triggered):
+        _line_array(self.lines.event)[start:end] = np.where(started, self.p.trigger, self.p.off)
+        _line_array(self.lines.phase)[start:end] = np.where(triggered, self.p.trigger, self.p.off)
+
+class SessionTimers(object):
+    """ OutputEventTimers shared by the data feeds of a strategy which trade on the same exchange
+
+    `specs` maps a timer name to its OutputEventTimer parameters. The timers of an exchange are created
+    once, on its first feed (the exchange's clock), so adding a feed on the same exchange adds no timer
+    work. Feeds are expected to have the same bar times as their clock feed (e.g. futures bars from one
+    source); on a bar time the clock feed doesn't have, the trigger time is looked up in the schedule.
+    Must be created in the strategy's __init__, like any indicator.
+    """
+
+    def __init__(self, datas, exchanges=None, **specs):
+        self.exchanges = list(exchanges) if exchanges else ["NYSE"] * len(datas)
+        if len(self.exchanges) != len(datas):
+            raise ValueError("{} exchanges for {} data feeds".format(len(self.exchanges), len(datas)))
+        self.timers = {} # exchange -> {name: OutputEventTimer}
+        for data, exchange in zip(datas, self.exchanges):
+            if exchange not in self.timers:
+                self.timers[exchange] = dict(
+                    (name, OutputEventTimer(data, exchange=exchange, **spec)) for name, spec in specs.items())
+                for timer in self.timers[exchange].values():
+                    timer.plotinfo.plot = False
+
+    def timer(self, feed, name):
+        """ The `name` timer read by the feed at index `feed` """
+        return self.timers[self.exchanges[feed]][name]
+
+    def state(self, feed, data, name):
+        """ (event, phase) of the `name` timer on the current bar of `data`, the feed at index `feed` """
+        timer = self.timers[self.exchanges[feed]][name]
+        curdatetime = data.datetime[0]
+        if curdatetime == timer.data.datetime[0]:
+            return timer.lines.event[0], timer.lines.phase[0]
+        trigger_dt = timer.trigger_time(curdatetime)
+        if curdatetime == trigger_dt:
+            return timer.p.trigger, timer.p.trigger
+        elif curdatetime > trigger_dt:
+            return timer.p.off, timer.p.trigger
+        return timer.p.off, timer.p.off
+
 class RangeEventTimer(EventTimer):
+    """ Opening range: the high/low of the bars from the base + offset through the next `period` minutes
+
+    The lines hold the range from the end of that window until the end of the session (NaN before). The
+    range only grows while the window is open, so it is a running max/min per session (O(1) per bar) in
+    next mode and one vectorized pass per session in once mode.
+
+    Several periods can share one indicator: with_periods(5, 15, 30) creates a subclass with the lines
+    high_5, low_5, high_15, ... in addition to high and low, which then hold the first period's range.
+    """
     lines = ('high', 'low')
     params = (
         ('period', 1),
     )
     plotinfo = dict(subplot=False)
 
-    def __init__(self):
-        super(RangeEventTimer, self).__init__()
-        self.addminperiod(self.p.period)
+    _periods = None # set by with_periods, else (p.period,)
+    _classes = {}
 
-    def get_offset_delta(self):
-        return datetime.timedelta(minutes=self.p.offset + self.p.period - 1)
+    @classmethod
+    def with_periods(cls, *periods):
+        """ Subclass exposing the range of each of `periods` (in minutes) """
+        key = (cls, periods)
+        if key not in cls._classes:
+            lines = tuple(name.format(p) for p in periods for name in ('high_{}', 'low_{}'))
+            name = "{}_{}".format(cls.__name__, "_".join(str(p) for p in periods))
+            cls._classes[key] = type(cls)(name, (cls,), dict(lines=lines, _periods=periods))
+        return cls._classes[key]
 
-    def trigger_start(self):
-        self.high = max(self.data.high.get(size=self.p.period))
-        self.low = min(self.data.low.get(size=self.p.period))
-        self.trigger()
+    def __init__(self):
+        super(RangeEventTimer, self).__init__()
+        self.periods = self._periods or (self.p.period,)
+        self._ranges = None
+        # (high, low) line pairs written with each period's range. with_periods classes inherit the high/low
+        # lines (first period) and add their own after them
+        self._range_lines = [[] for _ in self.periods]
+        if self._periods:
+            for k, pairs in enumerate(self._range_lines):
+                pairs.append((self.lines[2 + 2 * k], self.lines[3 + 2 * k]))
+        self._range_lines[0].append((self.lines.high, self.lines.low))
+
+    def get_offset_delta(self, period=None):
+        return datetime.timedelta(minutes=self.p.offset + (period or self.p.period) - 1)
+
+    def get_window_times(self):
+        """ date2num start of the window and end of the window of each period, for every session """
+        start = self.schedule.event_times(self.p.base, datetime.timedelta(minutes=self.p.offset))
+        return start, [self.schedule.event_times(self.p.base, self.get_offset_delta(p)) for p in self.periods]
 
-    def trigger(self):
-        self.lines.high[0] = self.high
-        self.lines.low[0] = self.low
+    def next(self):
+        curdatetime = self.data.datetime[0]
+        session = int(curdatetime)
+        if session != self._session:
+            self._session = session
+            self.schedule.ensure_for_data(self.data, session)
+            i = self.schedule.index(session)
+            start, ends = self.get_window_times()
+            self._window_start = start[i] if i >= 0 else np.NaN
+            self._window_ends = [end[i] if i >= 0 else np.NaN for end in ends]
+            self._ranges = [[-np.inf, np.inf] for _ in self.periods]
+
+        bar_high = self.data.high[0]
+        bar_low = self.data.low[0]
+        for k, window_end in enumerate(self._window_ends):
+            extremes = self._ranges[k]
+            if self._window_start <= curdatetime <= window_end:
+                if bar_high > extremes[0]:
+                    extremes[0] = bar_high
+                if bar_low < extremes[1]:
+                    extremes[1] = bar_low
+            if curdatetime >= window_end and extremes[0] >= extremes[1]:
+                high, low = extremes
+            else:
+                high, low = np.NaN, np.NaN
+            for high_line, low_line in self._range_lines[k]:
+                high_line[0] = high
+                low_line[0] = low
+
+    def once(self, start, end):
+        # the windows may begin before `start`, the ranges are computed from the first bar
+        curdatetime = _line_array(self.data.datetime)[:end]
+        if not len(curdatetime):
+            return
+        sessions = curdatetime.astype(np.int64)
+        self.schedule.ensure(int(sessions.min()), int(sessions.max()))
+        i = self.schedule.indices(sessions)
+        window_start, window_ends = self.get_window_times()
+        window_start = self.schedule.take(window_start, i)
+
+        # sessions are contiguous runs of bars
+        firsts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+        counts = np.diff(np.r_[firsts, len(sessions)])
+        highs = _line_array(self.data.high)[:end]
+        lows = _line_array(self.data.low)[:end]
+        for k, window_end in enumerate(window_ends):
+            window_end = self.schedule.take(window_end, i)
+            inside = (curdatetime >= window_start) & (curdatetime <= window_end)
+            session_high = np.repeat(np.maximum.reduceat(np.where(inside, highs, -np.inf), firsts), counts)
+            session_low = np.repeat(np.minimum.reduceat(np.where(inside, lows, np.inf), firsts), counts)
+            valid = (curdatetime >= window_end) & (session_high >= session_low)
+            for high_line, low_line in self._range_lines[k]:
+                _line_array(high_line)[start:end] = np.where(valid, session_high, np.NaN)[start:end]
+                _line_array(low_line)[start:end] = np.where(valid, session_low, np.NaN)[start:end]
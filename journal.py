@@ -0,0 +1,162 @@
+import os
+import tempfile
+import numpy as np
+
+from manager import ValueAreaManager, ValueAreaOrderClient
+
+# Kinds of journal events
+TRANSITION = 1 # manager state change, `op` is the trigger, `source`/`dest` the state indexes
+ORDER = 2 # order client call, `op` is the method
+FILL = 3 # order executed, `side` is 1 (buy) or -1 (sell)
+ALERT = 4 # ValueAreaStrategy alert, `source`/`dest` are the open/close candle states
+
+# `op` codes are indexes into these
+TRIGGERS = ("next", "order_filled", "order_cancelled", "reset")
+ORDER_OPS = ("update_entry_order", "cancel_entry_order", "update_exit_limit", "update_exit_stop",
+             "cancel_exit_orders", "close_all_positions")
+
+# One row per event. `time` is a date2num value, unused fields are -1 for the codes, 0 for side and NaN
+JOURNAL_DTYPE = np.dtype([
+    ("time", np.float64), ("symbol", "S16"), ("kind", np.int8), ("op", np.int8),
+    ("source", np.int8), ("dest", np.int8), ("side", np.int8), ("price", np.float64), ("size", np.float64),
+])
+
+
+class Journal(object):
+    """ Events of a run recorded into JOURNAL_DTYPE arrays
+
+    Rows are written into preallocated chunks of `chunk_size` events, a new chunk being allocated when the
+    current one is full, so recording never copies what is already there. flush() writes the events to
+    `path` as a .npy file, which load_journal() memory-maps back.
+    """
+
+    def __init__(self, path=None, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._current = None
+        self._n = chunk_size # rows used in the current chunk
+
+    def record(self, time, symbol, kind, op=-1, source=-1, dest=-1, side=0, price=np.NaN, size=np.NaN):
+        if self._n == self.chunk_size:
+            self._current = np.empty(self.chunk_size, dtype=JOURNAL_DTYPE)
+            self._chunks.append(self._current)
+            self._n = 0
+        self._current[self._n] = (time, symbol, kind, op, source, dest, side, price, size)
+        self._n += 1
+
+    def __len__(self):
+        if not self._chunks:
+            return 0
+        return (len(self._chunks) - 1) * self.chunk_size + self._n
+
+    def _filled_chunks(self):
+        for chunk in self._chunks[:-1]:
+            yield chunk
+        if self._chunks:
+            yield self._current[:self._n]
+
+    def events(self):
+        """ JOURNAL_DTYPE array of every event recorded, in order """
+        if len(self._chunks) == 1:
+            return self._current[:self._n]
+        return np.concatenate(list(self._filled_chunks())) if self._chunks else np.empty(0, dtype=JOURNAL_DTYPE)
+
+    def save(self, path):
+        """ Writes the events to the .npy file `path`, chunk by chunk """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                   suffix=".tmp")
+        os.close(fd)
+        try:
+            events = np.lib.format.open_memmap(tmp, mode="w+", dtype=JOURNAL_DTYPE, shape=(len(self),))
+            start = 0
+            for chunk in self._filled_chunks():
+                events[start:start + len(chunk)] = chunk
+                start += len(chunk)
+            events.flush()
+            del events
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def flush(self):
+        """ Saves the events to `path`, if the journal has one """
+        if self.path is not None:
+            self.save(self.path)
+
+
+def load_journal(path):
+    """ Memory-mapped JOURNAL_DTYPE array of a saved journal """
+    return np.load(path, mmap_mode="r")
+
+
+class JournalOrderClient(ValueAreaOrderClient):
+    """ Records the calls made to `client` in `journal` as ORDER events, at the time returned by `clock` """
+
+    _op_index = dict((op, i) for i, op in enumerate(ORDER_OPS))
+
+    def __init__(self, client, journal, symbol, clock):
+        self.client = client
+        self.journal = journal
+        self.symbol = symbol
+        self.clock = clock
+
+    def _record(self, op, buyOrSell=None, price=np.NaN):
+        side = 1 if buyOrSell == "buy" else -1 if buyOrSell == "sell" else 0
+        self.journal.record(self.clock(), self.symbol, ORDER, op=self._op_index[op], side=side, price=price)
+
+    def update_entry_order(self, buyOrSell, price):
+        self._record("update_entry_order", buyOrSell, price)
+        self.client.update_entry_order(buyOrSell, price)
+
+    def cancel_entry_order(self):
+        self._record("cancel_entry_order")
+        self.client.cancel_entry_order()
+
+    def update_exit_limit(self, buyOrSell, price):
+        self._record("update_exit_limit", buyOrSell, price)
+        self.client.update_exit_limit(buyOrSell, price)
+
+    def update_exit_stop(self, buyOrSell, price):
+        self._record("update_exit_stop", buyOrSell, price)
+        self.client.update_exit_stop(buyOrSell, price)
+
+    def cancel_exit_orders(self):
+        self._record("cancel_exit_orders")
+        self.client.cancel_exit_orders()
+
+    def close_all_positions(self):
+        self._record("close_all_positions")
+        self.client.close_all_positions()
+
+
+class JournaledManager(ValueAreaManager):
+    """ ValueAreaManager recording its transitions in `journal` as TRANSITION events, at the time returned
+    by `clock`, resets included. The order calls of a transition are recorded before it, as they are made
+    during it """
+    __slots__ = ("journal", "symbol", "clock")
+
+    _state_index = dict((state, i) for i, state in enumerate(ValueAreaManager.states))
+    _trigger_index = dict((trigger, i) for i, trigger in enumerate(TRIGGERS))
+
+    def __init__(self, journal, symbol, clock, orderClient=None, stop_percent=1.0):
+        self.journal = journal
+        self.symbol = symbol
+        self.clock = clock
+        super(JournaledManager, self).__init__(orderClient=orderClient, stop_percent=stop_percent)
+
+    def _fire(self, trigger):
+        source = self.state
+        taken = super(JournaledManager, self)._fire(trigger)
+        if taken:
+            self.journal.record(self.clock(), self.symbol, TRANSITION, op=self._trigger_index[trigger],
+                                source=self._state_index[source], dest=self._state_index[self.state])
+        return taken
+
+    def reset(self):
+        source = getattr(self, "state", "idle") # unset when called from __init__
+        super(JournaledManager, self).reset()
+        if source != self.state:
+            self.journal.record(self.clock(), self.symbol, TRANSITION, op=self._trigger_index["reset"],
+                                source=self._state_index[source], dest=self._state_index[self.state])
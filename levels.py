@@ -1,23 +1,158 @@
+import os
+import sys
 import datetime
-from collections import OrderedDict
-
-VALUE_AREAS = {
-    "ESZ7": OrderedDict([
-        (datetime.date(year=2017, month=11, day=22), { "VAH": 2600, "VAL": 2594.5 }),
-        (datetime.date(year=2017, month=11, day=21), { "VAH": 2583.25, "VAL": 2578.25 }),
-        (datetime.date(year=2017, month=11, day=20), { "VAH": 2582.25, "VAL": 2578.25 }),
-        (datetime.date(year=2017, month=11, day=17), { "VAH": 2589.25, "VAL": 2576.75}),
-        (datetime.date(year=2017, month=11, day=16), { "VAH": 2569.25, "VAL": 2562.25}),
-        (datetime.date(year=2017, month=11, day=15), { "VAH": 2578, "VAL": 2571 }),
-        (datetime.date(year=2017, month=11, day=14), { "VAH": 2584, "VAL": 2577.5 }),
-        (datetime.date(year=2017, month=11, day=13), { "VAH": 2580.75, "VAL": 2575.25 }),
-        (datetime.date(year=2017, month=11, day=10), { "VAH": 2584, "VAL": 2572.5 }),
-        (datetime.date(year=2017, month=11, day=9), { "VAH": 2592.25, "VAL": 2584.75 }),
-        (datetime.date(year=2017, month=11, day=8), { "VAH": 2590.5, "VAL": 2583.5 }),
-        (datetime.date(year=2017, month=11, day=7), { "VAH": 2589.75, "VAL": 2584.75 }),
-        (datetime.date(year=2017, month=11, day=6), { "VAH": 2585, "VAL": 2577.5 }),
-        (datetime.date(year=2017, month=11, day=3), { "VAH": 2576, "VAL": 2568.5 }),
-        (datetime.date(year=2017, month=11, day=2), { "VAH": 2581.5, "VAL": 2574 }),
-        (datetime.date(year=2017, month=11, day=1), { "VAH": 2574.25, "VAL": 2571.25 }),
-    ]),
-}
\ No newline at end of file
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+
+# Value areas are stored as one <symbol>.npy file per contract in this directory, each a LEVEL_DTYPE
+# array sorted by date. Files are only read (memory-mapped) the first time a symbol is looked up.
+LEVELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "value_areas")
+
+LEVEL_DTYPE = np.dtype([("date", np.int64), ("VAH", np.float64), ("VAL", np.float64)])
+
+
+class SymbolLevels(Mapping):
+    """ Value areas of one symbol, as a mapping of datetime.date -> {"VAH": ..., "VAL": ...}
+
+    `levels` is a LEVEL_DTYPE array (dates as proleptic ordinals) sorted by date.
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """ Builds the levels from a {datetime.date: {"VAH": ..., "VAL": ...}} mapping """
+        levels = np.array([(d.toordinal(), v["VAH"], v["VAL"]) for d, v in mapping.items()], dtype=LEVEL_DTYPE)
+        levels.sort(order="date")
+        return cls(levels)
+
+    @property
+    def dates(self):
+        return self.levels["date"]
+
+    @property
+    def VAH(self):
+        return self.levels["VAH"]
+
+    @property
+    def VAL(self):
+        return self.levels["VAL"]
+
+    def index(self, ordinal):
+        """ Position of the levels of `ordinal`, or -1 if there are none """
+        i = np.searchsorted(self.dates, ordinal)
+        if i < len(self.levels) and self.dates[i] == ordinal:
+            return int(i)
+        return -1
+
+    def __getitem__(self, date):
+        i = self.index(date.toordinal())
+        if i < 0:
+            raise KeyError(date)
+        return {"VAH": float(self.VAH[i]), "VAL": float(self.VAL[i])}
+
+    def __contains__(self, date):
+        return self.index(date.toordinal()) >= 0
+
+    def __iter__(self):
+        return (datetime.date.fromordinal(int(d)) for d in self.dates)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def between(self, start, end):
+        """ LEVEL_DTYPE view of the levels from the dates `start` through `end` (inclusive) """
+        i = np.searchsorted(self.dates, start.toordinal(), side="left")
+        j = np.searchsorted(self.dates, end.toordinal(), side="right")
+        return self.levels[i:j]
+
+    def lookup(self, ordinals):
+        """ (VAL, VAH) arrays for an array of date ordinals, NaN where there are no levels """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        VAL = np.full(len(ordinals), np.NaN)
+        VAH = np.full(len(ordinals), np.NaN)
+        if len(self.levels):
+            i = np.searchsorted(self.dates, ordinals)
+            found = i < len(self.levels)
+            found[found] = self.dates[i[found]] == ordinals[found]
+            VAL[found] = self.VAL[i[found]]
+            VAH[found] = self.VAH[i[found]]
+        return VAL, VAH
+
+
+class LevelStore(MutableMapping):
+    """ symbol -> SymbolLevels, lazily loaded from the <symbol>.npy files of `path`
+
+    Assigning a symbol only changes this store in memory, use `save` to write it to disk.
+    """
+
+    def __init__(self, path=LEVELS_DIR):
+        self.path = path
+        self._loaded = {}
+        self._hidden = set()
+
+    def _filename(self, symbol):
+        return os.path.join(self.path, symbol + ".npy")
+
+    def _stored_symbols(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [f[:-len(".npy")] for f in os.listdir(self.path) if f.endswith(".npy")]
+
+    def __getitem__(self, symbol):
+        try:
+            return self._loaded[symbol]
+        except KeyError:
+            pass
+        if symbol in self._hidden or not os.path.exists(self._filename(symbol)):
+            raise KeyError(symbol)
+        levels = SymbolLevels(np.load(self._filename(symbol), mmap_mode="r"))
+        return self._loaded.setdefault(symbol, levels)
+
+    def __setitem__(self, symbol, levels):
+        if not isinstance(levels, SymbolLevels):
+            levels = SymbolLevels.from_mapping(levels)
+        self._hidden.discard(symbol)
+        self._loaded[symbol] = levels
+
+    def __delitem__(self, symbol):
+        if symbol not in self:
+            raise KeyError(symbol)
+        self._loaded.pop(symbol, None)
+        self._hidden.add(symbol)
+
+    def __contains__(self, symbol):
+        return symbol in self._loaded or (symbol not in self._hidden and os.path.exists(self._filename(symbol)))
+
+    def __iter__(self):
+        symbols = set(self._loaded)
+        symbols.update(s for s in self._stored_symbols() if s not in self._hidden)
+        return iter(sorted(symbols))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def save(self, symbol):
+        """ Writes the levels of `symbol` to its file """
+        levels = np.array(self[symbol].levels, dtype=LEVEL_DTYPE)
+        os.makedirs(self.path, exist_ok=True)
+        np.save(self._filename(symbol), levels)
+
+    def import_csv(self, symbol, filename):
+        """ Merges a date,VAH,VAL csv file (dates as YYYY-MM-DD) into the levels of `symbol` and saves them """
+        rows = np.genfromtxt(filename, delimiter=",", names=True, dtype=None, encoding="utf-8")
+        levels = dict(self[symbol]) if symbol in self else {}
+        for row in np.atleast_1d(rows):
+            date = datetime.datetime.strptime(str(row["date"]), "%Y-%m-%d").date()
+            levels[date] = {"VAH": float(row["VAH"]), "VAL": float(row["VAL"])}
+        self[symbol] = levels
+        self.save(symbol)
+
+
+VALUE_AREAS = LevelStore()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python levels.py SYMBOL LEVELS_CSV")
+    VALUE_AREAS.import_csv(sys.argv[1], sys.argv[2])
@@ -1,12 +1,118 @@
 import logging
 import numpy as np
-import backtrader as bt
-from transitions import Machine
-
-from levels import VALUE_AREAS
+from collections import namedtuple
 
 log = logging.getLogger(__name__)
 
+# Price region bits, describing where a price is relative to the value area
+BELOW_VAL = 1 # price < VAL
+ABOVE_VAL = 2 # price >= VAL
+BELOW_VAH = 4 # price <= VAH
+ABOVE_VAH = 8 # price > VAH
+VA_NULL = 16 # VAL or VAH is NaN
+
+class MachineError(Exception):
+    """ Raised on a trigger that the current state does not handle, formatted like transitions.MachineError """
+
+    def __init__(self, value):
+        super(MachineError, self).__init__(value)
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+def price_region(VAL, VAH, price):
+    """ Region bits of `price`. Every comparison against NaN is False, so NaN prices have no bits set """
+    return ((price < VAL) * BELOW_VAL | (price >= VAL) * ABOVE_VAL |
+            (price <= VAH) * BELOW_VAH | (price > VAH) * ABOVE_VAH)
+
+# ValueAreaManager conditions as tests on the (open region, close region) pair
+_REGION_CONDITIONS = {
+    "is_VA_null": lambda o, c: c & VA_NULL,
+    "is_candle_close_below_VAL": lambda o, c: c & BELOW_VAL,
+    "is_candle_close_above_VAL": lambda o, c: c & ABOVE_VAL,
+    "is_candle_close_below_VAH": lambda o, c: c & BELOW_VAH,
+    "is_candle_close_above_VAH": lambda o, c: c & ABOVE_VAH,
+    "is_candle_open_below_VAL": lambda o, c: o & BELOW_VAL,
+    "is_candle_open_above_VAL": lambda o, c: o & ABOVE_VAL,
+    "is_candle_open_below_VAH": lambda o, c: o & BELOW_VAH,
+    "is_candle_open_above_VAH": lambda o, c: o & ABOVE_VAH,
+}
+
+# Actions recorded in the ValueAreaManager.handleBatch event log
+ENTRY = 1 # entry order placed/updated at `price`
+EXIT = 2 # all positions and orders closed
+CANCEL = 3 # entry order cancelled
+_CALLBACK_ACTIONS = {
+    "update_entry_order": ENTRY,
+    "close_all_positions_and_orders": EXIT,
+    "cancel_entry_order": CANCEL,
+}
+EVENT_DTYPE = np.dtype([("bar", np.int64), ("action", np.int8), ("side", np.int8), ("price", np.float64)])
+
+# One row per closed trade. Bars are indexes into the simulated arrays, side is 1 (long) or -1 (short) and
+# pnl is in points
+TRADE_DTYPE = np.dtype([
+    ("entry_bar", np.int64), ("exit_bar", np.int64), ("side", np.int8),
+    ("entry", np.float64), ("exit", np.float64), ("pnl", np.float64),
+])
+
+# Everything a ValueAreaManager needs to carry on from where it was, see ValueAreaManager.snapshot
+ManagerSnapshot = namedtuple("ManagerSnapshot", ["state", "VAL", "VAH", "candle_open", "candle_close",
+                                                 "target", "stop"])
+
+def _region_pairs():
+    """ Every reachable (open region, close region) pair, with VA_NULL set on both if the VA is null """
+    prices = (0.0, 1.0, 2.0, 3.0, 4.0, np.NaN)
+    pairs = set()
+    for VAL, VAH in ((1.0, 3.0), (3.0, 1.0), (2.0, 2.0), (np.NaN, 3.0), (1.0, np.NaN), (np.NaN, np.NaN)):
+        va = VA_NULL if (np.isnan(VAH) or np.isnan(VAL)) else 0
+        for candle_open in prices:
+            for candle_close in prices:
+                pairs.add((price_region(VAL, VAH, candle_open) | va, price_region(VAL, VAH, candle_close) | va))
+    return sorted(pairs)
+
+def _compile_transitions(cls):
+    """ Compiles cls.transition_table into {trigger: {(state, open region, close region): transition}}
+
+    Each transition is a (dest, before, after) tuple with the callbacks resolved to functions, or None if
+    no transition condition holds. States which are not a source of the trigger have no entries at all.
+    """
+    compiled = {}
+    for trigger in set(t["trigger"] for t in cls.transition_table):
+        candidates = [t for t in cls.transition_table if t["trigger"] == trigger]
+        lookup = compiled[trigger] = {}
+        for state in cls.states:
+            transitions = [t for t in candidates if t["source"] in ("*", state)]
+            if not transitions:
+                continue
+            for o, c in _region_pairs():
+                lookup[(state, o, c)] = None
+                for t in transitions:
+                    if all(_REGION_CONDITIONS[name](o, c) for name in t.get("conditions", [])):
+                        before = getattr(cls, t["before"]) if "before" in t else None
+                        after = getattr(cls, t["after"]) if "after" in t else None
+                        lookup[(state, o, c)] = (t["dest"], before, after)
+                        break
+    return compiled
+
+def _callback_action(callback):
+    return _CALLBACK_ACTIONS.get(callback.__name__, 0) if callback is not None else 0
+
+def _compile_batch(cls):
+    """ Compiles the "next" transitions into lists indexed by [state index][open region * 32 + close region]
+
+    Each entry is None if no transition is taken, else (dest index, before, after, before action,
+    after action) where the actions are the event log codes of the callbacks (0 if not logged).
+    """
+    table = [[None] * 1024 for _ in cls.states]
+    for (state, o, c), transition in cls._compiled["next"].items():
+        if transition is not None:
+            dest, before, after = transition
+            table[cls.states.index(state)][o * 32 + c] = (
+                cls.states.index(dest), before, after, _callback_action(before), _callback_action(after))
+    return table
+
 class ValueAreaOrderClient(object):
 
     def update_entry_order(self, buyOrSell, price):
@@ -29,7 +135,124 @@ class ValueAreaOrderClient(object):
 
 
 
+class FillSimulator(ValueAreaOrderClient):
+    """ Broker stand-in filling a ValueAreaManager's orders from the range of the bars
+
+    Orders placed on a bar work from the next bar on. Limits fill when the bar trades through their price,
+    at the price or a better open, stops at the price or a worse open, and the exit target is checked before
+    the stop. An entry not filled after working `entry_expiry` bars (at least 1) is cancelled, None (the
+    default) never expires it.
+    When an order is placed, the bar it fills on is found with a vectorized search of the bars ahead, so
+    the bars in between cost nothing. `bar` is the index of the bar being handled.
+    """
+
+    def __init__(self, open, high, low, close, entry_expiry=None):
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        if entry_expiry is not None and entry_expiry < 1:
+            raise ValueError("entry_expiry must be at least 1 bar or None, got {}".format(entry_expiry))
+        self.entry_expiry = entry_expiry
+        self.bar = 0
+        self.entry = None # [side, price, fill bar, expiry bar]
+        self.exit_limit = None # [price, fill bar]
+        self.exit_stop = None # [price, fill bar]
+        self.position = 0
+        self.entry_price = np.NaN
+        self.entry_bar = -1
+        self._trades = []
+        self.next_event = len(self.open) # first bar on which an order fills or expires
+
+    def _first_touch(self, price, above):
+        """ First bar after the current one whose high reaches `price` (above) or low reaches it (below) """
+        n = len(self.open)
+        start = self.bar + 1
+        chunk = 64
+        while start < n:
+            end = min(start + chunk, n)
+            hits = self.high[start:end] >= price if above else self.low[start:end] <= price
+            k = int(hits.argmax())
+            if hits[k]:
+                return start + k
+            start = end
+            chunk *= 2
+        return n
+
+    def _update_next_event(self):
+        bars = [len(self.open)]
+        if self.entry is not None:
+            bars += self.entry[2:]
+        if self.exit_limit is not None:
+            bars.append(self.exit_limit[1])
+        if self.exit_stop is not None:
+            bars.append(self.exit_stop[1])
+        self.next_event = min(bars)
+
+    def update_entry_order(self, buyOrSell, price):
+        side = 1 if buyOrSell == "buy" else -1
+        expiry = self.bar + self.entry_expiry if self.entry_expiry is not None else len(self.open)
+        self.entry = [side, price, self._first_touch(price, above=side < 0), expiry]
+        self._update_next_event()
+
+    def cancel_entry_order(self):
+        self.entry = None
+        self._update_next_event()
+
+    def update_exit_limit(self, buyOrSell, price):
+        self.exit_limit = [price, self._first_touch(price, above=buyOrSell == "sell")]
+        self._update_next_event()
+
+    def update_exit_stop(self, buyOrSell, price):
+        self.exit_stop = [price, self._first_touch(price, above=buyOrSell == "buy")]
+        self._update_next_event()
+
+    def cancel_exit_orders(self):
+        self.exit_limit = None
+        self.exit_stop = None
+        self._update_next_event()
+
+    def close_all_positions(self):
+        if self.position:
+            self._close_position(self.close[self.bar])
+
+    def _close_position(self, price):
+        self._trades.append((self.entry_bar, self.bar, self.position, self.entry_price, price,
+                             (price - self.entry_price) * self.position))
+        self.position = 0
+
+    def process(self, manager):
+        """ Fills or expires the orders due on the current bar, notifying `manager` """
+        i = self.bar
+        bar_open = self.open[i]
+        if self.entry is not None and self.entry[2] == i:
+            side, price = self.entry[:2]
+            self.entry = None
+            self.position = side
+            self.entry_price = min(bar_open, price) if side > 0 else max(bar_open, price)
+            self.entry_bar = i
+            self._update_next_event()
+            manager.order_filled()
+        elif self.entry is not None and self.entry[3] == i:
+            self.cancel_entry_order()
+            manager.order_cancelled()
+        elif self.exit_limit is not None and self.exit_limit[1] == i:
+            price = self.exit_limit[0]
+            self._close_position(max(bar_open, price) if self.position > 0 else min(bar_open, price))
+            manager.order_filled()
+        elif self.exit_stop is not None and self.exit_stop[1] == i:
+            price = self.exit_stop[0]
+            self._close_position(min(bar_open, price) if self.position > 0 else max(bar_open, price))
+            manager.order_filled()
+
+    def trades(self):
+        return np.array(self._trades, dtype=TRADE_DTYPE)
+
+
 class ValueAreaManager(object):
+    # the transitions are compiled per class, an instance is only its state and order client
+    __slots__ = ("orderClient", "stop_percent", "state", "VAL", "VAH", "candle_open", "candle_close",
+                 "_cur_target", "_cur_stop")
 
     states = [
         "idle", # no orders open, no open position, no awareness of current market conditions or VA levels invalid
@@ -79,7 +302,7 @@ class ValueAreaManager(object):
         if self.orderClient:
             if self.state == "value_buy_hold":
                 self._cur_target = self.VAH
-                self._cur_stop = self.VAL * 0.99 # TODO: MAKE THE STOP CONFIGURABLE SOMEHOW
+                self._cur_stop = self.VAL * (1 - self.stop_percent / 100)
 
                 if np.isnan(self._cur_target) or np.isnan(self._cur_stop):
                     raise ValueError("Buy closing order requested with NaN VAL or VAH")
@@ -89,7 +312,7 @@ class ValueAreaManager(object):
 
             elif self.state == "value_sell_hold":
                 self._cur_target = self.VAL
-                self._cur_stop = self.VAH * 1.01 # TODO: MAKE THE STOP CONFIGURABLE SOMEHOW
+                self._cur_stop = self.VAH * (1 + self.stop_percent / 100)
 
                 if np.isnan(self._cur_target) or np.isnan(self._cur_stop):
                     raise ValueError("Sell closing order requested with NaN VAL or VAH")
@@ -116,121 +339,264 @@ class ValueAreaManager(object):
         self.candle_close = candle_close
         self.next()
 
-    def __init__(self, orderClient=None):
-        self.orderClient = orderClient
-
-        # Build the state machine
-        self.machine = Machine(model=self, states=ValueAreaManager.states, initial="idle")
-
+    def handleBatch(self, VAL, VAH, candle_open, candle_close):
+        """ Equivalent of calling handleNext on each bar of the aligned arrays, in order
+
+        Returns (states, events): the index into `states` of the state after each bar, and an EVENT_DTYPE
+        array logging the ENTRY/EXIT/CANCEL actions taken. The order client is only called if attached.
+        """
+        VAL = np.asarray(VAL, dtype=np.float64)
+        VAH = np.asarray(VAH, dtype=np.float64)
+        candle_open = np.asarray(candle_open, dtype=np.float64)
+        candle_close = np.asarray(candle_close, dtype=np.float64)
+        if not len(VAL):
+            return np.empty(0, dtype=np.int8), np.empty(0, dtype=EVENT_DTYPE)
+
+        va = np.where(np.isnan(VAL) | np.isnan(VAH), VA_NULL, 0)
+        keys = ((price_region(VAL, VAH, candle_open) | va) * 32 +
+                (price_region(VAL, VAH, candle_close) | va)).tolist()
+
+        live = self.orderClient is not None
+        table = self._batch_table
+        state = self.states.index(self.state)
+        states = []
+        events = []
+        for i, key in enumerate(keys):
+            transition = table[state][key]
+            if transition is not None:
+                dest, before, after, before_action, after_action = transition
+                if live:
+                    self.VAL, self.VAH, self.candle_open, self.candle_close = \
+                        VAL[i], VAH[i], candle_open[i], candle_close[i]
+                if before is not None:
+                    events.append(self._batch_event(i, before_action, self.states[dest], VAL[i], VAH[i]))
+                    if live:
+                        before(self)
+                state = dest
+                if after is not None:
+                    if live:
+                        self.state = self.states[dest]
+                        after(self)
+                    events.append(self._batch_event(i, after_action, self.states[dest], VAL[i], VAH[i]))
+                if live:
+                    self.state = self.states[dest]
+            states.append(state)
+
+        self.state = self.states[state]
+        self.VAL, self.VAH, self.candle_open, self.candle_close = VAL[-1], VAH[-1], candle_open[-1], candle_close[-1]
+        return np.array(states, dtype=np.int8), np.array(events, dtype=EVENT_DTYPE)
+
+    def simulate(self, VAL, VAH, candle_open, high, low, candle_close, closing=None, entry_expiry=None):
+        """ Backtests the manager over aligned bar arrays, filling its own orders with a FillSimulator
+
+        On the bars of the `closing` mask the due fills happen, then every position and order is closed at
+        the bar's close and the manager is reset instead of handling the bar. Returns (states, trades):
+        the index into `states` of the state after each bar and a TRADE_DTYPE array of the closed trades.
+        Entries are cancelled after `entry_expiry` bars, see FillSimulator.
+        """
+        VAL = np.asarray(VAL, dtype=np.float64)
+        VAH = np.asarray(VAH, dtype=np.float64)
+        candle_open = np.asarray(candle_open, dtype=np.float64)
+        candle_close = np.asarray(candle_close, dtype=np.float64)
+        closing = np.zeros(len(VAL), dtype=bool) if closing is None else np.asarray(closing, dtype=bool)
+        va = np.where(np.isnan(VAL) | np.isnan(VAH), VA_NULL, 0)
+        keys = ((price_region(VAL, VAH, candle_open) | va) * 32 +
+                (price_region(VAL, VAH, candle_close) | va)).tolist()
+        closing_bars = set(np.flatnonzero(closing).tolist())
+
+        client = FillSimulator(candle_open, high, low, candle_close, entry_expiry=entry_expiry)
+        # plain floats keep the per-transition condition checks cheap
+        bars = list(zip(VAL.tolist(), VAH.tolist(), candle_open.tolist(), candle_close.tolist()))
+        previous, self.orderClient = self.orderClient, client
+        table = self._batch_table
+        index = dict((name, i) for i, name in enumerate(self.states))
+        state = index[self.state]
+        states = []
+        try:
+            for i, key in enumerate(keys):
+                transition = table[state][key]
+                if i < client.next_event and transition is None and i not in closing_bars:
+                    states.append(state)
+                    continue
+
+                client.bar = i
+                self.VAL, self.VAH, self.candle_open, self.candle_close = bars[i]
+                if i >= client.next_event:
+                    client.process(self)
+                if i in closing_bars:
+                    self.close_all_positions_and_orders()
+                    self.reset()
+                else:
+                    self.next()
+                state = index[self.state]
+                states.append(state)
+        finally:
+            self.orderClient = previous
+        return np.array(states, dtype=np.int8), client.trades()
+
+    @staticmethod
+    def _batch_event(bar, action, dest, VAL, VAH):
+        if action == ENTRY:
+            if dest == "value_buy":
+                return (bar, action, 1, VAL)
+            return (bar, action, -1, VAH)
+        return (bar, action, 0, np.NaN)
+
+    # Transition table, in priority order: the first transition whose source matches the current state
+    # and whose conditions all hold is taken. It is compiled into a lookup table when the class is defined
+    transition_table = [
         # ----- trigger: next -----
         # from any candle - if we don't have VA data then stay flat
-        self.machine.add_transition("next", "*", "idle",
-                                    conditions=["is_VA_null"],
-                                    before="close_all_positions_and_orders")
+        dict(trigger="next", source="*", dest="idle",
+             conditions=["is_VA_null"],
+             before="close_all_positions_and_orders"),
 
         # from idle
-        self.machine.add_transition("next", "idle", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"])
-        self.machine.add_transition("next", "idle", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"])
-        self.machine.add_transition("next", "idle", "stalking_inside",
-                                    conditions=[
-                                        "is_candle_close_below_VAH", "is_candle_open_below_VAH",
-                                        "is_candle_close_above_VAL", "is_candle_open_above_VAL",
-                                    ])
-        self.machine.add_transition("next", "idle", "value_buy",
-                                    conditions=["is_candle_close_above_VAL", "is_candle_open_below_VAL"],
-                                    after="update_entry_order")
-        self.machine.add_transition("next", "idle", "value_sell",
-                                    conditions=["is_candle_close_below_VAH", "is_candle_open_above_VAH"],
-                                    after="update_entry_order")
+        dict(trigger="next", source="idle", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"]),
+        dict(trigger="next", source="idle", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"]),
+        dict(trigger="next", source="idle", dest="stalking_inside",
+             conditions=[
+                 "is_candle_close_below_VAH", "is_candle_open_below_VAH",
+                 "is_candle_close_above_VAL", "is_candle_open_above_VAL",
+             ]),
+        dict(trigger="next", source="idle", dest="value_buy",
+             conditions=["is_candle_close_above_VAL", "is_candle_open_below_VAL"],
+             after="update_entry_order"),
+        dict(trigger="next", source="idle", dest="value_sell",
+             conditions=["is_candle_close_below_VAH", "is_candle_open_above_VAH"],
+             after="update_entry_order"),
 
         # from stalking_below
-        self.machine.add_transition("next", "stalking_below", "value_buy",
-                                    conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
-                                    after="update_entry_order")
-        self.machine.add_transition("next", "stalking_below", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"])
+        dict(trigger="next", source="stalking_below", dest="value_buy",
+             conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
+             after="update_entry_order"),
+        dict(trigger="next", source="stalking_below", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"]),
 
         # from stalking_above
-        self.machine.add_transition("next", "stalking_above", "value_sell",
-                                    conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
-                                    after="update_entry_order")
-        self.machine.add_transition("next", "stalking_above", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"])
+        dict(trigger="next", source="stalking_above", dest="value_sell",
+             conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
+             after="update_entry_order"),
+        dict(trigger="next", source="stalking_above", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"]),
 
         # from stalking_inside
-        self.machine.add_transition("next", "stalking_inside", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"])
-        self.machine.add_transition("next", "stalking_inside", "stalking_above",
-                                    conditions=["is_candle_close_above VAH"])
+        dict(trigger="next", source="stalking_inside", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"]),
+        dict(trigger="next", source="stalking_inside", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"]),
 
         # from value_buy
-        self.machine.add_transition("next", "value_buy", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"],
-                                    before="cancel_entry_order")
+        dict(trigger="next", source="value_buy", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"],
+             before="cancel_entry_order"),
 
         # from value_sell
-        self.machine.add_transition("next", "value_sell", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"],
-                                    before="cancel_entry_order")
+        dict(trigger="next", source="value_sell", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"],
+             before="cancel_entry_order"),
 
         # ----- trigger: order_filled -----
         # from value_buy
-        self.machine.add_transition("order_filled", "value_buy", "value_buy_hold",
-                                    after="update_closing_orders")
+        dict(trigger="order_filled", source="value_buy", dest="value_buy_hold",
+             after="update_closing_orders"),
         # from value_sell
-        self.machine.add_transition("order_filled", "value_sell", "value_sell_hold",
-                                    after="update_closing_orders")
+        dict(trigger="order_filled", source="value_sell", dest="value_sell_hold",
+             after="update_closing_orders"),
 
         # from value_buy_hold
-        self.machine.add_transition("order_filled", "value_buy_hold", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"],
-                                    before="cancel_exit_orders")
-        self.machine.add_transition("order_filled", "value_buy_hold", "stalking_inside",
-                                    conditions=["is_candle_close_below_VAH", "is_candle_close_above_VAL"],
-                                    before="cancel_exit_orders")
-        self.machine.add_transition("order_filled", "value_buy_hold", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"],
-                                    before="cancel_exit_orders")
+        dict(trigger="order_filled", source="value_buy_hold", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"],
+             before="cancel_exit_orders"),
+        dict(trigger="order_filled", source="value_buy_hold", dest="stalking_inside",
+             conditions=["is_candle_close_below_VAH", "is_candle_close_above_VAL"],
+             before="cancel_exit_orders"),
+        dict(trigger="order_filled", source="value_buy_hold", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"],
+             before="cancel_exit_orders"),
 
         # from value_sell_hold
-        self.machine.add_transition("order_filled", "value_sell_hold", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"],
-                                    before="cancel_exit_orders")
-        self.machine.add_transition("order_filled", "value_sell_hold", "stalking_inside",
-                                    conditions=["is_candle_close_below_VAH", "is_candle_close_above_VAL"],
-                                    before="cancel_exit_orders")
-        self.machine.add_transition("order_filled", "value_sell_hold", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"],
-                                    before="cancel_exit_orders")
+        dict(trigger="order_filled", source="value_sell_hold", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"],
+             before="cancel_exit_orders"),
+        dict(trigger="order_filled", source="value_sell_hold", dest="stalking_inside",
+             conditions=["is_candle_close_below_VAH", "is_candle_close_above_VAL"],
+             before="cancel_exit_orders"),
+        dict(trigger="order_filled", source="value_sell_hold", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"],
+             before="cancel_exit_orders"),
 
         # ----- trigger: order_cancelled -----
         # from value_buy
-        self.machine.add_transition("order_cancelled", "value_buy", "stalking_below",
-                                    conditions=["is_candle_close_below_VAL"])
-        self.machine.add_transition("order_cancelled", "value_buy", "value_buy",
-                                    conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
-                                    after="update_entry_order")
+        dict(trigger="order_cancelled", source="value_buy", dest="stalking_below",
+             conditions=["is_candle_close_below_VAL"]),
+        dict(trigger="order_cancelled", source="value_buy", dest="value_buy",
+             conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
+             after="update_entry_order"),
 
         # from value_sell
-        self.machine.add_transition("order_cancelled", "value_sell", "stalking_above",
-                                    conditions=["is_candle_close_above_VAH"])
-        self.machine.add_transition("order_cancelled", "value_sell", "value_sell",
-                                    conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
-                                    after="update_entry_order")
+        dict(trigger="order_cancelled", source="value_sell", dest="stalking_above",
+             conditions=["is_candle_close_above_VAH"]),
+        dict(trigger="order_cancelled", source="value_sell", dest="value_sell",
+             conditions=["is_candle_close_above_VAL", "is_candle_close_below_VAH"],
+             after="update_entry_order"),
 
         # from value_buy_hold
-        self.machine.add_transition("order_cancelled", "value_buy_hold", "value_buy_hold",
-                                    after="update_entry_order")
+        dict(trigger="order_cancelled", source="value_buy_hold", dest="value_buy_hold",
+             after="update_entry_order"),
 
         # from value_sell_hold
-        self.machine.add_transition("order_cancelled", "value_sell_hold", "value_sell_hold",
-                                    after="update_entry_order")
+        dict(trigger="order_cancelled", source="value_sell_hold", dest="value_sell_hold",
+             after="update_entry_order"),
+    ]
+
+    def __init__(self, orderClient=None, stop_percent=1.0):
+        self.orderClient = orderClient
+        self.stop_percent = stop_percent # stop distance beyond the entry edge of the value area
 
         # Initialize state variables
         self.reset()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # recompile so that callbacks overridden by the subclass are used
+        cls._compiled = _compile_transitions(cls)
+        cls._batch_table = _compile_batch(cls)
+
+    def _fire(self, trigger):
+        VAL = self.VAL
+        VAH = self.VAH
+        va = VA_NULL if (VAH != VAH or VAL != VAL) else 0
+        key = (self.state, price_region(VAL, VAH, self.candle_open) | va,
+               price_region(VAL, VAH, self.candle_close) | va)
+        try:
+            transition = self._compiled[trigger][key]
+        except KeyError:
+            raise MachineError("Can't trigger event {} from state {}!".format(trigger, self.state))
+
+        if transition is None:
+            # no transition condition was met
+            return False
+
+        dest, before, after = transition
+        if before is not None:
+            before(self)
+        self.state = dest
+        if after is not None:
+            after(self)
+        return True
+
+    def next(self):
+        return self._fire("next")
+
+    def order_filled(self):
+        return self._fire("order_filled")
+
+    def order_cancelled(self):
+        return self._fire("order_cancelled")
+
     @property
     def current_stop(self):
         return self._cur_stop
@@ -239,6 +605,22 @@ class ValueAreaManager(object):
     def current_target(self):
         return self._cur_target
 
+    def snapshot(self):
+        """ ManagerSnapshot of the current state, to restore() this or another manager to later """
+        return ManagerSnapshot(self.state, self.VAL, self.VAH, self.candle_open, self.candle_close,
+                               self._cur_target, self._cur_stop)
+
+    def restore(self, snapshot):
+        """ Puts the manager back in the state of `snapshot`
+
+        The order client is not called: the orders of the snapshot's state are expected to be working
+        already, e.g. when resuming a live session from a checkpoint.
+        """
+        if snapshot.state not in self.states:
+            raise ValueError("invalid state '{}'.".format(snapshot.state))
+        (self.state, self.VAL, self.VAH, self.candle_open, self.candle_close,
+         self._cur_target, self._cur_stop) = snapshot
+
     def reset(self):
         self.state = "idle"
         self.VAH = np.NaN
@@ -274,3 +656,6 @@ class ValueAreaManager(object):
 
     def is_candle_open_above_VAH(self):
         return (self.candle_open > self.VAH)
+
+ValueAreaManager._compiled = _compile_transitions(ValueAreaManager)
+ValueAreaManager._batch_table = _compile_batch(ValueAreaManager)
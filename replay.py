@@ -0,0 +1,397 @@
+import time
+import array
+import queue
+import socket
+import logging
+import argparse
+import datetime
+import threading
+
+import numpy as np
+
+from alerts import latency_summary
+from levels import VALUE_AREAS
+from manager import ValueAreaManager, ValueAreaOrderClient
+from sessions import get_session_schedule
+
+log = logging.getLogger(__name__)
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_US_PER_DAY = 86400 * 10 ** 6
+
+# A tick is a (time, price, volume, sent) tuple: naive exchange-local time in microseconds since 1970-01-01,
+# and the perf_counter time at which the publisher sent it, the start of the latencies measured.
+
+
+def bar_ticks(bars, minutes=30):
+    """ Ticks (without the sent time) replaying BAR_DTYPE bars of `minutes`: the open, then the low and the
+    high (the high first on down bars), then the close, each with a quarter of the volume """
+    times = bars["time"].astype("datetime64[us]").astype(np.int64)
+    step = minutes * 60 * 10 ** 6 // 4
+    up = bars["close"] >= bars["open"]
+    prices = np.column_stack([bars["open"], np.where(up, bars["low"], bars["high"]),
+                              np.where(up, bars["high"], bars["low"]), bars["close"]])
+    tick_times = times[:, None] + np.arange(4) * step
+    volumes = np.repeat(bars["volume"][:, None] / 4, 4, axis=1)
+    return list(zip(tick_times.ravel().tolist(), prices.ravel().tolist(), volumes.ravel().tolist()))
+
+
+def synthetic_ticks(count, start="2017-11-01T09:30", interval=0.25, price=2575.0, tick_size=0.25, seed=0):
+    """ `count` ticks (without the sent time) of a random walk, one every `interval` seconds """
+    rng = np.random.default_rng(seed)
+    times = np.datetime64(start, "us").astype(np.int64) + np.arange(count) * int(interval * 10 ** 6)
+    prices = price + np.cumsum(rng.integers(-1, 2, count)) * tick_size
+    volumes = rng.integers(1, 20, count).astype(np.float64)
+    return list(zip(times.tolist(), prices.tolist(), volumes.tolist()))
+
+
+class BarAggregator(object):
+    """ Builds bars of `minutes` from ticks as they arrive
+
+    add() returns the bar completed by a tick of a later bar, as a (time, open, high, low, close, volume)
+    tuple with the time of the bar's start, or None.
+    """
+
+    def __init__(self, minutes=30):
+        self.length = minutes * 60 * 10 ** 6
+        self.start = None
+        self.open = self.high = self.low = self.close = np.NaN
+        self.volume = 0.0
+
+    def add(self, time, price, volume):
+        start = time - time % self.length
+        if start == self.start:
+            if price > self.high:
+                self.high = price
+            if price < self.low:
+                self.low = price
+            self.close = price
+            self.volume += volume
+            return None
+        bar = self.flush()
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = volume
+        return bar
+
+    def flush(self):
+        """ The bar in progress (None if there is none), which is then discarded """
+        if self.start is None:
+            return None
+        bar = (self.start, self.open, self.high, self.low, self.close, self.volume)
+        self.start = None
+        return bar
+
+
+class SimulatedOrderClient(ValueAreaOrderClient):
+    """ Keeps the latest orders requested by a ValueAreaManager, for the caller to fill (see ReplaySession) """
+
+    def __init__(self):
+        self.entry = None # (side, price)
+        self.exit_limit = None
+        self.exit_stop = None
+
+    def update_entry_order(self, buyOrSell, price):
+        self.entry = (buyOrSell, price)
+
+    def cancel_entry_order(self):
+        self.entry = None
+
+    def update_exit_limit(self, buyOrSell, price):
+        self.exit_limit = price
+
+    def update_exit_stop(self, buyOrSell, price):
+        self.exit_stop = price
+
+    def cancel_exit_orders(self):
+        self.exit_limit = None
+        self.exit_stop = None
+
+    def close_all_positions(self):
+        self.entry = None
+        self.exit_limit = None
+        self.exit_stop = None
+
+
+class LatencyOrderClient(SimulatedOrderClient):
+    """ SimulatedOrderClient recording the time from the arrival of the tick being handled (`sent`) to
+    each order update """
+
+    def __init__(self):
+        super(LatencyOrderClient, self).__init__()
+        self.sent = np.NaN
+        self.latencies = array.array("d")
+
+    def _record(self):
+        self.latencies.append(time.perf_counter() - self.sent)
+
+    def update_entry_order(self, buyOrSell, price):
+        super(LatencyOrderClient, self).update_entry_order(buyOrSell, price)
+        self._record()
+
+    def cancel_entry_order(self):
+        super(LatencyOrderClient, self).cancel_entry_order()
+        self._record()
+
+    def update_exit_limit(self, buyOrSell, price):
+        super(LatencyOrderClient, self).update_exit_limit(buyOrSell, price)
+        self._record()
+
+    def update_exit_stop(self, buyOrSell, price):
+        super(LatencyOrderClient, self).update_exit_stop(buyOrSell, price)
+        self._record()
+
+    def cancel_exit_orders(self):
+        super(LatencyOrderClient, self).cancel_exit_orders()
+        self._record()
+
+    def close_all_positions(self):
+        super(LatencyOrderClient, self).close_all_positions()
+        self._record()
+
+
+class Publisher(threading.Thread):
+    """ Sends `ticks` to `send` from a thread, paced at `speed` times their real pace (None: no pacing)
+
+    Gaps between ticks longer than `max_gap` seconds (e.g. nights and weekends) are shortened to `max_gap`.
+    """
+
+    def __init__(self, ticks, send, speed=None, max_gap=None):
+        super(Publisher, self).__init__(name="replay", daemon=True)
+        self.ticks = ticks
+        self.send = send
+        self.speed = speed
+        self.max_gap = max_gap
+
+    def run(self):
+        send, clock = self.send, time.perf_counter
+        max_gap = self.max_gap * 10 ** 6 if self.max_gap is not None else None
+        start = clock()
+        elapsed = 0 # data time since the first tick, in microseconds, without the skipped gaps
+        previous = self.ticks[0][0] if self.ticks else 0
+        for tick_time, price, volume in self.ticks:
+            gap = tick_time - previous
+            previous = tick_time
+            elapsed += min(gap, max_gap) if max_gap is not None else gap
+            if self.speed:
+                delay = start + elapsed / 10 ** 6 / self.speed - clock()
+                if delay > 0:
+                    time.sleep(delay)
+            send((tick_time, price, volume, clock()))
+        send(None)
+
+
+class QueueTransport(object):
+    """ Ticks passed through an in-process queue """
+
+    def __init__(self, maxsize=0):
+        self._queue = queue.Queue(maxsize)
+
+    def send(self, tick):
+        self._queue.put(tick)
+
+    def __iter__(self):
+        get = self._queue.get
+        while True:
+            tick = get()
+            if tick is None:
+                return
+            yield tick
+
+
+class SocketTransport(object):
+    """ Ticks sent as csv lines over a local TCP connection """
+
+    def __init__(self, host="127.0.0.1"):
+        self._server = socket.create_server((host, 0))
+        self._writer = socket.create_connection(self._server.getsockname())
+        self._writer.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader, _ = self._server.accept()
+        self._server.close()
+
+    def send(self, tick):
+        if tick is None:
+            self._writer.shutdown(socket.SHUT_WR)
+            return
+        self._writer.sendall("{},{!r},{!r},{!r}\n".format(*tick).encode("ascii"))
+
+    def __iter__(self):
+        try:
+            for line in self._reader.makefile("r", encoding="ascii"):
+                tick_time, price, volume, sent = line.split(",")
+                yield int(tick_time), float(price), float(volume), float(sent)
+        finally:
+            self._reader.close()
+            self._writer.close()
+
+
+TRANSPORTS = {"queue": QueueTransport, "socket": SocketTransport}
+
+
+class ReplaySession(object):
+    """ Drives a ValueAreaManager from ticks as a live session would
+
+    Ticks are aggregated into bars of `minutes`, and each completed bar is handed to the manager with the
+    value area of its date (from `value_areas`, a SymbolLevels, by default VALUE_AREAS[symbol]). The
+    orders are kept by a LatencyOrderClient and filled by the following ticks: the entry when a tick
+    trades at its price, the exits when a tick reaches the target or the stop. Like the other engines,
+    every position and order is closed at the close of the first bar after the `exchange` session close -
+    `close_offset` (in minutes), and the following bars of the session are not traded. A new session date
+    also closes everything, at the close of the previous session's last bar, and resets the manager.
+    """
+
+    def __init__(self, symbol, minutes=30, stop_percent=1.0, value_areas=None, close_offset=30, exchange="NYSE"):
+        self.value_areas = value_areas if value_areas is not None else VALUE_AREAS.get(symbol)
+        self.aggregator = BarAggregator(minutes)
+        self.client = LatencyOrderClient()
+        self.manager = ValueAreaManager(orderClient=self.client, stop_percent=stop_percent)
+        self.close_offset = close_offset
+        self.schedule = get_session_schedule(exchange)
+        self.bars = []
+        self.fills = [] # (time, side, price) of every fill
+        self.ticks = 0
+        self.position = 0
+        self._date = None
+        self._levels = (np.NaN, np.NaN)
+        self._closing = None # time from which the bars of the date close everything, None if never
+
+    def levels(self, ordinal):
+        """ (VAL, VAH) of the date `ordinal` """
+        if ordinal != self._date:
+            self._date = ordinal
+            i = self.value_areas.index(ordinal) if self.value_areas is not None else -1
+            self._levels = (float(self.value_areas.VAL[i]), float(self.value_areas.VAH[i])) if i >= 0 \
+                else (np.NaN, np.NaN)
+            self.schedule.ensure(ordinal)
+            i = self.schedule.index(ordinal)
+            close = self.schedule.close_local[i] - np.timedelta64(int(self.close_offset), "m") if i >= 0 else None
+            self._closing = None if close is None else int(close.astype("datetime64[us]").astype(np.int64))
+        return self._levels
+
+    def on_tick(self, tick_time, price, volume, sent):
+        self.ticks += 1
+        self.client.sent = sent
+        bar = self.aggregator.add(tick_time, price, volume)
+        if bar is not None:
+            self.on_bar(bar, new_session=tick_time // _US_PER_DAY != bar[0] // _US_PER_DAY)
+        self._fill(tick_time, price)
+
+    def on_bar(self, bar, new_session=False):
+        self.bars.append(bar)
+        VAL, VAH = self.levels(bar[0] // _US_PER_DAY + _EPOCH_ORDINAL)
+        if self._closing is not None and bar[0] >= self._closing:
+            self.close_all(bar)
+            return
+        self.manager.handleNext(VAL, VAH, bar[1], bar[4])
+        if new_session:
+            self.close_all(bar)
+
+    def close_all(self, bar):
+        """ Closes every position and order at the close of `bar`, recording the exit fill """
+        if self.position:
+            self.fills.append((bar[0] + self.aggregator.length, -self.position, bar[4]))
+            self.position = 0
+        if self.manager.state != "idle":
+            self.manager.close_all_positions_and_orders()
+            self.manager.reset()
+
+    def _fill(self, tick_time, price):
+        client = self.client
+        if client.entry is not None:
+            side, entry = client.entry
+            if (price <= entry) if side == "buy" else (price >= entry):
+                client.entry = None
+                self.position = 1 if side == "buy" else -1
+                self.fills.append((tick_time, self.position, entry))
+                self.manager.order_filled()
+        elif self.position and client.exit_limit is not None:
+            target, stop = client.exit_limit, client.exit_stop
+            # the stop may have been cancelled while the target is working
+            if self.position > 0:
+                exit = target if price >= target else stop if stop is not None and price <= stop else None
+            else:
+                exit = target if price <= target else stop if stop is not None and price >= stop else None
+            if exit is not None:
+                self.fills.append((tick_time, -self.position, exit))
+                self.position = 0
+                self.manager.order_filled()
+
+    def run(self, ticks):
+        """ Handles every tick of the iterable `ticks`, then the bar in progress when they end """
+        for tick in ticks:
+            self.on_tick(*tick)
+        bar = self.aggregator.flush()
+        if bar is not None:
+            self.on_bar(bar)
+
+    def report(self, elapsed=None):
+        return dict(ticks=self.ticks, bars=len(self.bars), fills=len(self.fills), orders=len(self.client.latencies),
+                    elapsed=elapsed, ticks_per_s=self.ticks / elapsed if elapsed else np.NaN,
+                    latency=latency_summary(self.client.latencies))
+
+
+def replay(ticks, symbol, minutes=30, speed=None, max_gap=None, transport="queue", **kwargs):
+    """ Streams `ticks` ((time, price, volume) tuples) through `transport` ("queue" or "socket") at `speed`
+    times real time (None: as fast as possible) into a ReplaySession, returns the session and its report
+
+    Without pacing the publisher runs ahead of the session, so the latencies include the time spent queued:
+    use a speed to measure the latency of a live feed, no speed for the throughput.
+    """
+    session = ReplaySession(symbol, minutes=minutes, **kwargs)
+    channel = TRANSPORTS[transport]()
+    publisher = Publisher(ticks, channel.send, speed=speed, max_gap=max_gap)
+    start = time.perf_counter()
+    publisher.start()
+    session.run(channel)
+    elapsed = time.perf_counter() - start
+    publisher.join()
+    return session, session.report(elapsed)
+
+
+def format_report(report):
+    latency = report["latency"]
+    return "\n".join([
+        "{ticks} ticks, {bars} bars, {fills} fills, {orders} order updates in {elapsed:.3f}s "
+        "({ticks_per_s:.0f} ticks/s)".format(**report),
+        "tick to order latency (us): p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}".format(
+            latency["p50"] * 1e6, latency["p90"] * 1e6, latency["p99"] * 1e6, latency["max"] * 1e6),
+    ])
+
+
+def main():
+    from datafeeds import load_bars
+    from levels import SymbolLevels
+    parser = argparse.ArgumentParser(description="Replays bars or synthetic ticks through a ValueAreaManager")
+    parser.add_argument("symbol")
+    parser.add_argument("datafile", nargs="?", help="ES.csv style bars, replayed as 4 ticks per bar")
+    parser.add_argument("--minutes", type=int, default=30, help="bar length of the data file and of the manager")
+    parser.add_argument("--synthetic", type=int, default=None, help="replay this many random walk ticks instead")
+    parser.add_argument("--value-area", type=float, nargs=2, metavar=("VAL", "VAH"),
+                        help="fixed value area for every date, instead of the stored ones")
+    parser.add_argument("--close-offset", type=int, default=30,
+                        help="minutes before the session close from which everything is closed")
+    parser.add_argument("--speed", type=float, default=None, help="times real time, as fast as possible if unset")
+    parser.add_argument("--max-gap", type=float, default=60.0,
+                        help="longest pause between ticks when paced, in seconds of data time")
+    parser.add_argument("--transport", choices=sorted(TRANSPORTS), default="queue")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ticks = synthetic_ticks(args.synthetic)
+    elif args.datafile:
+        ticks = bar_ticks(load_bars(args.datafile), minutes=args.minutes)
+    else:
+        parser.error("a data file or --synthetic is required")
+    value_areas = None
+    if args.value_area:
+        first, last = ticks[0][0] // _US_PER_DAY + _EPOCH_ORDINAL, ticks[-1][0] // _US_PER_DAY + _EPOCH_ORDINAL
+        value_areas = SymbolLevels.from_mapping(dict(
+            (datetime.date.fromordinal(d), dict(VAL=args.value_area[0], VAH=args.value_area[1]))
+            for d in range(first, last + 1)))
+    session, report = replay(ticks, args.symbol, minutes=args.minutes, speed=args.speed, max_gap=args.max_gap,
+                             transport=args.transport, value_areas=value_areas, close_offset=args.close_offset)
+    print(format_report(report))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
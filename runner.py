@@ -0,0 +1,131 @@
+import os
+import logging
+import argparse
+import datetime
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import backtrader as bt
+
+import levels
+from scratch import ValueAreaStrategy, get_csv_data
+
+log = logging.getLogger(__name__)
+
+# A single backtest: `symbol` traded over `datafile` between the dates `fromdate` and `todate` (None = unbounded)
+BacktestJob = namedtuple("BacktestJob", ["symbol", "datafile", "fromdate", "todate"])
+
+# Per-job output. `alerts` are (datetime, open_state, close_state) tuples, `trades` is the TradeAnalyzer output
+BacktestResult = namedtuple("BacktestResult", ["job", "alerts", "trades", "value"])
+
+
+def _init_worker(value_areas):
+    """ Installs the value areas shipped to the worker process, once for all the jobs it runs """
+    levels.VALUE_AREAS.update(value_areas)
+
+
+def run_job(job, strategy=ValueAreaStrategy, cash=100000.0, **kwargs):
+    """ Runs `job` in its own Cerebro and returns its BacktestResult """
+    cerebro = bt.Cerebro()
+    cerebro.broker.setcash(cash)
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=90)
+    data_kwargs = {}
+    if job.fromdate is not None:
+        data_kwargs["fromdate"] = datetime.datetime.combine(job.fromdate, datetime.time.min)
+    if job.todate is not None:
+        data_kwargs["todate"] = datetime.datetime.combine(job.todate, datetime.time.max)
+    cerebro.adddata(get_csv_data(job.datafile, **data_kwargs))
+    cerebro.addstrategy(strategy, symbol=job.symbol, **kwargs)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="trades")
+    result = cerebro.run()[0]
+    return BacktestResult(job, getattr(result, "alerts", []), dict(result.analyzers.trades.get_analysis()),
+                          cerebro.broker.getvalue())
+
+
+def split_job(job, days):
+    """ Splits `job` into consecutive jobs of `days` calendar days (the job's dates must be set) """
+    jobs = []
+    start = job.fromdate
+    while start <= job.todate:
+        end = min(start + datetime.timedelta(days=days - 1), job.todate)
+        jobs.append(job._replace(fromdate=start, todate=end))
+        start = end + datetime.timedelta(days=1)
+    return jobs
+
+
+def run_jobs(jobs, max_workers=None, **kwargs):
+    """ Runs every job in a pool of `max_workers` processes (default: one per core)
+
+    Value areas of the symbols traded are sent to each worker once when it starts. The results are
+    returned in the same order as `jobs`.
+    """
+    symbols = set(job.symbol for job in jobs)
+    value_areas = dict((s, levels.VALUE_AREAS[s]) for s in symbols if s in levels.VALUE_AREAS)
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(value_areas,)) as executor:
+        futures = [executor.submit(run_job, job, **kwargs) for job in jobs]
+        return [future.result() for future in futures]
+
+
+class BacktestReport(object):
+    """ Merges the results of several jobs, per symbol """
+
+    def __init__(self, results):
+        self.results = results
+        self.symbols = sorted(set(r.job.symbol for r in results))
+
+    def alerts(self, symbol=None):
+        """ (symbol, datetime, open_state, close_state) of every alert, in time order """
+        alerts = [(r.job.symbol,) + alert for r in self.results for alert in r.alerts
+                  if symbol is None or r.job.symbol == symbol]
+        return sorted(alerts, key=lambda alert: (alert[1], alert[0]))
+
+    def trades(self, symbol):
+        """ Total, won and lost trade counts and net pnl of `symbol` over all its jobs """
+        summary = dict(total=0, won=0, lost=0, pnl=0.0)
+        for r in self.results:
+            if r.job.symbol != symbol:
+                continue
+            summary["total"] += r.trades.get("total", {}).get("closed", 0)
+            summary["won"] += r.trades.get("won", {}).get("total", 0)
+            summary["lost"] += r.trades.get("lost", {}).get("total", 0)
+            summary["pnl"] += r.trades.get("pnl", {}).get("net", {}).get("total", 0.0)
+        return summary
+
+    def format(self):
+        lines = []
+        for symbol in self.symbols:
+            summary = self.trades(symbol)
+            lines.append("{symbol}: {alerts} alerts, {total} trades ({won} won, {lost} lost), pnl {pnl:.2f}".format(
+                symbol=symbol, alerts=len(self.alerts(symbol)), **summary))
+        return "\n".join(lines)
+
+
+def _parse_job(spec):
+    """ SYMBOL=DATAFILE[:FROMDATE:TODATE] with dates as YYYY-MM-DD """
+    symbol, rest = spec.split("=", 1)
+    parts = rest.split(":")
+    dates = [datetime.datetime.strptime(p, "%Y-%m-%d").date() if p else None for p in parts[1:3]]
+    dates += [None] * (2 - len(dates))
+    return BacktestJob(symbol, parts[0], *dates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs ValueAreaStrategy backtests in parallel")
+    parser.add_argument("jobs", nargs="+", type=_parse_job, help="SYMBOL=DATAFILE[:FROMDATE:TODATE]")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--split-days", type=int, default=None,
+                        help="split dated jobs into chunks of this many days")
+    args = parser.parse_args()
+
+    jobs = args.jobs
+    if args.split_days:
+        jobs = [chunk for job in jobs for chunk in
+                (split_job(job, args.split_days) if job.fromdate and job.todate else [job])]
+    report = BacktestReport(run_jobs(jobs, max_workers=args.workers))
+    print(report.format())
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    main()
@@ -1,110 +1,434 @@
 import backtrader as bt
-import pandas as pd
 import numpy as np
+import time
+import array
 import datetime
 import logging
 
-from intraday import OutputEventTimer
+from alerts import AlertDispatcher, AlertRecord, LogSink
+from datafeeds import get_bar_data
+from intraday import SessionTimers, _line_array
+from journal import ALERT, FILL, JournaledManager, JournalOrderClient
 from levels import VALUE_AREAS
+from manager import ValueAreaManager, ValueAreaOrderClient
+from volume_profile import CompositeProfile, SessionProfiles, StreamingProfile
 
 log = logging.getLogger(__name__)
 
+# Candle states of ValueAreaStrategy, indexes into ValueAreaStrategy.valid_states
+STATE_NONE = 0 # no value area
+STATE_INSIDE = 1 # VAL <= price <= VAH
+STATE_BELOW = 2 # price < VAL
+STATE_ABOVE = 3 # price > VAH
+
+def describe_state(state, VAL, VAH):
+    """ Text of a candle state, e.g. "above VAH (2600.0)" """
+    if state == STATE_ABOVE:
+        return "above VAH ({})".format(VAH)
+    elif state == STATE_BELOW:
+        return "below VAL ({})".format(VAL)
+    elif state == STATE_INSIDE:
+        return "inside VA ({}-{})".format(VAL, VAH)
+    return "none"
+
+def get_csv_data(dataname="ES.csv", **kwargs):
+    """ Data feed for ES-style intraday csv files ("20171023  09:30:00",high,low,open,close,volume),
+    read through the binary bar cache of datafeeds """
+    params = dict(timeframe=bt.TimeFrame.Minutes, compression=30)
+    params.update(kwargs)
+    return get_bar_data(dataname, **params)
+
+def feed_symbols(strategy):
+    """ Symbol of each data feed of a strategy: its `symbols` param, else `symbol` for a single feed and
+    the feed names (cerebro.adddata(data, name=...)) for several """
+    if strategy.p.symbols:
+        if len(strategy.p.symbols) != len(strategy.datas):
+            raise ValueError("{} symbols for {} data feeds".format(len(strategy.p.symbols), len(strategy.datas)))
+        return list(strategy.p.symbols)
+    if len(strategy.datas) == 1:
+        return [strategy.p.symbol]
+    return [data._name for data in strategy.datas]
+
+def data_clock(data):
+    """ Function returning the date2num time of the current bar of `data` """
+    return lambda: data.datetime[0]
+
 class ValueAreaIndicator(bt.Indicator):
+    """ VAH/VAL of the symbol's value area for the date of each bar, NaN where there is none
+
+    The levels are looked up once per session in next(), and for the whole feed with a single
+    searchsorted join of the bar dates in once() (runonce mode).
+    """
     lines = ("high", "low")
     params = (
         ("symbol", ""),
     )
 
-    def next(self):
+    def __init__(self):
+        self._session = None
+        self._VAL = self._VAH = np.NaN
+
+    def lookup(self, sessions):
+        """ (VAL, VAH) arrays for an array of session ordinals """
         try:
             levelHistory = VALUE_AREAS[self.p.symbol]
         except KeyError:
-            self.lines.high[0] = np.NaN
-            self.lines.low[0] = np.NaN
-            return
+            return np.full(len(sessions), np.NaN), np.full(len(sessions), np.NaN)
+        return levelHistory.lookup(sessions)
 
-        curdate = self.data.datetime.date()
-        try:
-            levels = levelHistory[curdate]
-        except KeyError:
-            self.lines.high[0] = np.NaN
-            self.lines.low[0] = np.NaN
-            return
+    def next(self):
+        # the integer part of the naive date2num datetime is the date's ordinal
+        session = int(self.data.datetime[0])
+        if session != self._session:
+            self._session = session
+            (self._VAL,), (self._VAH,) = self.lookup([session])
+        self.lines.high[0] = self._VAH
+        self.lines.low[0] = self._VAL
 
-        self.lines.high[0] = levels["VAH"]
-        self.lines.low[0] = levels["VAL"]
+    def once(self, start, end):
+        VAL, VAH = self.lookup(_line_array(self.data.datetime)[start:end].astype(np.int64))
+        _line_array(self.lines.high)[start:end] = VAH
+        _line_array(self.lines.low)[start:end] = VAL
+
+class CompositeValueAreaIndicator(bt.Indicator):
+    """ Value areas of the feed's own volume: the prior session's, the `short` and `long` session composites
+    ending on the prior session and the developing value area of the current session up to the bar
+
+    The composites are rolling sums of the session histograms (see volume_profile.CompositeProfile), so every
+    line set comes from one pass over the bars. Sessions are the calendar dates of the bars, and the lines
+    are NaN until the first session is complete.
+    """
+    lines = ("prior_high", "prior_low", "short_high", "short_low", "long_high", "long_low",
+             "developing_high", "developing_low")
+    params = (
+        ("short", 2), # sessions in the short composite
+        ("long", 5), # sessions in the long composite
+        ("tick_size", 0.25),
+        ("value_area", 0.7),
+    )
+    plotinfo = dict(subplot=False)
+
+    def __init__(self):
+        self._windows = (("prior", 1), ("short", self.p.short), ("long", self.p.long))
+        self._composites = [CompositeProfile(days, tick_size=self.p.tick_size, value_area=self.p.value_area)
+                            for name, days in self._windows]
+        self._composite_lines = [(getattr(self.lines, name + "_high"), getattr(self.lines, name + "_low"))
+                                 for name, days in self._windows]
+        self._composite_levels = [(np.NaN, np.NaN)] * len(self._windows)
+        self._developing = StreamingProfile(tick_size=self.p.tick_size, value_area=self.p.value_area)
+        self._session = None
+
+    def next(self):
+        session = int(self.data.datetime[0])
+        if session != self._session:
+            if self._session is not None:
+                prices, volumes = self._developing.profile()
+                for composite in self._composites:
+                    composite.add_profile(prices, volumes)
+                self._composite_levels = [(composite.VAH, composite.VAL) for composite in self._composites]
+            self._developing.reset()
+            self._session = session
+        self._developing.add_bar(self.data.high[0], self.data.low[0], self.data.volume[0])
+
+        for (high, low), (VAH, VAL) in zip(self._composite_lines, self._composite_levels):
+            high[0] = VAH
+            low[0] = VAL
+        self.lines.developing_high[0] = self._developing.VAH
+        self.lines.developing_low[0] = self._developing.VAL
+
+    def once(self, start, end):
+        # the histograms are built from every bar so far, as once() may start in the middle of a session
+        sessions = _line_array(self.data.datetime)[:end].astype(np.int64)
+        high, low, volume = (_line_array(line)[:end] for line in (self.data.high, self.data.low, self.data.volume))
+        profiles = SessionProfiles(sessions, high, low, volume, tick_size=self.p.tick_size)
+        previous = np.searchsorted(profiles.sessions, sessions[start:end]) - 1
+        for (name, days), (high_line, low_line) in zip(self._windows, self._composite_lines):
+            areas = profiles.composite_value_areas(days, self.p.value_area)
+            for field, line in (("VAH", high_line), ("VAL", low_line)):
+                _line_array(line)[start:end] = np.where(previous >= 0, areas[field][np.maximum(previous, 0)],
+                                                        np.NaN)
+
+        if start == end:
+            return
+        developing = StreamingProfile(tick_size=self.p.tick_size, value_area=self.p.value_area)
+        developing_high = _line_array(self.lines.developing_high)
+        developing_low = _line_array(self.lines.developing_low)
+        first = int(np.searchsorted(sessions, sessions[start]))
+        for i in range(first, end):
+            if i > first and sessions[i] != sessions[i - 1]:
+                developing.reset()
+            developing.add_bar(high[i], low[i], volume[i])
+            if i >= start:
+                developing_high[i] = developing.VAH
+                developing_low[i] = developing.VAL
 
 class ValueAreaStrategy(bt.Strategy):
+    """ Alerts when a bar of any data feed opens and closes in different value area states
+
+    Each feed has its own ValueAreaIndicator, for its symbol (see feed_symbols). Feeds on the same exchange
+    (`exchanges[i]`, NYSE by default) share the session timers.
+    """
     params = (
         ('close_offset', 30),
         ("symbol", ""),
+        ("symbols", None), # symbol of each data feed
+        ("exchanges", None), # exchange of each data feed
+        ("alert_sink", None), # AlertSink the alerts are sent to, logged by default
+        ("measure_latency", False), # record the time spent in next() for each bar in bar_latency
+        ("journal", None), # journal.Journal the alerts are also recorded in, flushed when the run stops
     )
 
     valid_states = ["none", "inside", "below", "above"]
 
-    # TODO: Add price to alert
-    _CANDLE_ALERT_MSG = "{symbol} trade opportunity @ {date} {time}: {open_state} -> {close_state}"
-
     def __init__(self):
         super(ValueAreaStrategy, self).__init__()
-        self.openTimer = OutputEventTimer(offset=0)
-        self.closeTimer = OutputEventTimer(base="close", offset=-self.p.close_offset)
-        self.valueArea = ValueAreaIndicator(symbol=self.p.symbol, subplot=False)
-        self._last_state = "none"
+        self.symbols = feed_symbols(self)
+        self.timers = SessionTimers(self.datas, self.p.exchanges, open=dict(offset=0),
+                                    close=dict(base="close", offset=-self.p.close_offset))
+        self.valueAreas = [ValueAreaIndicator(data, symbol=symbol, subplot=False)
+                           for data, symbol in zip(self.datas, self.symbols)]
+        # the first feed's, for single feed use
+        self.openTimer = self.timers.timer(0, "open")
+        self.closeTimer = self.timers.timer(0, "close")
+        self.valueArea = self.valueAreas[0]
+        self._last_states = [STATE_NONE] * len(self.datas)
+        self._lengths = [0] * len(self.datas)
+        self.feed_alerts = [[] for data in self.datas] # (datetime, open_state, close_state) of every alert emitted
+        self.alert_dispatcher = AlertDispatcher(self.p.alert_sink or LogSink(log))
+        self.bar_latency = array.array("d")
+        # open and close state of every bar, see state_history
+        self._open_states = [array.array("b") for data in self.datas]
+        self._close_states = [array.array("b") for data in self.datas]
 
-    def base(self, state):
-        return state.split( )[0]
+    @property
+    def alerts(self):
+        """ Alerts of the first feed, see feed_alerts """
+        return self.feed_alerts[0]
 
     @property
     def last_state(self):
-        return self._last_state
+        return self._last_states[0]
 
     @last_state.setter
     def last_state(self, value):
-        state = self.base(value)
-        if not state in self.valid_states:
+        if not 0 <= value < len(self.valid_states):
             raise ValueError("invalid state '{}'.".format(value))
-        self._last_state = value
+        self._last_states[0] = value
 
-    def nextstart(self):
-        self.order = None
-        self.next()
+    def state_history(self, feed=0):
+        """ (open states, close states) int8 arrays with one entry per bar of the feed """
+        return (np.frombuffer(self._open_states[feed], dtype=np.int8),
+                np.frombuffer(self._close_states[feed], dtype=np.int8))
 
-    def _get_state(self, source="close"):
-        if pd.isnull(self.valueArea.lines.high[0]) or pd.isnull(self.valueArea.lines.low[0]):
-            return "none"
-        else:
-            hi = self.valueArea.lines.high[0]
-            lo = self.valueArea.lines.low[0]
-            cur = getattr(self.data, source)[0]
-            if cur > hi:
-                rv = "above VAH ({})".format(hi)
-            elif cur < lo:
-                rv = "below VAL ({})".format(lo)
-            else:
-                rv = "inside VA ({}-{})".format(lo, hi)
-            return rv
-
-    def manage_current_trade(self):
+    def _get_state(self, source="close", feed=0):
+        valueArea = self.valueAreas[feed]
+        hi = valueArea.lines.high[0]
+        lo = valueArea.lines.low[0]
+        if hi != hi or lo != lo:
+            return STATE_NONE
+        cur = getattr(self.datas[feed], source)[0]
+        if cur > hi:
+            return STATE_ABOVE
+        elif cur < lo:
+            return STATE_BELOW
+        return STATE_INSIDE
+
+    def manage_current_trade(self, feed=0):
         pass
 
     def next(self):
-        if self.openTimer.lines.event[0] == True:
+        start = time.perf_counter()
+        for i, data in enumerate(self.datas):
+            if len(data) == self._lengths[i]:
+                # no new bar on this feed
+                continue
+            self._lengths[i] = len(data)
+            self._next_feed(i, data, start)
+        if self.p.measure_latency:
+            self.bar_latency.append(time.perf_counter() - start)
+
+    def _next_feed(self, i, data, start):
+        if self.timers.state(i, data, "open")[0] == True:
             # It's a new day! Reset the "last" status
-            self.last_state = "none"
+            self._last_states[i] = STATE_NONE
 
-        state = self._get_state()
-        open_state = self._get_state(source="open")
-        if self.base(state) == self.base(open_state):
-            self.manage_current_trade()
+        state = self._get_state(feed=i)
+        open_state = self._get_state(source="open", feed=i)
+        self._open_states[i].append(open_state)
+        self._close_states[i].append(state)
+        if state == open_state:
+            self.manage_current_trade(i)
         else:
-            msg = self._CANDLE_ALERT_MSG.format(
-                symbol=self.p.symbol, open_state=open_state, close_state=state,
-                date=self.data.datetime.date(), time=self.data.datetime.time(),
-            )
-            log.warning(msg)
+            # the state descriptions are only needed for the alert
+            valueArea = self.valueAreas[i]
+            VAL, VAH = valueArea.lines.low[0], valueArea.lines.high[0]
+            open_text, close_text = describe_state(open_state, VAL, VAH), describe_state(state, VAL, VAH)
+            dt = data.datetime.datetime()
+            self.alert_dispatcher.emit(AlertRecord(self.symbols[i], dt, open_text, close_text, start))
+            self.feed_alerts[i].append((dt, open_text, close_text))
+            if self.p.journal is not None:
+                self.p.journal.record(data.datetime[0], self.symbols[i], ALERT, source=open_state, dest=state,
+                                      price=data.close[0])
+
+        self._last_states[i] = state
+
+    def start(self):
+        # the consumer thread only runs with the strategy, not for every strategy instance created
+        self.alert_dispatcher.start()
+
+    def stop(self):
+        self.alert_dispatcher.close()
+        if self.p.journal is not None:
+            self.p.journal.flush()
+
+class BacktraderOrderClient(ValueAreaOrderClient):
+    """ Places the orders of a ValueAreaManager with a strategy's broker, on `data` (the first feed by default) """
+
+    def __init__(self, strategy, data=None):
+        self.strategy = strategy
+        self.data = data if data is not None else strategy.data
+        self.entry = None
+        self.exit_limit = None
+        self.exit_stop = None
+
+    def _order(self, buyOrSell, **kwargs):
+        return (self.strategy.buy if buyOrSell == "buy" else self.strategy.sell)(data=self.data, **kwargs)
+
+    def update_entry_order(self, buyOrSell, price):
+        self.cancel_entry_order()
+        self.entry = self._order(buyOrSell, exectype=bt.Order.Limit, price=price)
+
+    def cancel_entry_order(self):
+        if self.entry is not None:
+            self.strategy.cancel(self.entry)
+            self.entry = None
+
+    def update_exit_limit(self, buyOrSell, price):
+        if self.exit_limit is not None:
+            self.strategy.cancel(self.exit_limit)
+        self.exit_limit = self._order(buyOrSell, exectype=bt.Order.Limit, price=price,
+                                      size=abs(self.strategy.getposition(self.data).size), oco=self.exit_stop)
+
+    def update_exit_stop(self, buyOrSell, price):
+        if self.exit_stop is not None:
+            self.strategy.cancel(self.exit_stop)
+        self.exit_stop = self._order(buyOrSell, exectype=bt.Order.Stop, price=price,
+                                     size=abs(self.strategy.getposition(self.data).size), oco=self.exit_limit)
+
+    def cancel_exit_orders(self):
+        for order in (self.exit_limit, self.exit_stop):
+            if order is not None:
+                self.strategy.cancel(order)
+        self.exit_limit = None
+        self.exit_stop = None
+
+    def close_all_positions(self):
+        self.strategy.close(data=self.data)
+
+    def is_managed(self, order):
+        return order in (self.entry, self.exit_limit, self.exit_stop)
+
+class ValueAreaTradingStrategy(bt.Strategy):
+    """ Trades the value area with a ValueAreaManager between the open + open_offset and the close -
+    close_offset, when every position and order is closed at the bar's close
+
+    Every data feed is traded with its own ValueAreaIndicator, order client and manager (see
+    ValueAreaStrategy for the symbols and exchanges of the feeds). With `value_area` set to "prior",
+    "short", "long" or "developing", the levels are instead that line set of a CompositeValueAreaIndicator
+    of the feed.
+    """
+    params = (
+        ("symbol", ""),
+        ("symbols", None), # symbol of each data feed
+        ("exchanges", None), # exchange of each data feed
+        ("open_offset", 30),
+        ("close_offset", 30),
+        ("stop_percent", 1.0),
+        ("journal", None), # journal.Journal of the transitions, orders and fills, flushed when the run stops
+        ("value_area", None), # CompositeValueAreaIndicator line set traded instead of the symbol's levels
+    )
+
+    def __init__(self):
+        super(ValueAreaTradingStrategy, self).__init__()
+        self.symbols = feed_symbols(self)
+        self.timers = SessionTimers(self.datas, self.p.exchanges, open=dict(offset=self.p.open_offset),
+                                    close=dict(base="close", offset=-self.p.close_offset))
+        if self.p.value_area is None:
+            self.valueAreas = [ValueAreaIndicator(data, symbol=symbol, subplot=False)
+                               for data, symbol in zip(self.datas, self.symbols)]
+            self._levels = [(valueArea.lines.low, valueArea.lines.high) for valueArea in self.valueAreas]
+        else:
+            self.valueAreas = [CompositeValueAreaIndicator(data) for data in self.datas]
+            self._levels = [(getattr(valueArea.lines, self.p.value_area + "_low"),
+                             getattr(valueArea.lines, self.p.value_area + "_high")) for valueArea in self.valueAreas]
+        self.clients = [BacktraderOrderClient(self, data) for data in self.datas]
+        self.managers = [self._create_manager(data, symbol, client)
+                         for data, symbol, client in zip(self.datas, self.symbols, self.clients)]
+        # the first feed's, for single feed use
+        self.openTimer = self.timers.timer(0, "open")
+        self.closeTimer = self.timers.timer(0, "close")
+        self.valueArea, self.client, self.manager = self.valueAreas[0], self.clients[0], self.managers[0]
+        self._feeds = dict((id(data), i) for i, data in enumerate(self.datas))
+        self._lengths = [0] * len(self.datas)
+        self.feed_fills = [[] for data in self.datas] # (datetime, size, price) of every order executed
+
+    @property
+    def fills(self):
+        """ Fills of the first feed, see feed_fills """
+        return self.feed_fills[0]
+
+    def _create_manager(self, data, symbol, client):
+        journal = self.p.journal
+        if journal is None:
+            return ValueAreaManager(orderClient=client, stop_percent=self.p.stop_percent)
+        clock = data_clock(data)
+        return JournaledManager(journal, symbol, clock, orderClient=JournalOrderClient(client, journal, symbol, clock),
+                                stop_percent=self.p.stop_percent)
+
+    def start(self):
+        # the end of day exit is a market order, filled at the close of the bar it is placed on
+        self.broker.set_coc(True)
+
+    def _update_manager(self, i):
+        manager, (low, high), data = self.managers[i], self._levels[i], self.datas[i]
+        manager.VAL = low[0]
+        manager.VAH = high[0]
+        manager.candle_open = data.open[0]
+        manager.candle_close = data.close[0]
+
+    def notify_order(self, order):
+        if order.status != order.Completed:
+            return
+        i = self._feeds[id(order.data)]
+        self.feed_fills[i].append((order.data.datetime.datetime(), order.executed.size, order.executed.price))
+        if self.p.journal is not None:
+            self.p.journal.record(order.data.datetime[0], self.symbols[i], FILL, side=1 if order.isbuy() else -1,
+                                  price=order.executed.price, size=order.executed.size)
+        client = self.clients[i]
+        if client.is_managed(order):
+            if order is client.entry:
+                client.entry = None
+            self._update_manager(i)
+            self.managers[i].order_filled()
+
+    def next(self):
+        for i, data in enumerate(self.datas):
+            if len(data) == self._lengths[i]:
+                # no new bar on this feed
+                continue
+            self._lengths[i] = len(data)
+            manager = self.managers[i]
+            if self.timers.state(i, data, "close")[1]:
+                if self.getposition(data) or manager.state != "idle":
+                    manager.close_all_positions_and_orders()
+                    manager.reset()
+            elif self.timers.state(i, data, "open")[1]:
+                self._update_manager(i)
+                manager.next()
 
-        self.last_state = state
+    def stop(self):
+        if self.p.journal is not None:
+            self.p.journal.flush()
 
 def main():
     # Create a cerebro entity
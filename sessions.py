@@ -0,0 +1,155 @@
+import os
+import datetime
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Number of days loaded past the requested session when the full extent of the
+# data is not known (e.g. live feeds which are not preloaded)
+LOOKAHEAD_DAYS = 365
+
+_schedules = {}
+_cache_dir = None
+
+
+def set_session_cache_dir(path):
+    """ Enables saving/loading of session schedules to/from `path`. None disables the disk cache. """
+    global _cache_dir
+    _cache_dir = path
+
+
+def get_session_schedule(exchange):
+    """ Returns the SessionSchedule shared by every timer on `exchange` """
+    try:
+        return _schedules[exchange]
+    except KeyError:
+        return _schedules.setdefault(exchange, SessionSchedule(exchange))
+
+
+def _to_num(values):
+    """ date2num of every element of a datetime64 array (NaT -> NaN) """
+    from backtrader.utils import date2num
+    return np.array([np.NaN if np.isnat(v) else date2num(v.astype(datetime.datetime)) for v in values],
+                    dtype=np.float64)
+
+
+class SessionSchedule(object):
+    """ Open/close times of every session of an exchange over a date range
+
+    The schedule is computed with a single `calendar.schedule` call and kept as arrays indexed by the
+    session date (as a proleptic ordinal, which is also the integer part of a naive date2num value).
+    `open`/`close` are date2num values in UTC, `open_local`/`close_local` are naive exchange-local
+    datetime64 values.
+    """
+
+    def __init__(self, exchange):
+        # imported on first use, so that importing the sessions does not load pandas_market_calendars
+        from pandas_market_calendars import get_calendar
+        self.exchange = exchange
+        self.calendar = get_calendar(exchange)
+        self.dates = np.empty(0, dtype=np.int64)
+        self.open_local = np.empty(0, dtype="datetime64[s]")
+        self.close_local = np.empty(0, dtype="datetime64[s]")
+        self.open = np.empty(0, dtype=np.float64)
+        self.close = np.empty(0, dtype=np.float64)
+        self.start = None
+        self.end = None
+        self._event_times = {}
+
+    def covers(self, ordinal):
+        return self.start is not None and self.start <= ordinal <= self.end
+
+    def ensure(self, first, last=None):
+        """ Makes sure sessions from ordinal `first` through `last` are loaded """
+        if last is None:
+            last = first
+        if self.covers(first) and self.covers(last):
+            return
+        if self.start is not None:
+            first = min(first, self.start)
+            last = max(last, self.end)
+        self.load(datetime.date.fromordinal(first), datetime.date.fromordinal(last))
+
+    def ensure_for_data(self, data, ordinal):
+        """ Makes sure the session on `ordinal` is loaded, together with the rest of `data` if preloaded """
+        if self.covers(ordinal):
+            return
+        last = ordinal + LOOKAHEAD_DAYS
+        if len(data.datetime.array):
+            last = max(last, int(data.datetime.array[-1]))
+        self.ensure(ordinal, last)
+
+    def _cache_path(self, start, end):
+        filename = "{}_{}_{}.npz".format(self.exchange, start.isoformat(), end.isoformat())
+        return os.path.join(_cache_dir, filename)
+
+    def load(self, start, end):
+        """ Replaces the schedule with the sessions between the dates `start` and `end` (inclusive) """
+        path = self._cache_path(start, end) if _cache_dir else None
+        if path and os.path.exists(path):
+            with np.load(path) as cached:
+                dates, open_local, close_local = cached["dates"], cached["open_local"], cached["close_local"]
+                open_utc, close_utc = cached["open_utc"], cached["close_utc"]
+        else:
+            log.debug("computing {} schedule {} - {}".format(self.exchange, start, end))
+            schedule = self.calendar.schedule(start_date=start.isoformat(), end_date=end.isoformat())
+            opens = schedule["market_open"]
+            closes = schedule["market_close"]
+            if opens.dt.tz is None:
+                opens = opens.dt.tz_localize("utc")
+                closes = closes.dt.tz_localize("utc")
+            dates = np.array([d.toordinal() for d in schedule.index], dtype=np.int64)
+            open_utc = opens.dt.tz_convert(None).values.astype("datetime64[s]")
+            close_utc = closes.dt.tz_convert(None).values.astype("datetime64[s]")
+            open_local = opens.dt.tz_convert(self.calendar.tz).dt.tz_localize(None).values.astype("datetime64[s]")
+            close_local = closes.dt.tz_convert(self.calendar.tz).dt.tz_localize(None).values.astype("datetime64[s]")
+            if path:
+                os.makedirs(_cache_dir, exist_ok=True)
+                np.savez(path, dates=dates, open_local=open_local, close_local=close_local,
+                         open_utc=open_utc, close_utc=close_utc)
+
+        self.dates = dates
+        self.open_local = open_local
+        self.close_local = close_local
+        self.open = _to_num(open_utc)
+        self.close = _to_num(close_utc)
+        self.start = start.toordinal()
+        self.end = end.toordinal()
+        self._event_times = {}
+
+    def index(self, ordinal):
+        """ Index of the session on `ordinal`, or -1 if the exchange is closed that day """
+        i = np.searchsorted(self.dates, ordinal)
+        if i < len(self.dates) and self.dates[i] == ordinal:
+            return int(i)
+        return -1
+
+    def indices(self, ordinals):
+        """ Vectorized `index` over an array of ordinals """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        if not len(self.dates):
+            return np.full(len(ordinals), -1, dtype=np.int64)
+        i = np.searchsorted(self.dates, ordinals)
+        found = self.dates[np.minimum(i, len(self.dates) - 1)] == ordinals
+        return np.where(found, i, -1)
+
+    def take(self, values, indices):
+        """ values[indices] with NaN wherever the index is -1 """
+        out = np.full(len(indices), np.NaN)
+        found = indices >= 0
+        out[found] = values[indices[found]]
+        return out
+
+    def event_times(self, base, delta):
+        """ date2num values of the naive exchange-local time `delta` after each session's `base`
+
+        `base` is either 'open' or 'close'. The result is computed once per (base, delta) and compares
+        exactly against the date2num values of a naive exchange-local data feed.
+        """
+        key = (base, delta)
+        try:
+            return self._event_times[key]
+        except KeyError:
+            local = getattr(self, base + "_local")
+            return self._event_times.setdefault(key, _to_num(local + np.timedelta64(delta)))
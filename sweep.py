@@ -0,0 +1,181 @@
+import bisect
+import random
+import datetime
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from backtest import backtest_value_area, summarize
+from levels import VALUE_AREAS
+from manager import ValueAreaManager
+from sessions import get_session_schedule
+
+log = logging.getLogger(__name__)
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class SweepData(object):
+    """ A data feed preprocessed once for every parameter combination of a sweep
+
+    Bar times are naive exchange-local datetime64[s]. Each bar carries the open/close of its session
+    (NaT if the exchange is closed) and the value area of its date (NaN if unknown).
+    """
+
+    def __init__(self, dt, open, high, low, close, symbol, exchange="NYSE"):
+        self.symbol = symbol
+        self.exchange = exchange
+        self.dt = np.asarray(dt, dtype="datetime64[s]")
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+
+        self.session = self.dt.astype("datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+        schedule = get_session_schedule(exchange)
+        if len(self.session):
+            schedule.ensure(int(self.session.min()), int(self.session.max()))
+        i = schedule.indices(self.session)
+        found = i >= 0
+        self.session_open = np.where(found, schedule.open_local[i], np.datetime64("NaT"))
+        self.session_close = np.where(found, schedule.close_local[i], np.datetime64("NaT"))
+
+        if symbol in VALUE_AREAS:
+            self.VAL, self.VAH = VALUE_AREAS[symbol].lookup(self.session)
+        else:
+            self.VAL = np.full(len(self.dt), np.NaN)
+            self.VAH = np.full(len(self.dt), np.NaN)
+
+    @classmethod
+    def from_csv(cls, path, symbol, exchange="NYSE"):
+        """ Loads an ES-style intraday csv file """
+        from datafeeds import load_bars
+        bars = load_bars(path)
+        return cls(bars["time"], bars["open"], bars["high"], bars["low"], bars["close"], symbol, exchange=exchange)
+
+    def __len__(self):
+        return len(self.dt)
+
+    def trading_window(self, open_offset, close_offset):
+        """ Masks of the bars inside [open + open_offset, close - close_offset) and of the bars after it """
+        after_open = self.dt >= self.session_open + np.timedelta64(int(open_offset), "m")
+        closing = self.dt >= self.session_close - np.timedelta64(int(close_offset), "m")
+        return after_open & ~closing, closing
+
+
+def simulate_value_area(data, open_offset=30, close_offset=30, stop_percent=1.0):
+    """ Trades `data` bar by bar with a ValueAreaManager and returns the trade statistics (prices in points)
+
+    The orders are filled by the manager's FillSimulator (see ValueAreaManager.simulate), and every
+    position and order is closed on the first bar after session close - `close_offset`. The results are
+    the same as backtest.backtest_value_area's, which skips the bars where nothing can happen.
+    """
+    window, closing = data.trading_window(open_offset, close_offset)
+    bars = np.flatnonzero(window | closing)
+    manager = ValueAreaManager(stop_percent=stop_percent)
+    states, trades = manager.simulate(data.VAL[bars], data.VAH[bars], data.open[bars], data.high[bars],
+                                      data.low[bars], data.close[bars], closing=closing[bars])
+    return summarize(trades)
+
+
+def grid(**axes):
+    """ Every combination of the values of each parameter, as a list of dicts """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names))]
+
+
+def random_search(count, seed=None, **axes):
+    """ `count` random combinations. Each axis is a list of choices or a (low, high) tuple of floats """
+    rng = random.Random(seed)
+    names = sorted(axes)
+    def sample(axis):
+        return rng.uniform(*axis) if isinstance(axis, tuple) else rng.choice(axis)
+    return [dict((n, sample(axes[n])) for n in names) for _ in range(count)]
+
+
+class SweepTable(object):
+    """ Results of a sweep, kept ranked by `rank_by` (highest first) as they arrive """
+
+    def __init__(self, rank_by="pnl"):
+        self.rank_by = rank_by
+        self._keys = []
+        self.rows = []
+
+    def add(self, params, result):
+        key = -result[self.rank_by]
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self.rows.insert(i, (params, result))
+        return i
+
+    def top(self, n=10):
+        return self.rows[:n]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def format(self, n=10):
+        lines = []
+        for rank, (params, result) in enumerate(self.top(n), 1):
+            lines.append("{:>4} {} -> {}".format(
+                rank, " ".join("{}={}".format(k, v) for k, v in sorted(params.items())),
+                " ".join("{}={:.4g}".format(k, v) for k, v in sorted(result.items()))))
+        return "\n".join(lines)
+
+
+_data = None
+
+def _init_worker(data):
+    """ Installs the sweep data in the worker process, once for every combination it evaluates """
+    global _data
+    _data = data
+
+def _evaluate(evaluate, params):
+    return evaluate(_data, **params)
+
+
+def run_sweep(data, params, evaluate=simulate_value_area, max_workers=None, rank_by="pnl", on_result=None):
+    """ Evaluates `evaluate(data, **p)` for every p in `params` across worker processes
+
+    `data` is sent to each worker once. Results stream into the returned SweepTable as they complete,
+    `on_result(params, result, rank)` is called for each.
+    """
+    table = SweepTable(rank_by=rank_by)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(data,)) as executor:
+        futures = dict((executor.submit(_evaluate, evaluate, p), p) for p in params)
+        for future in as_completed(futures):
+            rank = table.add(futures[future], future.result())
+            if on_result:
+                on_result(futures[future], future.result(), rank)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweeps the value area strategy parameters")
+    parser.add_argument("datafile")
+    parser.add_argument("symbol")
+    parser.add_argument("--open-offset", type=int, nargs="+", default=[0, 15, 30, 60])
+    parser.add_argument("--close-offset", type=int, nargs="+", default=[15, 30, 60])
+    parser.add_argument("--stop-percent", type=float, nargs="+", default=[0.25, 0.5, 1.0, 2.0])
+    parser.add_argument("--random", type=int, default=None,
+                        help="evaluate this many random combinations instead of the whole grid")
+    parser.add_argument("--engine", choices=["vectorized", "manager"], default="vectorized",
+                        help="backtest.backtest_value_area or the bar by bar simulate_value_area, which give "
+                             "the same results")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    axes = dict(open_offset=args.open_offset, close_offset=args.close_offset, stop_percent=args.stop_percent)
+    params = random_search(args.random, **axes) if args.random else grid(**axes)
+    data = SweepData.from_csv(args.datafile, args.symbol)
+    evaluate = backtest_value_area if args.engine == "vectorized" else simulate_value_area
+    table = run_sweep(data, params, evaluate=evaluate, max_workers=args.workers)
+    print(table.format(args.top))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    main()
@@ -0,0 +1,113 @@
+import io
+import json
+import time
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import backtrader as bt
+
+from alerts import AlertDispatcher, AlertRecord, AlertSink, FileSink, StreamSink, WebhookSink
+from scratch import ValueAreaStrategy, get_csv_data
+
+def make_record(minute=0):
+    dt = datetime.datetime(2017, 11, 1, 16, minute)
+    return AlertRecord("ESZ7", dt, "above VAH (2574.25)", "inside VA (2571.25-2574.25)", time.perf_counter())
+
+class BlockingSink(AlertSink):
+    def __init__(self):
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, records):
+        self.entered.set()
+        self.release.wait()
+        self.batches.append(list(records))
+
+def test_alertMessage():
+    assert make_record().message() == \
+        "ESZ7 trade opportunity @ 2017-11-01 16:00:00: above VAH (2574.25) -> inside VA (2571.25-2574.25)"
+
+def test_dispatcherDropsWhenFull():
+    sink = BlockingSink()
+    dispatcher = AlertDispatcher(sink, maxsize=4, batch_size=3).start()
+    # the first alert is held by the blocked sink, then 4 fit in the queue
+    assert dispatcher.emit(make_record(0))
+    assert sink.entered.wait(5)
+    results = [dispatcher.emit(make_record(i)) for i in range(1, 10)]
+    assert results == [True] * 4 + [False] * 5
+    assert (dispatcher.emitted, dispatcher.dropped) == (5, 5)
+
+    sink.release.set()
+    dispatcher.close()
+    delivered = [r for batch in sink.batches for r in batch]
+    assert [r.datetime.minute for r in delivered] == list(range(dispatcher.emitted))
+    assert all(len(batch) <= 3 for batch in sink.batches)
+    stats = dispatcher.stats()
+    assert stats["delivered"] == dispatcher.emitted and stats["failed"] == 0
+    assert stats["latency"]["count"] == dispatcher.emitted
+
+def test_dispatcherCloseStuckSink():
+    sink = BlockingSink()
+    threads = threading.active_count()
+    dispatcher = AlertDispatcher(sink, maxsize=2, close_timeout=0.2)
+    # no consumer thread until started
+    assert threading.active_count() == threads
+    dispatcher.start()
+    dispatcher.emit(make_record(0))
+    assert sink.entered.wait(5)
+    assert dispatcher.emit(make_record(1)) and dispatcher.emit(make_record(2))
+    start = time.perf_counter()
+    dispatcher.close()
+    assert time.perf_counter() - start < 2.0
+    assert dispatcher.dropped == 2
+    sink.release.set()
+
+def test_fileAndStreamSinks(tmpdir):
+    path = str(tmpdir.join("alerts.jsonl"))
+    stream = io.StringIO()
+    for sink in (FileSink(path), StreamSink(stream)):
+        dispatcher = AlertDispatcher(sink).start()
+        dispatcher.emit(make_record(0))
+        dispatcher.emit(make_record(30))
+        dispatcher.close()
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["datetime"] for row in rows] == ["2017-11-01T16:00:00", "2017-11-01T16:30:00"]
+    assert stream.getvalue().splitlines() == [make_record(0).message(), make_record(30).message()]
+
+def test_webhookSink():
+    received = []
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.extend(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        dispatcher = AlertDispatcher(WebhookSink("http://127.0.0.1:{}/".format(server.server_port))).start()
+        for i in range(5):
+            dispatcher.emit(make_record(i))
+        dispatcher.close()
+    finally:
+        server.shutdown()
+    assert [row["datetime"][-5:] for row in received] == ["00:00", "01:00", "02:00", "03:00", "04:00"]
+    assert dispatcher.delivered == 5
+
+def test_strategyAlertSink():
+    stream = io.StringIO()
+    cerebro = bt.Cerebro()
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(ValueAreaStrategy, symbol="ESZ7", alert_sink=StreamSink(stream), measure_latency=True)
+    strategy = cerebro.run()[0]
+    assert len(strategy.alerts) > 0
+    expected = [AlertRecord("ESZ7", dt, o, c, 0).message() for dt, o, c in strategy.alerts]
+    assert stream.getvalue().splitlines() == expected
+    assert strategy.alert_dispatcher.delivered == len(strategy.alerts)
+    assert len(strategy.bar_latency) == len(strategy.state_history()[0])
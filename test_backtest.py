@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+import backtrader as bt
+
+from backtest import TRADE_DTYPE, backtest_value_area, summarize, value_area_trades
+from manager import ValueAreaManager
+from scratch import ValueAreaTradingStrategy, get_csv_data
+from sweep import SweepData, simulate_value_area
+
+@pytest.fixture(scope="module")
+def data():
+    return SweepData.from_csv("ES.csv", "ESZ7")
+
+def test_valueAreaTrades():
+    # VA 10-20: close back inside from below -> buy limit at 10, filled on a gap open at 9.5, target 20
+    opens = np.array([8.0, 9.0, 9.5, 15.0, 19.0, 21.0])
+    highs = np.array([9.0, 12.0, 16.0, 19.0, 21.0, 22.0])
+    lows = np.array([7.0, 8.5, 9.0, 14.0, 18.0, 20.0])
+    closes = np.array([8.5, 11.0, 15.0, 18.5, 20.5, 21.5])
+    VAL, VAH = np.full(6, 10.0), np.full(6, 20.0)
+    window = np.ones(6, dtype=bool)
+    trades = value_area_trades(opens, highs, lows, closes, VAL, VAH, window, ~window)
+    assert trades.dtype == TRADE_DTYPE
+    assert trades.tolist() == [(2, 4, 1, 9.5, 20.0, 10.5)]
+
+    # the same position stopped out below 10 * 0.99, then flattened at a closing bar
+    lows[3] = 9.8
+    assert value_area_trades(opens, highs, lows, closes, VAL, VAH, window, ~window).tolist() == \
+        [(2, 3, 1, 9.5, 9.9, 9.9 - 9.5)]
+    closing = np.arange(6) == 3
+    assert value_area_trades(opens, highs, lows, closes, VAL, VAH, window & ~closing, closing,
+                             stop_percent=5.0).tolist() == [(2, 3, 1, 9.5, 18.5, 9.0)]
+
+@pytest.mark.parametrize("open_offset,stop_percent", [(0, 0.05), (30, 0.1), (0, 1.0)])
+def test_matchesBacktrader(data, open_offset, stop_percent):
+    cerebro = bt.Cerebro()
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(ValueAreaTradingStrategy, symbol="ESZ7", open_offset=open_offset,
+                        stop_percent=stop_percent)
+    fills = cerebro.run()[0].fills
+
+    window, closing = data.trading_window(open_offset, 30)
+    trades = value_area_trades(data.open, data.high, data.low, data.close, data.VAL, data.VAH,
+                               window, closing, stop_percent=stop_percent)
+    assert len(trades) > 0
+    assert len(fills) == 2 * len(trades)
+    entries, exits = fills[0::2], fills[1::2]
+    assert [dt for dt, _, _ in entries] == data.dt[trades["entry_bar"]].astype(object).tolist()
+    assert [(np.sign(size), price) for _, size, price in entries] == list(zip(trades["side"], trades["entry"]))
+    assert [price for _, _, price in exits] == trades["exit"].tolist()
+    assert backtest_value_area(data, open_offset, 30, stop_percent) == summarize(trades)
+
+@pytest.mark.parametrize("open_offset", [0, 15, 30])
+@pytest.mark.parametrize("close_offset", [15, 30])
+@pytest.mark.parametrize("stop_percent", [0.05, 0.25, 1.0])
+def test_matchesFillSimulator(data, open_offset, close_offset, stop_percent):
+    # the sweep engines share the FillSimulator's fill rules: the same trades, not just close ones
+    window, closing = data.trading_window(open_offset, close_offset)
+    trades = value_area_trades(data.open, data.high, data.low, data.close, data.VAL, data.VAH,
+                               window, closing, stop_percent=stop_percent)
+    bars = np.flatnonzero(window | closing)
+    states, simulated = ValueAreaManager(stop_percent=stop_percent).simulate(
+        data.VAL[bars], data.VAH[bars], data.open[bars], data.high[bars], data.low[bars], data.close[bars],
+        closing=closing[bars])
+    simulated["entry_bar"] = bars[simulated["entry_bar"]]
+    simulated["exit_bar"] = bars[simulated["exit_bar"]]
+    assert trades.tolist() == simulated.tolist()
+    assert backtest_value_area(data, open_offset, close_offset, stop_percent) == \
+        simulate_value_area(data, open_offset, close_offset, stop_percent)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import bench
+import levels
+from sessions import get_session_schedule
+
+@pytest.fixture()
+def value_areas(monkeypatch):
+    # the value areas installed by the benchmarks are dropped after the test
+    monkeypatch.setattr(levels.VALUE_AREAS, "_loaded", dict(levels.VALUE_AREAS._loaded))
+    monkeypatch.setattr(levels.VALUE_AREAS, "_hidden", set(levels.VALUE_AREAS._hidden))
+    return levels.VALUE_AREAS
+
+def test_syntheticBars():
+    bars = bench.synthetic_bars(3, seed=1)
+    schedule = get_session_schedule("NYSE")
+    sessions = np.unique(bars["datetime"].astype(np.int64))
+    i = schedule.indices(sessions)
+    assert (i >= 0).all() and len(sessions) == 3
+    # one bar per minute from each open, so the open timer fires on the first bar of every session
+    assert len(bars) == 3 * 390
+    assert set(schedule.event_times("open", np.timedelta64(0, "m"))[i]) <= set(bars["datetime"])
+    assert (bars["high"] >= np.maximum(bars["open"], bars["close"])).all()
+    assert (bars["low"] <= np.minimum(bars["open"], bars["close"])).all()
+    assert bars.tobytes() == bench.synthetic_bars(3, seed=1).tobytes()
+
+def test_runSuiteAndCompare(tmpdir, value_areas):
+    results = bench.run_suite(scales=["1d"], symbols=[2], repeat=1)
+    assert list(results) == ["manager/1d/2", "timers/1d/2", "indicator/1d/2", "composite/1d/2",
+                             "strategy/1d/2"]
+    assert all(r["bars"] == 2 * 390 and r["seconds"] > 0 for r in results.values())
+    assert "SYN1" in value_areas
+
+    path = str(tmpdir.join("baseline.json"))
+    bench.save_results(path, results)
+    baseline = bench.load_results(path)
+    assert [row["status"] for row in bench.compare(baseline, results)] == ["ok"] * 5
+
+    slower = dict((key, dict(r, seconds=r["seconds"] * 1.5)) for key, r in results.items())
+    rows = bench.compare(baseline, slower, threshold=0.2)
+    assert [row["status"] for row in rows] == ["regression"] * 5
+    faster = dict((key, dict(r, seconds=r["seconds"] / 1.5)) for key, r in results.items())
+    assert [row["status"] for row in bench.compare(baseline, faster, threshold=0.2)] == ["improvement"] * 5
+    assert "regression" in bench.format_comparison(rows)
+
+def test_importBudgets():
+    rows = bench.check_imports(repeat=1)
+    assert [row["module"] for row in rows] == list(bench.IMPORT_BUDGETS)
+    assert all(row["status"] == "ok" for row in rows), bench.format_imports(rows)
+    seconds, heavy = bench.import_profile("intraday")
+    assert seconds > 0 and "backtrader" in heavy
@@ -0,0 +1,109 @@
+import time
+import pytest
+
+from broker import AsyncOrderClient, LoopThread, SimulatedBroker
+from manager import ValueAreaManager
+from replay import SimulatedOrderClient
+
+@pytest.fixture()
+def broker():
+    thread = LoopThread()
+    broker = SimulatedBroker(latency=0.05)
+    thread.run(broker.start())
+    yield broker
+    thread.run(broker.stop())
+    thread.stop()
+
+def test_coalescedUpdates(broker):
+    client = AsyncOrderClient(port=broker.port, max_in_flight=1).connect()
+    try:
+        client.update_entry_order("buy", 2500.0)
+        while not broker.requests:
+            time.sleep(0.001)
+        start = time.perf_counter()
+        for i in range(1, 100):
+            client.update_entry_order("buy", 2500.0 + i)
+        assert time.perf_counter() - start < broker.latency
+        client.flush(5)
+    finally:
+        client.close()
+    # the first update is in flight while the others replace each other
+    assert [r["price"] for r in broker.requests] == [2500.0, 2599.0]
+    assert broker.entry == ("buy", 2599.0)
+    assert (client.submitted, client.sent, client.coalesced) == (100, 2, 98)
+
+def test_cancelReplacesPendingUpdates(broker):
+    client = AsyncOrderClient(port=broker.port, max_in_flight=1).connect()
+    try:
+        client.update_entry_order("sell", 2600.0)
+        client.update_exit_limit("sell", 2610.0)
+        client.update_exit_stop("sell", 2590.0)
+        client.cancel_exit_orders()
+        client.update_exit_limit("buy", 2580.0)
+        client.flush(5)
+    finally:
+        client.close()
+    assert [r["op"] for r in broker.requests] == ["update_entry_order", "cancel_exit_orders", "update_exit_limit"]
+    assert (broker.entry, broker.exit_limit, broker.exit_stop) == (("sell", 2600.0), 2580.0, None)
+
+def test_managerWithAsyncClient(broker):
+    # the broker ends up with the same orders as a synchronous client driven by the same bars
+    bars = [(2570.0, 2580.0, 2585.0, 2582.0), (2570.0, 2580.0, 2582.0, 2579.0), (2570.0, 2580.0, 2579.0, 2575.0),
+            (2570.0, 2580.0, 2575.0, 2581.0), (2570.0, 2580.0, 2581.0, 2568.0), (2570.0, 2580.0, 2568.0, 2571.0)]
+    expected = SimulatedOrderClient()
+    client = AsyncOrderClient(port=broker.port).connect()
+    managers = [ValueAreaManager(orderClient=expected), ValueAreaManager(orderClient=client)]
+    try:
+        for i, bar in enumerate(bars):
+            for manager in managers:
+                manager.handleNext(*bar)
+                if i == 2:
+                    manager.order_filled()
+        assert managers[0].state == managers[1].state
+        client.flush(5)
+    finally:
+        client.close()
+    assert broker.entry == expected.entry
+    assert (broker.exit_limit, broker.exit_stop) == (expected.exit_limit, expected.exit_stop)
+    assert client.rejected == 0
+
+def test_flushTimeout():
+    thread = LoopThread()
+    broker = SimulatedBroker(latency=10.0)
+    thread.run(broker.start())
+    client = AsyncOrderClient(port=broker.port).connect()
+    try:
+        client.update_entry_order("buy", 2500.0)
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            client.flush(0.1)
+        assert time.perf_counter() - start < 1.0
+    finally:
+        thread.run(broker.disconnect())
+        client.close()
+        thread.run(broker.stop())
+        thread.stop()
+
+def test_flushAfterDisconnect():
+    thread = LoopThread()
+    broker = SimulatedBroker(latency=10.0)
+    thread.run(broker.start())
+    client = AsyncOrderClient(port=broker.port, max_in_flight=1).connect()
+    try:
+        client.update_entry_order("buy", 2500.0)
+        client.update_exit_limit("sell", 2510.0)
+        while not broker.requests:
+            time.sleep(0.001)
+        thread.run(broker.disconnect())
+        # the request in flight and the pending one are failed instead of waited for
+        start = time.perf_counter()
+        with pytest.raises(ConnectionError):
+            client.flush()
+        assert time.perf_counter() - start < 1.0
+        assert client.lost == 2 and not client.connected
+        with pytest.raises(ConnectionError):
+            client.cancel_entry_order()
+    finally:
+        client.close()
+        thread.run(broker.stop())
+        thread.stop()
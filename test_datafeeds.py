@@ -0,0 +1,67 @@
+import os
+import shutil
+import datetime
+import numpy as np
+import backtrader as bt
+
+from datafeeds import BarArrayData, cache_path, date2nums, load_bars, parse_datetimes, read_csv_bars
+
+def test_parseDatetimes():
+    values = ["20171023  09:30:00", "20000229  23:59:59", "19991231  00:00:01"]
+    times, nums = parse_datetimes(np.array(values, dtype=object))
+    expected = [datetime.datetime.strptime(v, "%Y%m%d  %H:%M:%S") for v in values]
+    assert times.astype(datetime.datetime).tolist() == expected
+    assert nums.tolist() == [bt.date2num(dt) for dt in expected]
+    assert date2nums(times).tolist() == nums.tolist()
+
+def test_date2numsMatchesBacktrader():
+    rng = np.random.RandomState(0)
+    seconds = rng.randint(0, 86400 * 365 * 50, size=20000)
+    # before 1436 the ordinals are outside the binade the vectorized rounding relies on
+    times = np.concatenate(([np.datetime64("1400-03-01T12:34:56")], np.datetime64("1990-01-01", "s") + seconds))
+    expected = [bt.date2num(dt) for dt in times.astype(datetime.datetime).tolist()]
+    assert date2nums(times).tolist() == expected
+    assert date2nums(times[1:]).tolist() == expected[1:]
+
+def test_loadBarsCache(tmpdir):
+    path = str(tmpdir.join("ES.csv"))
+    shutil.copy("ES.csv", path)
+    bars = load_bars(path)
+    assert os.path.exists(cache_path(path))
+    assert sorted(os.listdir(str(tmpdir))) == ["ES.csv", "ES.csv.npy"]
+    cached = load_bars(path)
+    assert isinstance(cached, np.memmap)
+    assert cached.tobytes() == bars.tobytes()
+    assert bars["high"][0] == 2576.75 and bars["low"][0] == 2573.0
+
+    # a newer csv invalidates the cache
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.writelines(lines[:11])
+    mtime = os.path.getmtime(cache_path(path)) + 10
+    os.utime(path, (mtime, mtime))
+    assert len(load_bars(path)) == 10
+
+def _run(data, preload=True):
+    class Recorder(bt.Strategy):
+        def __init__(self):
+            self.rows = []
+        def next(self):
+            self.rows.append(tuple(line[0] for line in self.data.lines))
+
+    cerebro = bt.Cerebro(preload=preload)
+    cerebro.adddata(data)
+    cerebro.addstrategy(Recorder)
+    return np.array(cerebro.run()[0].rows)
+
+def test_barArrayDataMatchesCsv():
+    bars = read_csv_bars("ES.csv")
+    kwargs = dict(timeframe=bt.TimeFrame.Minutes, compression=30,
+                  fromdate=datetime.datetime(2017, 11, 2), todate=datetime.datetime(2017, 11, 6, 23, 59))
+    csv = bt.feeds.GenericCSVData(dataname="ES.csv", dtformat="%Y%m%d  %H:%M:%S", datetime=0, high=1, low=2,
+                                  open=3, close=4, volume=5, openinterest=-1, **kwargs)
+    expected = _run(csv)
+    assert len(expected) > 0
+    assert np.array_equal(_run(BarArrayData(bars=bars, **kwargs)), expected, equal_nan=True)
+    assert np.array_equal(_run(BarArrayData(bars=bars, **kwargs), preload=False), expected, equal_nan=True)
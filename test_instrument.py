@@ -0,0 +1,72 @@
+import json
+import pytest
+import numpy as np
+import backtrader as bt
+
+import instrument
+from manager import ValueAreaManager
+from scratch import ValueAreaTradingStrategy, get_csv_data
+
+@pytest.mark.parametrize("runonce", [False, True])
+def test_profileBacktest(tmpdir, runonce):
+    original = ValueAreaManager.next
+    cerebro = bt.Cerebro(runonce=runonce)
+    data = get_csv_data()
+    cerebro.adddata(data)
+    cerebro.addstrategy(ValueAreaTradingStrategy, symbol="ESZ7", open_offset=0)
+    with instrument.profile() as profiler:
+        assert ValueAreaManager.next is not original
+        strategy = cerebro.run()[0]
+    assert ValueAreaManager.next is original
+    assert instrument.active() is None
+
+    report = profiler.report()
+    assert report["bars"]["strategy"] == len(data)
+    assert report["throughput"]["strategy"] > 0
+    components = report["components"]
+    assert components["Strategy._oncepost" if runonce else "Strategy._next"]["calls"] == len(data)
+    assert components["ValueAreaTradingStrategy.next"]["calls"] == len(data)
+    assert components["ValueAreaManager.next"]["calls"] > 0
+    if runonce:
+        # oncestart and once for each of the two timers
+        assert components["EventTimer.once"]["calls"] == 4
+    else:
+        assert components["EventTimer.next"]["calls"] == 2 * len(data)
+    stats = components["ValueAreaTradingStrategy.next"]
+    assert stats["p50"] <= stats["p99"] <= stats["max"]
+    entries = len(strategy.fills) // 2
+    assert report["transitions"]["value_buy->value_buy_hold"] + \
+        report["transitions"]["value_sell->value_sell_hold"] == entries
+
+    path = str(tmpdir.join("trace.json"))
+    profiler.save_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == sum(stats["calls"] for stats in components.values())
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    profiler.save_json(str(tmpdir.join("report.json")))
+
+def test_profileHandleBatch():
+    manager = ValueAreaManager()
+    VAL, VAH = np.full(4, 10.0), np.full(4, 20.0)
+    with instrument.profile() as profiler:
+        manager.handleBatch(VAL, VAH, [8.0, 9.0, 15.0, 21.0], [9.0, 15.0, 21.0, 22.0])
+    assert profiler.transitions == {"idle->stalking_below": 1, "stalking_below->value_buy": 1,
+                                    "value_buy->stalking_above": 1}
+    assert profiler.bars["manager"] == 4
+
+def test_transitionsMatchHandleNext():
+    rng = np.random.RandomState(0)
+    n = 1000
+    # a null VA sends every state to idle, including idle itself
+    VALs, VAHs = np.where(rng.rand(n) < 0.05, np.NaN, 10.0), np.full(n, 20.0)
+    opens = rng.choice([5.0, 10.0, 15.0, 20.0, 25.0], size=n)
+    closes = rng.choice([5.0, 10.0, 15.0, 20.0, 25.0], size=n)
+    with instrument.profile() as looped:
+        manager = ValueAreaManager()
+        for args in zip(VALs, VAHs, opens, closes):
+            manager.handleNext(*args)
+    with instrument.profile() as batched:
+        ValueAreaManager().handleBatch(VALs, VAHs, opens, closes)
+    assert looped.transitions["idle->idle"] > 0
+    assert looped.transitions == batched.transitions
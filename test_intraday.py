@@ -0,0 +1,97 @@
+import pytest
+import datetime
+import numpy as np
+import backtrader as bt
+
+from datafeeds import BarArrayData, load_bars
+from intraday import OutputEventTimer, RangeEventTimer, StandardIntradayStrategy
+from scratch import get_csv_data
+
+class TimerRecorder(bt.Strategy):
+    def __init__(self):
+        self.openTimer = OutputEventTimer(offset=0)
+        self.closeTimer = OutputEventTimer(base="close", offset=-30)
+        self.records = []
+
+    def next(self):
+        self.records.append((self.data.datetime.datetime(),
+                             self.openTimer.event[0], self.openTimer.phase[0],
+                             self.closeTimer.event[0], self.closeTimer.phase[0]))
+
+def run_timers(runonce):
+    cerebro = bt.Cerebro(runonce=runonce)
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(TimerRecorder)
+    return cerebro.run()[0].records
+
+@pytest.mark.parametrize("runonce", [False, True])
+def test_outputEventTimer(runonce):
+    for dt, open_event, open_phase, close_event, close_phase in run_timers(runonce):
+        assert open_event == (dt.time() == datetime.time(9, 30))
+        assert open_phase == True
+        assert close_event == (dt.time() == datetime.time(15, 30))
+        assert close_phase == (dt.time() >= datetime.time(15, 30))
+
+def test_outputEventTimerOnceMatchesNext():
+    assert run_timers(runonce=True) == run_timers(runonce=False)
+
+class RangeRecorder(bt.Strategy):
+    def __init__(self):
+        self.ranges = RangeEventTimer.with_periods(1, 31, 61)()
+        self.shifted = RangeEventTimer(offset=30, period=31)
+        self.records = []
+
+    def next(self):
+        self.records.append([line[0] for line in self.ranges.lines] + [line[0] for line in self.shifted.lines])
+
+def expected_range(bars, first, last):
+    """ high/low of each date's bars from `first` through `last`, on the bars from `last` on (NaN before) """
+    times = bars["time"].astype(datetime.datetime)
+    result = np.full((len(bars), 2), np.NaN)
+    for day in sorted(set(t.date() for t in times)):
+        window = [i for i, t in enumerate(times) if t.date() == day and first <= t.time() <= last]
+        after = [i for i, t in enumerate(times) if t.date() == day and t.time() >= last]
+        result[after] = (bars["high"][window].max(), bars["low"][window].min())
+    return result
+
+@pytest.mark.parametrize("runonce", [False, True])
+def test_rangeEventTimer(runonce):
+    cerebro = bt.Cerebro(runonce=runonce)
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(RangeRecorder)
+    records = np.array(cerebro.run()[0].records)
+
+    bars = load_bars("ES.csv")
+    opening = datetime.time(9, 30)
+    first = expected_range(bars, opening, opening)
+    expected = np.hstack([
+        first, first,
+        expected_range(bars, opening, datetime.time(10, 0)),
+        expected_range(bars, opening, datetime.time(10, 30)),
+        expected_range(bars, datetime.time(10, 0), datetime.time(10, 30)),
+    ])
+    np.testing.assert_array_equal(records, expected)
+
+class OpenRangeBuyer(StandardIntradayStrategy):
+    """ Buys every feed at the open, to be closed by the end of day exit """
+    def __init__(self):
+        super(OpenRangeBuyer, self).__init__()
+        self.entries = []
+
+    def check_for_entry(self, data):
+        self.entries.append((data._name, data.datetime.datetime()))
+        return True
+
+def test_standardIntradayStrategyFeeds():
+    bars = load_bars("ES.csv")
+    cerebro = bt.Cerebro()
+    cerebro.adddata(BarArrayData(bars=bars, timeframe=bt.TimeFrame.Minutes, compression=30), name="ES")
+    cerebro.adddata(BarArrayData(bars=bars[1::2], timeframe=bt.TimeFrame.Minutes, compression=30), name="NQ")
+    cerebro.addstrategy(OpenRangeBuyer, open_offset=0)
+    strategy = cerebro.run()[0]
+    assert len([i for i in strategy.getindicators() if isinstance(i, OutputEventTimer)]) == 2
+    names = [name for name, dt in strategy.entries]
+    assert names.count("ES") > 0 and names.count("NQ") > 0
+    # entries only between the open and the close - 30 minutes, on each feed's own bars
+    assert all(datetime.time(9, 30) <= dt.time() < datetime.time(15, 30) for name, dt in strategy.entries)
+    assert strategy.getposition(strategy.datas[0]).size == strategy.getposition(strategy.datas[1]).size == 0
@@ -0,0 +1,74 @@
+import numpy as np
+import backtrader as bt
+
+from journal import ALERT, FILL, ORDER, ORDER_OPS, TRANSITION, TRIGGERS, Journal, JournalOrderClient, load_journal
+from manager import ValueAreaManager
+from replay import SimulatedOrderClient
+from scratch import ValueAreaStrategy, ValueAreaTradingStrategy, get_csv_data
+
+STATES = ValueAreaManager.states
+
+def test_journalChunks(tmpdir):
+    journal = Journal(chunk_size=4)
+    assert len(journal) == 0 and len(journal.events()) == 0
+    for i in range(10):
+        journal.record(float(i), "ESZ7", ORDER, op=i % 6, price=2500.0 + i)
+    events = journal.events()
+    assert len(journal) == 10 and len(journal._chunks) == 3
+    assert events["time"].tolist() == list(range(10))
+    assert (events["symbol"] == b"ESZ7").all() and events["dest"].tolist() == [-1] * 10
+
+    path = str(tmpdir.join("journal.npy"))
+    journal.save(path)
+    loaded = load_journal(path)
+    assert isinstance(loaded, np.memmap)
+    assert loaded.tobytes() == events.tobytes()
+
+def test_orderClientOps():
+    journal = Journal()
+    client = JournalOrderClient(SimulatedOrderClient(), journal, "ESZ7", clock=lambda: 1.0)
+    for op in ORDER_OPS:
+        args = ("buy", 2500.0) if op.startswith("update") else ()
+        getattr(client, op)(*args)
+    events = journal.events()
+    assert [ORDER_OPS[op] for op in events["op"]] == list(ORDER_OPS)
+    assert (events["kind"] == ORDER).all()
+
+def test_tradingStrategyJournal(tmpdir):
+    path = str(tmpdir.join("trading.npy"))
+    journal = Journal(path=path)
+    cerebro = bt.Cerebro()
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(ValueAreaTradingStrategy, symbol="ESZ7", open_offset=0, stop_percent=0.1, journal=journal)
+    strategy = cerebro.run()[0]
+
+    events = load_journal(path)
+    assert len(events) == len(journal)
+    fills = events[events["kind"] == FILL]
+    assert [(dt, size, price) for dt, size, price in strategy.fills] == \
+        [(bt.num2date(t), s, p) for t, s, p in zip(fills["time"], fills["size"], fills["price"])]
+
+    transitions = events[events["kind"] == TRANSITION]
+    entries = (transitions["op"] == TRIGGERS.index("order_filled")) & \
+        np.isin(transitions["dest"], [STATES.index("value_buy_hold"), STATES.index("value_sell_hold")])
+    assert entries.sum() == len(strategy.fills) // 2
+    # every transition starts from where the previous one ended
+    assert (transitions["source"][1:] == transitions["dest"][:-1]).all()
+
+    orders = events[events["kind"] == ORDER]
+    entry_orders = orders[orders["op"] == ORDER_OPS.index("update_entry_order")]
+    assert len(entry_orders) >= entries.sum() > 0
+    assert set(entry_orders["side"].tolist()) <= {1, -1}
+
+def test_strategyJournalAlerts():
+    journal = Journal()
+    cerebro = bt.Cerebro()
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(ValueAreaStrategy, symbol="ESZ7", journal=journal)
+    strategy = cerebro.run()[0]
+    alerts = journal.events()
+    assert (alerts["kind"] == ALERT).all() and len(alerts) == len(strategy.alerts)
+    open_states, close_states = strategy.state_history()
+    changed = np.flatnonzero(open_states != close_states)
+    assert alerts["source"].tolist() == open_states[changed].tolist()
+    assert alerts["dest"].tolist() == close_states[changed].tolist()
@@ -0,0 +1,48 @@
+import pytest
+import datetime
+import numpy as np
+
+from levels import LevelStore, SymbolLevels, VALUE_AREAS
+
+sample = {
+    datetime.date(2017, 11, 2): {"VAH": 2581.5, "VAL": 2574},
+    datetime.date(2017, 11, 1): {"VAH": 2574.25, "VAL": 2571.25},
+    datetime.date(2017, 11, 6): {"VAH": 2585, "VAL": 2577.5},
+}
+
+@pytest.fixture()
+def store(tmpdir):
+    store = LevelStore(str(tmpdir))
+    store["ESZ7"] = sample
+    store.save("ESZ7")
+    return LevelStore(str(tmpdir))
+
+def test_levelStoreLookup(store):
+    assert list(store) == ["ESZ7"]
+    assert store["ESZ7"][datetime.date(2017, 11, 2)] == {"VAH": 2581.5, "VAL": 2574}
+    assert list(store["ESZ7"]) == sorted(sample)
+    with pytest.raises(KeyError):
+        store["ESZ7"][datetime.date(2017, 11, 3)]
+    with pytest.raises(KeyError):
+        store["NQZ7"]
+
+def test_levelStoreBetween(store):
+    levels = store["ESZ7"].between(datetime.date(2017, 11, 2), datetime.date(2017, 11, 6))
+    assert list(levels["VAH"]) == [2581.5, 2585]
+
+def test_levelStoreVectorLookup(store):
+    dates = [datetime.date(2017, 11, d).toordinal() for d in (1, 3, 6, 30)]
+    VAL, VAH = store["ESZ7"].lookup(dates)
+    np.testing.assert_array_equal(VAL, [2571.25, np.NaN, 2577.5, np.NaN])
+    np.testing.assert_array_equal(VAH, [2574.25, np.NaN, 2585, np.NaN])
+
+def test_levelStoreInMemory(store):
+    store["NQZ7"] = {datetime.date(2017, 11, 1): {"VAH": 6300, "VAL": 6280}}
+    assert list(store) == ["ESZ7", "NQZ7"]
+    del store["ESZ7"]
+    assert "ESZ7" not in store
+    assert list(store) == ["NQZ7"]
+
+def test_valueAreasCompatibility():
+    assert VALUE_AREAS["ESZ7"][datetime.date(2017, 11, 22)] == {"VAH": 2600, "VAL": 2594.5}
+    assert isinstance(VALUE_AREAS["ESZ7"], SymbolLevels)
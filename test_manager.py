@@ -1,8 +1,13 @@
 import pytest
+import math
+import random
 import logging
+import numpy as np
 from unittest.mock import create_autospec, ANY
+import transitions
+from transitions import Machine
 
-from manager import ValueAreaManager, ValueAreaOrderClient
+from manager import MachineError, ValueAreaManager, ValueAreaOrderClient, ENTRY
 
 log = logging.getLogger(__name__)
 
@@ -64,4 +69,190 @@ def test_valueAreaCompleteSuccess(vaManager, buyOrSell, startPrice, entryPrice,
     vaManager.orderClient.cancel_exit_orders.assert_called_with()
 
     # Expect to get the candle after we get the order_filled notification
-    vaManager.handleNext(VAL, VAH, targetPrice, exitPrice)
\ No newline at end of file
+    vaManager.handleNext(VAL, VAH, targetPrice, exitPrice)
+
+@pytest.mark.parametrize("stop_percent", [1.0, 2.5])
+def test_valueAreaStopPercent(stop_percent):
+    vaManager = ValueAreaManager(orderClient=create_autospec(ValueAreaOrderClient), stop_percent=stop_percent)
+    vaManager.handleNext(VAL, VAH, 7, 11)
+    vaManager.order_filled()
+    assert vaManager.current_stop == VAL * (1 - stop_percent / 100)
+    vaManager.orderClient.update_exit_stop.assert_called_with("sell", vaManager.current_stop)
+
+# ----- differential test against the original transitions.Machine implementation -----
+class TransitionsValueAreaManager(ValueAreaManager):
+    """ ValueAreaManager driven by the transitions.Machine it was originally written with """
+
+    def __init__(self, orderClient=None):
+        super(TransitionsValueAreaManager, self).__init__(orderClient=orderClient)
+        self.machine = Machine(model=self, states=ValueAreaManager.states, initial="idle")
+        for transition in ValueAreaManager.transition_table:
+            self.machine.add_transition(**transition)
+
+    def next(self):
+        return self.machine.events["next"].trigger(self)
+
+    def order_filled(self):
+        return self.machine.events["order_filled"].trigger(self)
+
+    def order_cancelled(self):
+        return self.machine.events["order_cancelled"].trigger(self)
+
+def _apply(manager, action):
+    try:
+        if action[0] == "next":
+            return manager.handleNext(*action[1:])
+        return getattr(manager, action[0])()
+    except (MachineError, transitions.MachineError, ValueError) as e:
+        return (type(e).__name__, str(e))
+
+def _same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+@pytest.mark.parametrize("seed", range(10))
+def test_compiledMatchesTransitions(seed):
+    rng = random.Random(seed)
+    prices = [5, 10, 15, 20, 25, float("nan")]
+    levels = [(VAL, VAH), (VAL, VAH), (VAL, VAH), (VAH, VAL), (float("nan"), VAH), (VAL, float("nan"))]
+    compiled = ValueAreaManager(orderClient=create_autospec(ValueAreaOrderClient))
+    reference = TransitionsValueAreaManager(orderClient=create_autospec(ValueAreaOrderClient))
+    for _ in range(500):
+        roll = rng.random()
+        if roll < 0.7:
+            action = ("next",) + rng.choice(levels) + (rng.choice(prices), rng.choice(prices))
+        elif roll < 0.85:
+            action = ("order_filled",)
+        else:
+            action = ("order_cancelled",)
+
+        assert _apply(compiled, action) == _apply(reference, action)
+        assert compiled.state == reference.state
+        assert _same(compiled.current_target, reference.current_target)
+        assert _same(compiled.current_stop, reference.current_stop)
+        assert len(compiled.orderClient.mock_calls) == len(reference.orderClient.mock_calls)
+
+    assert compiled.orderClient.mock_calls == reference.orderClient.mock_calls
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("live", [False, True])
+def test_batchMatchesHandleNext(seed, live):
+    rng = np.random.RandomState(seed)
+    n = 1000
+    VALs = np.where(rng.rand(n) < 0.05, np.NaN, VAL)
+    VAHs = np.full(n, VAH, dtype=np.float64)
+    opens = rng.choice([5, 10, 15, 20, 25, np.NaN], size=n)
+    closes = rng.choice([5, 10, 15, 20, 25, np.NaN], size=n)
+
+    looped = ValueAreaManager(orderClient=create_autospec(ValueAreaOrderClient) if live else None)
+    looped_states = []
+    for args in zip(VALs, VAHs, opens, closes):
+        looped.handleNext(*args)
+        looped_states.append(ValueAreaManager.states.index(looped.state))
+
+    batched = ValueAreaManager(orderClient=create_autospec(ValueAreaOrderClient) if live else None)
+    states, events = batched.handleBatch(VALs, VAHs, opens, closes)
+
+    np.testing.assert_array_equal(states, looped_states)
+    assert batched.state == looped.state
+    assert _same(batched.current_target, looped.current_target)
+    if live:
+        assert batched.orderClient.mock_calls == looped.orderClient.mock_calls
+        entries = events[events["action"] == ENTRY]
+        assert [c for c in looped.orderClient.mock_calls if c[0] == "update_entry_order"] == \
+            [("update_entry_order", ("buy" if e["side"] > 0 else "sell", e["price"]), {}) for e in entries]
+
+def test_simulateFills():
+    # VA 10-20: close back inside from below -> buy limit at 10, filled on a gap open at 9.5, target 20
+    opens = [8.0, 9.0, 9.5, 15.0, 19.0, 21.0]
+    highs = [9.0, 12.0, 16.0, 19.0, 21.0, 22.0]
+    lows = [7.0, 8.5, 9.0, 14.0, 18.0, 20.0]
+    closes = [8.5, 11.0, 15.0, 18.5, 20.5, 21.5]
+    states, trades = ValueAreaManager().simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes)
+    assert [ValueAreaManager.states[s] for s in states] == [
+        "stalking_below", "value_buy", "value_buy_hold", "value_buy_hold", "stalking_above", "stalking_above"]
+    assert trades.tolist() == [(2, 4, 1, 9.5, 20.0, 10.5)]
+
+    closing = [False, False, False, True, False, False]
+    states, trades = ValueAreaManager().simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes, closing=closing)
+    assert trades.tolist() == [(2, 3, 1, 9.5, 18.5, 9.0)]
+    assert ValueAreaManager.states[states[3]] == "idle"
+
+def test_simulateEntryExpiry():
+    class CountingManager(ValueAreaManager):
+        cancelled = 0
+        def order_cancelled(self):
+            self.cancelled += 1
+            return super().order_cancelled()
+
+    opens = [8.0, 9.0, 12.0, 12.0, 12.0, 12.0]
+    highs = [9.0, 12.0, 13.0, 13.0, 13.0, 13.0]
+    lows = [7.0, 8.5, 11.0, 11.0, 11.0, 9.0]
+    closes = [8.5, 11.0, 12.0, 12.0, 12.0, 9.5]
+    manager = CountingManager()
+    states, trades = manager.simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes, entry_expiry=2)
+    # placed on bar 1, expired and placed again on bar 3, filled on its last bar
+    assert manager.cancelled == 1
+    assert [ValueAreaManager.states[s] for s in states[1:]] == ["value_buy"] * 4 + ["value_buy_hold"]
+    assert len(trades) == 0
+
+    manager = CountingManager()
+    states, trades = manager.simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes, entry_expiry=1)
+    assert manager.cancelled == 3
+    assert trades.tolist() == [] and ValueAreaManager.states[states[-1]] == "value_buy_hold"
+
+    manager = CountingManager()
+    states, trades = manager.simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes, entry_expiry=None)
+    assert manager.cancelled == 0
+    for expiry in (0, -1):
+        with pytest.raises(ValueError):
+            CountingManager().simulate([VAL] * 6, [VAH] * 6, opens, highs, lows, closes, entry_expiry=expiry)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_simulateMatchesBacktest(seed):
+    from backtest import value_area_trades
+    rng = np.random.RandomState(seed)
+    sessions, length = 40, 50
+    closes = 100 + np.cumsum(rng.choice([-0.5, -0.25, 0, 0.25, 0.5], size=sessions * length))
+    opens = np.r_[closes[0], closes[:-1]]
+    highs = np.maximum(opens, closes) + rng.choice([0, 0.25, 0.5], size=len(closes))
+    lows = np.minimum(opens, closes) - rng.choice([0, 0.25, 0.5], size=len(closes))
+    centers = np.repeat(closes[::length] + rng.choice([-1.0, 0.0, 1.0], size=sessions), length)
+    VALs, VAHs = centers - 1.0, centers + 1.0
+    closing = np.tile(np.arange(length) >= length - 5, sessions)
+
+    states, trades = ValueAreaManager(stop_percent=0.5).simulate(VALs, VAHs, opens, highs, lows, closes,
+                                                                 closing=closing)
+    expected = value_area_trades(opens, highs, lows, closes, VALs, VAHs, ~closing, closing, stop_percent=0.5)
+    assert len(trades) > 0
+    assert trades.tolist() == expected.tolist()
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_snapshotRestore(seed):
+    rng = random.Random(seed)
+    bars = [(VAL, VAH, rng.uniform(5, 25), rng.uniform(5, 25)) for i in range(200)]
+    fills = set(rng.sample(range(200), 40))
+    def run(manager, bars, start=0):
+        client = create_autospec(ValueAreaOrderClient)
+        manager.orderClient = client
+        for i, bar in enumerate(bars, start):
+            manager.handleNext(*bar)
+            if i in fills and manager.state.startswith("value_"):
+                manager.order_filled()
+        return client.mock_calls
+
+    expected = ValueAreaManager()
+    expected_calls = run(expected, bars)
+    first = ValueAreaManager()
+    calls = run(first, bars[:100])
+    # a new manager carries on from the checkpoint without replaying the first bars
+    resumed = ValueAreaManager()
+    resumed.restore(first.snapshot())
+    calls += run(resumed, bars[100:], start=100)
+    assert calls == expected_calls
+    assert resumed.snapshot() == expected.snapshot()
+
+def test_restoreInvalidState():
+    manager = ValueAreaManager()
+    with pytest.raises(ValueError):
+        manager.restore(manager.snapshot()._replace(state="flat"))
+    assert not hasattr(manager, "__dict__")
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from datafeeds import load_bars
+from replay import BarAggregator, ReplaySession, bar_ticks, replay, synthetic_ticks
+
+def test_barAggregator():
+    aggregator = BarAggregator(minutes=1)
+    ticks = [(0, 10.0, 1.0), (20 * 10 ** 6, 12.0, 2.0), (40 * 10 ** 6, 9.0, 1.0), (60 * 10 ** 6, 11.0, 5.0)]
+    bars = [aggregator.add(*tick) for tick in ticks]
+    assert bars == [None, None, None, (0, 10.0, 12.0, 9.0, 9.0, 4.0)]
+    assert aggregator.flush() == (60 * 10 ** 6, 11.0, 11.0, 11.0, 11.0, 5.0)
+    assert aggregator.flush() is None
+
+@pytest.mark.parametrize("transport", ["queue", "socket"])
+def test_replayBars(transport):
+    bars = load_bars("ES.csv")
+    session, report = replay(bar_ticks(bars), "ESZ7", transport=transport)
+    # the ticks rebuild the original bars
+    rebuilt = np.array(session.bars)
+    assert (rebuilt[:, 0] == bars["time"].astype("datetime64[us]").astype(np.int64)).all()
+    assert (rebuilt[:, 1:] == np.column_stack([bars[c] for c in ("open", "high", "low", "close", "volume")])).all()
+
+    expected = ReplaySession("ESZ7")
+    expected.run((tick + (0.0,) for tick in bar_ticks(bars)))
+    assert session.fills == expected.fills and len(session.fills) > 0
+    # every position is closed by the end of its session
+    assert sum(side for _, side, _ in session.fills) == 0
+    assert session.position == 0
+    assert session.manager.snapshot() == expected.manager.snapshot()
+    assert report["ticks"] == 4 * len(bars) and report["bars"] == len(bars)
+    assert report["latency"]["count"] == report["orders"] > 0
+    assert 0 <= report["latency"]["p50"] <= report["latency"]["p90"] <= report["latency"]["max"]
+
+def test_replaySessionClose():
+    bars = load_bars("ES.csv")
+    session = ReplaySession("ESZ7", close_offset=30)
+    session.run((tick + (0.0,) for tick in bar_ticks(bars)))
+    times = np.array([t for t, _, _ in session.fills])
+    sides = np.array([side for _, side, _ in session.fills])
+    # every day's fills net to zero, the positions still open being closed at the 16:00 session close
+    days = times // (86400 * 10 ** 6)
+    assert all(sides[days == day].sum() == 0 for day in np.unique(days))
+    forced = times % (86400 * 10 ** 6) == 16 * 3600 * 10 ** 6
+    assert forced.sum() > 0
+    closes = dict(zip(bars["time"].astype("datetime64[us]").astype(np.int64) + 30 * 60 * 10 ** 6, bars["close"]))
+    assert [price for (t, _, price), f in zip(session.fills, forced) if f] == [closes[t] for t in times[forced]]
+
+def test_replayPaced():
+    ticks = synthetic_ticks(21, interval=0.01)
+    session, report = replay(ticks, "SYN", minutes=1, speed=1.0)
+    assert report["elapsed"] >= 0.2
+    session, report = replay(ticks, "SYN", minutes=1, speed=100.0)
+    assert report["elapsed"] < 0.2
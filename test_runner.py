@@ -0,0 +1,25 @@
+import datetime
+
+from runner import BacktestJob, BacktestReport, run_job, run_jobs, split_job
+from scratch import ValueAreaTradingStrategy
+
+job = BacktestJob("ESZ7", "ES.csv", datetime.date(2017, 11, 1), datetime.date(2017, 11, 21))
+
+def test_splitJob():
+    jobs = split_job(job, 7)
+    assert [(j.fromdate.day, j.todate.day) for j in jobs] == [(1, 7), (8, 14), (15, 21)]
+    assert all(j.symbol == "ESZ7" and j.datafile == "ES.csv" for j in jobs)
+
+def test_parallelMatchesSingleRun():
+    single = BacktestReport([run_job(job)])
+    parallel = BacktestReport(run_jobs(split_job(job, 7), max_workers=2))
+    assert len(single.alerts()) > 0
+    assert parallel.alerts() == single.alerts()
+
+def test_parallelTradesMatchSingleRun():
+    single = BacktestReport([run_job(job, strategy=ValueAreaTradingStrategy)]).trades("ESZ7")
+    parallel = BacktestReport(run_jobs(split_job(job, 7), max_workers=2,
+                                       strategy=ValueAreaTradingStrategy)).trades("ESZ7")
+    assert single["total"] > 0
+    # every job starts with the same cash, so the position sizes and pnl differ once the account has moved
+    assert [parallel[k] for k in ("total", "won", "lost")] == [single[k] for k in ("total", "won", "lost")]
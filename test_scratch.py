@@ -0,0 +1,120 @@
+import numpy as np
+import backtrader as bt
+
+from datafeeds import BarArrayData, load_bars
+from intraday import OutputEventTimer
+from levels import VALUE_AREAS
+from volume_profile import SessionProfiles
+from scratch import (CompositeValueAreaIndicator, ValueAreaIndicator, ValueAreaTradingStrategy, ValueAreaStrategy,
+                     STATE_ABOVE, STATE_BELOW, STATE_INSIDE, STATE_NONE, describe_state, get_csv_data)
+
+def test_describeState():
+    assert describe_state(STATE_ABOVE, 2571.25, 2574.25) == "above VAH (2574.25)"
+    assert describe_state(STATE_BELOW, 2571.25, 2574.25) == "below VAL (2571.25)"
+    assert describe_state(STATE_INSIDE, 2571.25, 2574.25) == "inside VA (2571.25-2574.25)"
+    assert describe_state(STATE_NONE, np.NaN, np.NaN) == "none"
+
+def test_strategyStateHistory():
+    cerebro = bt.Cerebro()
+    data = get_csv_data()
+    cerebro.adddata(data)
+    cerebro.addstrategy(ValueAreaStrategy, symbol="ESZ7")
+    strategy = cerebro.run()[0]
+
+    open_states, close_states = strategy.state_history()
+    assert len(open_states) == len(close_states) == len(data)
+    changed = np.flatnonzero(open_states != close_states)
+    assert len(changed) == len(strategy.alerts) > 0
+    assert [alert[0] for alert in strategy.alerts] == [bt.num2date(data.datetime.array[i]) for i in changed]
+    assert strategy.alerts[0][1:] == ("above VAH (2574.25)", "inside VA (2571.25-2574.25)")
+
+class IndicatorStrategy(bt.Strategy):
+    def __init__(self):
+        self.known = ValueAreaIndicator(symbol="ESZ7")
+        self.unknown = ValueAreaIndicator(symbol="UNKNOWN")
+
+def test_valueAreaIndicatorOnce():
+    lines = []
+    for runonce in (False, True):
+        cerebro = bt.Cerebro(runonce=runonce)
+        data = get_csv_data()
+        cerebro.adddata(data)
+        cerebro.addstrategy(IndicatorStrategy)
+        strategy = cerebro.run()[0]
+        lines.append((np.array(strategy.known.high.array), np.array(strategy.known.low.array)))
+        assert np.isnan(strategy.unknown.high.array).all() and np.isnan(strategy.unknown.low.array).all()
+
+    VAL, VAH = VALUE_AREAS["ESZ7"].lookup(np.array(data.datetime.array).astype(np.int64))
+    assert np.isnan(VAL).any() and not np.isnan(VAL).all()
+    for high, low in lines:
+        np.testing.assert_array_equal(high, VAH)
+        np.testing.assert_array_equal(low, VAL)
+
+class CompositeStrategy(bt.Strategy):
+    def __init__(self):
+        self.valueArea = CompositeValueAreaIndicator(short=2, long=3)
+
+def test_compositeValueAreaIndicator():
+    lines = []
+    for runonce in (False, True):
+        cerebro = bt.Cerebro(runonce=runonce)
+        data = get_csv_data()
+        cerebro.adddata(data)
+        cerebro.addstrategy(CompositeStrategy)
+        valueArea = cerebro.run()[0].valueArea
+        lines.append(dict((name, np.array(getattr(valueArea.lines, name).array))
+                          for name in valueArea.lines.getlinealiases()))
+    for name in lines[0]:
+        np.testing.assert_allclose(lines[0][name], lines[1][name], err_msg=name)
+
+    sessions = np.array(data.datetime.array).astype(np.int64)
+    profiles = SessionProfiles(sessions, data.high.array, data.low.array, data.volume.array)
+    areas = profiles.value_areas()
+    short, long = profiles.composite_value_areas(2), profiles.composite_value_areas(3)
+    k = np.searchsorted(profiles.sessions, sessions)
+    last = np.r_[sessions[1:] != sessions[:-1], True]
+    for line in lines:
+        assert np.isnan(line["prior_high"][k == 0]).all() and np.isnan(line["long_low"][k == 0]).all()
+        np.testing.assert_allclose(line["prior_high"][k > 0], areas["VAH"][k[k > 0] - 1])
+        np.testing.assert_allclose(line["prior_low"][k > 0], areas["VAL"][k[k > 0] - 1])
+        # the developing value area of a session's last bar is the session's value area
+        np.testing.assert_allclose(line["developing_high"][last], areas["VAH"])
+        np.testing.assert_allclose(line["developing_low"][last], areas["VAL"])
+        np.testing.assert_allclose(line["short_high"][k > 0], short["VAH"][k[k > 0] - 1])
+        np.testing.assert_allclose(line["long_low"][k > 0], long["VAL"][k[k > 0] - 1])
+
+def test_tradingStrategyCompositeLevels():
+    cerebro = bt.Cerebro()
+    cerebro.adddata(get_csv_data())
+    cerebro.addstrategy(ValueAreaTradingStrategy, open_offset=0, value_area="short")
+    strategy = cerebro.run()[0]
+    assert isinstance(strategy.valueArea, CompositeValueAreaIndicator)
+    assert len(strategy.fills) > 0 and len(strategy.fills) % 2 == 0
+
+def run_feeds(strategy, feeds, **kwargs):
+    cerebro = bt.Cerebro()
+    for bars in feeds:
+        cerebro.adddata(BarArrayData(bars=bars, timeframe=bt.TimeFrame.Minutes, compression=30))
+    cerebro.addstrategy(strategy, symbols=["ESZ7"] * len(feeds), **kwargs)
+    return cerebro.run()[0]
+
+def test_strategyMultipleFeeds():
+    bars = load_bars("ES.csv")
+    # the first feed is the timers' clock, the second one has bars it doesn't have
+    feeds = [bars[::3], bars]
+    strategy = run_feeds(ValueAreaStrategy, feeds)
+    timers = [i for i in strategy.getindicators() if isinstance(i, OutputEventTimer)]
+    assert len(timers) == 2
+    for i, bars in enumerate(feeds):
+        single = run_feeds(ValueAreaStrategy, [bars])
+        assert strategy.feed_alerts[i] == single.alerts and len(single.alerts) > 0
+        assert [a.tolist() for a in strategy.state_history(i)] == [a.tolist() for a in single.state_history()]
+
+def test_tradingStrategyMultipleFeeds():
+    # backtrader's broker checks the orders of a feed against its last bar when another feed moves, so
+    # the feeds are aligned here
+    bars = load_bars("ES.csv")
+    strategy = run_feeds(ValueAreaTradingStrategy, [bars, bars], open_offset=0, stop_percent=0.1)
+    single = run_feeds(ValueAreaTradingStrategy, [bars], open_offset=0, stop_percent=0.1)
+    assert strategy.feed_fills[0] == strategy.feed_fills[1] == single.fills and len(single.fills) > 0
+    assert [m.state for m in strategy.managers] == [single.manager.state] * 2
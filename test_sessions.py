@@ -0,0 +1,50 @@
+import pytest
+import datetime
+import numpy as np
+from backtrader.utils import date2num
+
+from sessions import SessionSchedule, get_session_schedule, set_session_cache_dir
+
+start = datetime.date(2017, 11, 1)
+end = datetime.date(2017, 11, 30)
+
+@pytest.fixture()
+def schedule(request):
+    schedule = SessionSchedule("NYSE")
+    schedule.load(start, end)
+    return schedule
+
+def test_scheduleOpenClose(schedule):
+    i = schedule.index(datetime.date(2017, 11, 22).toordinal())
+    assert schedule.open[i] == date2num(datetime.datetime(2017, 11, 22, 14, 30))
+    assert schedule.close[i] == date2num(datetime.datetime(2017, 11, 22, 21, 0))
+    assert schedule.open_local[i] == np.datetime64("2017-11-22T09:30:00")
+
+def test_scheduleClosedDates(schedule):
+    assert schedule.index(datetime.date(2017, 11, 23).toordinal()) == -1 # thanksgiving
+    assert schedule.index(datetime.date(2017, 11, 25).toordinal()) == -1 # saturday
+    assert schedule.index(datetime.date(2017, 12, 25).toordinal()) == -1 # out of range
+
+def test_scheduleEnsureExtends(schedule):
+    schedule.ensure(datetime.date(2017, 12, 29).toordinal())
+    assert schedule.covers(start.toordinal())
+    assert schedule.index(datetime.date(2017, 12, 29).toordinal()) >= 0
+
+def test_scheduleShared():
+    assert get_session_schedule("NYSE") is get_session_schedule("NYSE")
+
+def test_scheduleDiskCache(tmpdir, schedule):
+    set_session_cache_dir(str(tmpdir))
+    try:
+        cached = SessionSchedule("NYSE")
+        cached.load(start, end)
+        assert tmpdir.join("NYSE_2017-11-01_2017-11-30.npz").check()
+
+        cached.calendar = None # schedule must not be recomputed
+        cached.load(start, end)
+    finally:
+        set_session_cache_dir(None)
+
+    np.testing.assert_array_equal(cached.dates, schedule.dates)
+    np.testing.assert_array_equal(cached.open, schedule.open)
+    np.testing.assert_array_equal(cached.close_local, schedule.close_local)
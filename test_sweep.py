@@ -0,0 +1,35 @@
+import pytest
+
+from sweep import SweepData, SweepTable, grid, random_search, run_sweep, simulate_value_area
+
+@pytest.fixture(scope="module")
+def data(request):
+    return SweepData.from_csv("ES.csv", "ESZ7")
+
+def test_sweepData(data):
+    assert len(data) == 330
+    assert str(data.session_open[0]) == "2017-10-23T09:30:00"
+    assert data.VAL[data.session == data.session[-1]][0] == 2578.25
+
+def test_grid():
+    params = grid(a=[1, 2], b=[3])
+    assert params == [dict(a=1, b=3), dict(a=2, b=3)]
+
+def test_randomSearch():
+    params = random_search(5, seed=1, a=[1, 2], b=(0.5, 1.5))
+    assert len(params) == 5
+    assert all(p["a"] in (1, 2) and 0.5 <= p["b"] <= 1.5 for p in params)
+
+def test_sweepTableRanking():
+    table = SweepTable(rank_by="pnl")
+    table.add(dict(a=1), dict(pnl=1.0))
+    table.add(dict(a=2), dict(pnl=3.0))
+    table.add(dict(a=3), dict(pnl=2.0))
+    assert [p["a"] for p, _ in table.top(3)] == [2, 3, 1]
+
+def test_sweepMatchesSerial(data):
+    params = grid(open_offset=[0, 30], close_offset=[30], stop_percent=[0.1, 1.0])
+    table = run_sweep(data, params, max_workers=2)
+    assert len(table) == len(params)
+    for p, result in table.rows:
+        assert result == simulate_value_area(data, **p)
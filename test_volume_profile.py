@@ -0,0 +1,116 @@
+import datetime
+import numpy as np
+
+from volume_profile import CompositeProfile, SessionProfiles, StreamingProfile, value_area_bounds, compute_levels
+
+def test_valueAreaBounds():
+    assert value_area_bounds([1, 2, 10, 3, 1], value_area=0.7) == (2, 2, 3)
+    assert value_area_bounds([1, 1, 1, 1], value_area=1.0) == (0, 0, 3)
+    assert value_area_bounds([5], value_area=0.7) == (0, 0, 0)
+
+def test_sessionProfiles():
+    session = [1, 1, 2]
+    high = [10.5, 10.25, 20.0]
+    low = [10.0, 10.25, 19.5]
+    volume = [30, 10, 9]
+    profiles = SessionProfiles(session, high, low, volume, tick_size=0.25)
+    prices, volumes = profiles.profile(0)
+    np.testing.assert_array_equal(prices, [10.0, 10.25, 10.5])
+    np.testing.assert_allclose(volumes, [10, 20, 10])
+    prices, volumes = profiles.profile(1)
+    np.testing.assert_array_equal(prices, [19.5, 19.75, 20.0])
+    np.testing.assert_allclose(volumes, [3, 3, 3])
+
+def test_computeLevelsNextSession():
+    dt = np.array(["2017-11-17T09:30", "2017-11-17T10:00"], dtype="datetime64[s]")
+    levels = compute_levels(dt, [2580.0, 2584.0], [2578.0, 2580.0], [100, 300])
+    # a friday's value area is traded on the following monday
+    assert list(levels) == [datetime.date(2017, 11, 20)]
+    assert levels[datetime.date(2017, 11, 20)] == {"VAH": 2583.75, "VAL": 2580.0}
+
+def test_computeLevelsWeekend():
+    dt = np.array(["2017-11-17T09:30", "2017-11-18T09:30", "2017-11-20T09:30"], dtype="datetime64[s]")
+    levels = compute_levels(dt, [2580.0, 2590.0, 2600.0], [2580.0, 2590.0, 2600.0], [100, 300, 200])
+    # the friday and saturday sessions both map to monday, which trades the saturday value area
+    assert list(levels) == [datetime.date(2017, 11, 20), datetime.date(2017, 11, 21)]
+    assert levels[datetime.date(2017, 11, 20)] == {"VAH": 2590.0, "VAL": 2590.0}
+    assert levels[datetime.date(2017, 11, 21)] == {"VAH": 2600.0, "VAL": 2600.0}
+
+def test_streamingProfileMatchesBatch():
+    rng = np.random.RandomState(0)
+    prices = 2500 + 0.25 * np.cumsum(rng.randint(-3, 4, size=2000))
+    volumes = rng.randint(1, 50, size=2000)
+    profile = StreamingProfile(tick_size=0.25, capacity=8)
+    for price, volume in zip(prices, volumes):
+        profile.add_tick(price, volume)
+        # the developing value area is the one of the histogram traded so far
+        traded, histogram = profile.profile()
+        lo, poc, hi = value_area_bounds(histogram)
+        assert (profile.VAL, profile.POC, profile.VAH) == (traded[lo], traded[poc], traded[hi])
+
+    batch = SessionProfiles(np.zeros(len(prices)), prices, prices, volumes, tick_size=0.25).value_areas()
+    assert (profile.VAL, profile.POC, profile.VAH) == (batch["VAL"][0], batch["POC"][0], batch["VAH"][0])
+
+def test_streamingProfileWidened():
+    # a tick past the traded range, away from the area, still changes the walk: the empty ticks up to it
+    # are taken before the ones below
+    profile = StreamingProfile(tick_size=1.0)
+    for price, volume in [(0, 10), (-2, 5), (-3, 5), (2, 1), (-6, 1), (1, 3)]:
+        profile.add_tick(price, volume)
+        traded, histogram = profile.profile()
+        lo, poc, hi = value_area_bounds(histogram)
+        assert (profile.VAL, profile.POC, profile.VAH) == (traded[lo], traded[poc], traded[hi])
+    profile.reset()
+    for price, volume in [(0, 10), (-2, 5), (-3, 5)]:
+        profile.add_tick(price, volume)
+    assert (profile.VAL, profile.POC, profile.VAH) == (-2, 0, 0)
+    profile.add_tick(2, 1)
+    assert (profile.VAL, profile.POC, profile.VAH) == (-2, 0, 2)
+
+def test_streamingProfileBars():
+    profile = StreamingProfile(tick_size=0.25)
+    assert np.isnan(profile.VAL) and np.isnan(profile.VAH)
+    profile.add_bar(10.5, 10.0, 30)
+    profile.add_bar(10.25, 10.25, 10)
+    assert (profile.VAL, profile.POC, profile.VAH) == (10.25, 10.25, 10.5)
+    profile.reset()
+    profile.add_bar(20.0, 20.0, 5)
+    assert (profile.VAL, profile.POC, profile.VAH) == (20.0, 20.0, 20.0)
+
+def test_compositeProfileMatchesBatch():
+    rng = np.random.RandomState(1)
+    session = np.repeat(np.arange(8), 50)
+    prices = 2500 + 0.25 * np.cumsum(rng.randint(-3, 4, size=len(session)))
+    volumes = rng.randint(1, 50, size=len(session))
+    profiles = SessionProfiles(session, prices, prices, volumes, tick_size=0.25)
+    np.testing.assert_array_equal(profiles.composite_value_areas(1), profiles.value_areas())
+
+    composite = profiles.composite_value_areas(3)
+    for i in range(len(profiles)):
+        # the same value area as a single profile of every bar of the window
+        window = (session > i - 3) & (session <= i)
+        batch = SessionProfiles(np.zeros(window.sum()), prices[window], prices[window], volumes[window]).value_areas()
+        assert composite["date"][i] == i
+        assert (composite["VAL"][i], composite["POC"][i], composite["VAH"][i]) == \
+            (batch["VAL"][0], batch["POC"][0], batch["VAH"][0])
+
+def test_compositeProfileWindow():
+    profile = CompositeProfile(2, tick_size=0.25, capacity=4)
+    assert len(profile) == 0 and np.isnan(profile.VAL)
+    profile.add_profile(np.array([10.0, 10.25]), [4.0, 2.0])
+    profile.add_profile(np.array([20.0]), [3.0])
+    assert len(profile) == 2
+    assert (profile.VAL, profile.POC, profile.VAH) == (10.0, 10.0, 20.0)
+    profile.add_session(int(20.25 / 0.25), [5.0])
+    # the first session left the window
+    assert len(profile) == 2
+    prices, volumes = profile.profile()
+    np.testing.assert_array_equal(prices, [20.0, 20.25])
+    np.testing.assert_array_equal(volumes, [3.0, 5.0])
+    assert (profile.VAL, profile.POC, profile.VAH) == (20.0, 20.25, 20.25)
+
+def test_computeLevelsComposite():
+    dt = np.array(["2017-11-16T09:30", "2017-11-17T09:30"], dtype="datetime64[s]")
+    levels = compute_levels(dt, [2580.0, 2590.0], [2580.0, 2590.0], [100, 300], days=2, value_area=1.0)
+    assert levels[datetime.date(2017, 11, 17)] == {"VAH": 2580.0, "VAL": 2580.0}
+    assert levels[datetime.date(2017, 11, 20)] == {"VAH": 2590.0, "VAL": 2580.0}
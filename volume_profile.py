@@ -0,0 +1,382 @@
+import sys
+import logging
+import datetime
+import numpy as np
+from collections import deque
+
+from levels import LEVEL_DTYPE, SymbolLevels, VALUE_AREAS
+from sessions import get_session_schedule
+
+log = logging.getLogger(__name__)
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+PROFILE_DTYPE = np.dtype([("date", np.int64), ("VAH", np.float64), ("VAL", np.float64), ("POC", np.float64)])
+
+
+def _greedy_bounds(volumes, poc, target):
+    """ (low, high) indexes reached by extending from `poc` until the area holds `target` volume
+
+    The area grows one tick at a time towards the larger of the two neighbouring volumes (above on ties).
+    That order is the same as taking the ticks by decreasing running minimum of the volumes walking away
+    from the point of control (above first on ties), which lets the whole walk be done with one sort.
+    """
+    if volumes[poc] >= target:
+        return poc, poc
+    above = volumes[poc + 1:]
+    below = volumes[:poc][::-1]
+    keys = np.concatenate((np.minimum.accumulate(above), np.minimum.accumulate(below)))
+    side = np.concatenate((np.zeros(len(above), dtype=np.int8), np.ones(len(below), dtype=np.int8)))
+    order = np.lexsort((np.arange(len(keys)), side, -keys))
+    total = np.cumsum(np.concatenate(([volumes[poc]], np.concatenate((above, below))[order])))
+    taken = min(int(np.searchsorted(total, target)), len(order))
+    above_taken = int(np.count_nonzero(side[order[:taken]] == 0))
+    return poc - (taken - above_taken), poc + above_taken
+
+
+def value_area_bounds(volumes, value_area=0.7):
+    """ (low, poc, high) indexes of the value area of a histogram
+
+    Starting from the point of control (the highest volume, lowest price on ties) the area is extended one
+    tick at a time towards the side with the larger next volume (above on ties) until it holds
+    `value_area` of the total volume.
+    """
+    volumes = np.asarray(volumes, dtype=np.float64)
+    poc = int(np.argmax(volumes))
+    lo, hi = _greedy_bounds(volumes, poc, value_area * volumes.sum())
+    return lo, poc, hi
+
+
+class SessionProfiles(object):
+    """ Volume-at-price histograms of every session, at `tick_size` resolution
+
+    The histograms are stored back to back in `volumes`; session i covers volumes[offsets[i]:offsets[i + 1]],
+    the first bin being the price start[i] * tick_size. Each bar's volume is spread evenly over the ticks
+    from its low to its high.
+    """
+
+    def __init__(self, session, high, low, volume, tick_size=0.25):
+        session = np.asarray(session, dtype=np.int64)
+        lo = np.round(np.asarray(low, dtype=np.float64) / tick_size).astype(np.int64)
+        hi = np.round(np.asarray(high, dtype=np.float64) / tick_size).astype(np.int64)
+        volume = np.asarray(volume, dtype=np.float64)
+        hi = np.maximum(hi, lo)
+
+        self.tick_size = tick_size
+        self.sessions, inverse = np.unique(session, return_inverse=True)
+        count = len(self.sessions)
+        start = np.full(count, np.iinfo(np.int64).max)
+        end = np.full(count, np.iinfo(np.int64).min)
+        np.minimum.at(start, inverse, lo)
+        np.maximum.at(end, inverse, hi)
+        self.start = start
+        self.offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(end - start + 1, out=self.offsets[1:])
+
+        # difference array with one spare bin per session: +v/n at each bar's low tick, -v/n one past its
+        # high tick. The running sum over a session's spare bin is only rounding error, and is removed.
+        padded = self.offsets[:-1] + np.arange(count)
+        per_tick = volume / (hi - lo + 1)
+        first = padded[inverse] + lo - start[inverse]
+        last = padded[inverse] + hi - start[inverse] + 1
+        size = self.offsets[-1] + count
+        running = np.cumsum(np.bincount(first, weights=per_tick, minlength=size) -
+                            np.bincount(last, weights=per_tick, minlength=size))
+        carry = np.zeros(count)
+        carry[1:] = running[padded[1:] - 1]
+        running -= np.repeat(carry, np.diff(self.offsets) + 1)
+        spare = np.zeros(size, dtype=bool)
+        spare[padded + np.diff(self.offsets)] = True
+        self.volumes = np.maximum(running[~spare], 0.0)
+
+    @classmethod
+    def from_bars(cls, dt, high, low, volume, tick_size=0.25):
+        """ Profiles of bars with naive datetime64 times, one session per calendar date """
+        session = np.asarray(dt, dtype="datetime64[D]").astype(np.int64) + _EPOCH_ORDINAL
+        return cls(session, high, low, volume, tick_size=tick_size)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def profile(self, i):
+        """ (prices, volumes) of session i """
+        volumes = self.volumes[self.offsets[i]:self.offsets[i + 1]]
+        prices = (self.start[i] + np.arange(len(volumes))) * self.tick_size
+        return prices, volumes
+
+    def value_areas(self, value_area=0.7):
+        """ PROFILE_DTYPE array of the value area of each session, keyed by the session's own date """
+        bounds = np.array([value_area_bounds(self.volumes[self.offsets[i]:self.offsets[i + 1]], value_area)
+                           for i in range(len(self.sessions))], dtype=np.int64).reshape(-1, 3)
+        ticks = self.start[:, None] + bounds
+        result = np.empty(len(self.sessions), dtype=PROFILE_DTYPE)
+        result["date"] = self.sessions
+        result["VAL"] = ticks[:, 0] * self.tick_size
+        result["POC"] = ticks[:, 1] * self.tick_size
+        result["VAH"] = ticks[:, 2] * self.tick_size
+        return result
+
+    def composite_value_areas(self, days, value_area=0.7):
+        """ PROFILE_DTYPE array of the value area of the `days` sessions up to each session (fewer at the start),
+        keyed by the date of the last one """
+        composite = CompositeProfile(days, tick_size=self.tick_size, value_area=value_area)
+        result = np.empty(len(self.sessions), dtype=PROFILE_DTYPE)
+        for i in range(len(self.sessions)):
+            composite.add_session(self.start[i], self.volumes[self.offsets[i]:self.offsets[i + 1]])
+            result[i] = (self.sessions[i], composite.VAH, composite.VAL, composite.POC)
+        return result
+
+
+class StreamingProfile(object):
+    """ Developing volume profile and value area of the current session, updated bar by bar
+
+    The histogram is a tick-indexed array that grows as new prices trade. Adding a bar costs O(ticks in the
+    bar) and keeps the point of control up to date. The value area is computed when read: bars which only
+    trade outside the current area, inside the range traded so far (and don't move the point of control)
+    leave the walk from the point of control valid, so it just continues until the area holds `value_area`
+    of the new total. Otherwise it is recomputed with one vectorized pass over the histogram. Use the
+    VAL/VAH properties directly as ValueAreaManager.handleNext levels for same-session trading.
+    """
+
+    def __init__(self, tick_size=0.25, value_area=0.7, capacity=256):
+        self.tick_size = tick_size
+        self.value_area = value_area
+        self._capacity = capacity
+        self.reset()
+
+    def reset(self):
+        """ Starts a new session """
+        self._bins = np.zeros(self._capacity)
+        self._base = None # tick of _bins[0]
+        self._min = self._max = None # lowest/highest tick traded
+        self.total = 0.0
+        self._poc = None
+        self._lo = self._hi = None # current value area ticks
+        self._area = 0.0 # volume inside the current value area
+        self._dirty = True
+
+    def _reserve(self, lo, hi):
+        """ Makes sure ticks lo through hi are inside the histogram, recentering/doubling it if needed """
+        if self._base is not None and lo >= self._base and hi < self._base + len(self._bins):
+            return
+        if self._min is not None:
+            lo, hi = min(lo, self._min), max(hi, self._max)
+        size = len(self._bins)
+        while size < 2 * (hi - lo + 1):
+            size *= 2
+        bins = np.zeros(size)
+        base = lo - (size - (hi - lo + 1)) // 2
+        if self._min is not None:
+            bins[self._min - base:self._max - base + 1] = \
+                self._bins[self._min - self._base:self._max - self._base + 1]
+        self._bins = bins
+        self._base = base
+
+    def add_bar(self, high, low, volume):
+        """ Spreads `volume` evenly over the ticks from `low` to `high` """
+        lo = int(round(low / self.tick_size))
+        hi = max(int(round(high / self.tick_size)), lo)
+        self._reserve(lo, hi)
+        # new ticks past either end change the walk from the point of control, even when they are outside
+        # the area: the ticks between are empty, and empty ticks above are taken before those below
+        widened = self._min is None or lo < self._min or hi > self._max
+        self._min = lo if self._min is None else min(self._min, lo)
+        self._max = hi if self._max is None else max(self._max, hi)
+
+        bins = self._bins[lo - self._base:hi - self._base + 1]
+        bins += volume / (hi - lo + 1)
+        self.total += volume
+
+        poc = self._poc
+        best = int(np.argmax(bins)) + lo
+        if poc is None or self._bins[best - self._base] > self._bins[poc - self._base] or \
+                (self._bins[best - self._base] == self._bins[poc - self._base] and best < poc):
+            self._poc = best
+            self._dirty = True
+        elif not self._dirty and (widened or (hi >= self._lo - 1 and lo <= self._hi + 1)):
+            self._dirty = True
+
+    def add_tick(self, price, volume):
+        self.add_bar(price, price, volume)
+
+    def _update(self):
+        if self._poc is None:
+            return
+        target = self.value_area * self.total
+        if self._dirty:
+            lo, poc, hi = self._min, self._poc, self._max
+            volumes = self._bins[lo - self._base:hi - self._base + 1]
+            low, high = _greedy_bounds(volumes, poc - lo, target)
+            self._lo, self._hi = lo + low, lo + high
+            self._area = volumes[low:high + 1].sum()
+            self._dirty = False
+            return
+
+        # only ticks outside the area changed: continue the walk from where it stopped
+        bins, base = self._bins, self._base
+        while self._area < target and (self._lo > self._min or self._hi < self._max):
+            above = bins[self._hi + 1 - base] if self._hi < self._max else -1.0
+            below = bins[self._lo - 1 - base] if self._lo > self._min else -1.0
+            if above >= below:
+                self._hi += 1
+                self._area += above
+            else:
+                self._lo -= 1
+                self._area += below
+
+    @property
+    def POC(self):
+        return np.NaN if self._poc is None else self._poc * self.tick_size
+
+    @property
+    def VAL(self):
+        self._update()
+        return np.NaN if self._lo is None else self._lo * self.tick_size
+
+    @property
+    def VAH(self):
+        self._update()
+        return np.NaN if self._hi is None else self._hi * self.tick_size
+
+    def profile(self):
+        """ (prices, volumes) traded so far """
+        if self._min is None:
+            return np.empty(0), np.empty(0)
+        volumes = self._bins[self._min - self._base:self._max - self._base + 1].copy()
+        return np.arange(self._min, self._max + 1) * self.tick_size, volumes
+
+
+class CompositeProfile(object):
+    """ Volume profile and value area of the last `days` sessions
+
+    The composite histogram is a running sum over a tick-indexed array: adding a session adds its histogram
+    and subtracts the one of the session leaving the window, so each session costs O(ticks of the two
+    sessions) plus one value area walk over the composite's range, instead of rebuilding it from bars.
+    The sums are exact for volumes which are exact in floating point, otherwise up to rounding.
+    """
+
+    def __init__(self, days, tick_size=0.25, value_area=0.7, capacity=1024):
+        self.days = days
+        self.tick_size = tick_size
+        self.value_area = value_area
+        self._capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self._bins = np.zeros(self._capacity)
+        self._base = None # tick of _bins[0]
+        self._sessions = deque() # (first tick, volumes) of the sessions in the window
+        self._ticks = None # (low, poc, high) ticks of the value area, None until computed
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _range(self):
+        return (min(start for start, volumes in self._sessions),
+                max(start + len(volumes) - 1 for start, volumes in self._sessions))
+
+    def _reserve(self, lo, hi):
+        """ Makes sure ticks lo through hi are inside the histogram, recentering/doubling it if needed """
+        if self._base is not None and lo >= self._base and hi < self._base + len(self._bins):
+            return
+        if self._sessions:
+            low, high = self._range()
+            lo, hi = min(lo, low), max(hi, high)
+        size = len(self._bins)
+        while size < 2 * (hi - lo + 1):
+            size *= 2
+        bins = np.zeros(size)
+        base = lo - (size - (hi - lo + 1)) // 2
+        if self._sessions:
+            bins[low - base:high - base + 1] = self._bins[low - self._base:high - self._base + 1]
+        self._bins = bins
+        self._base = base
+
+    def add_session(self, start, volumes):
+        """ Adds the histogram `volumes` of a session, whose first bin is the tick `start` """
+        volumes = np.asarray(volumes, dtype=np.float64)
+        if not len(volumes):
+            return
+        start = int(start)
+        self._reserve(start, start + len(volumes) - 1)
+        self._bins[start - self._base:start - self._base + len(volumes)] += volumes
+        self._sessions.append((start, volumes))
+        if len(self._sessions) > self.days:
+            start, volumes = self._sessions.popleft()
+            self._bins[start - self._base:start - self._base + len(volumes)] -= volumes
+        self._ticks = None
+
+    def add_profile(self, prices, volumes):
+        """ Adds a session from its (prices, volumes), as returned by StreamingProfile.profile() """
+        if len(prices):
+            self.add_session(int(round(prices[0] / self.tick_size)), volumes)
+
+    def _update(self):
+        if self._ticks is None and self._sessions:
+            lo, hi = self._range()
+            # what is left of the sessions subtracted is rounding error, which may be slightly negative
+            low, poc, high = value_area_bounds(np.maximum(self._bins[lo - self._base:hi - self._base + 1], 0.0),
+                                               self.value_area)
+            self._ticks = (lo + low, lo + poc, lo + high)
+        return self._ticks
+
+    @property
+    def VAL(self):
+        return np.NaN if self._update() is None else self._ticks[0] * self.tick_size
+
+    @property
+    def POC(self):
+        return np.NaN if self._update() is None else self._ticks[1] * self.tick_size
+
+    @property
+    def VAH(self):
+        return np.NaN if self._update() is None else self._ticks[2] * self.tick_size
+
+    def profile(self):
+        """ (prices, volumes) of the composite """
+        if not self._sessions:
+            return np.empty(0), np.empty(0)
+        lo, hi = self._range()
+        volumes = np.maximum(self._bins[lo - self._base:hi - self._base + 1], 0.0)
+        return np.arange(lo, hi + 1) * self.tick_size, volumes
+
+
+def next_session_levels(areas, exchange="NYSE"):
+    """ LEVEL_DTYPE levels trading each session's value area on the exchange's following session
+
+    Dates mapping to the same session, like a friday and a weekend day, keep the latest value area.
+    """
+    levels = np.empty(len(areas), dtype=LEVEL_DTYPE)
+    levels["VAH"] = areas["VAH"]
+    levels["VAL"] = areas["VAL"]
+    if not len(areas):
+        return levels
+    schedule = get_session_schedule(exchange)
+    schedule.ensure(int(areas["date"][0]), int(areas["date"][-1]) + 10)
+    i = np.searchsorted(schedule.dates, areas["date"], side="right")
+    levels["date"] = schedule.dates[np.minimum(i, len(schedule.dates) - 1)]
+    levels = levels[i < len(schedule.dates)]
+    return levels[np.r_[levels["date"][1:] != levels["date"][:-1], True]]
+
+
+def compute_levels(dt, high, low, volume, tick_size=0.25, value_area=0.7, exchange="NYSE", days=1):
+    """ Levels for ValueAreaIndicator computed from intraday bars: each date's levels are the value area
+    of the previous session's volume profile, or of the composite of the previous `days` sessions """
+    profiles = SessionProfiles.from_bars(dt, high, low, volume, tick_size=tick_size)
+    areas = profiles.value_areas(value_area) if days == 1 else profiles.composite_value_areas(days, value_area)
+    return SymbolLevels(next_session_levels(areas, exchange=exchange))
+
+
+def main():
+    from datafeeds import load_bars
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python volume_profile.py SYMBOL DATAFILE [TICK_SIZE]")
+    symbol, datafile = sys.argv[1:3]
+    tick_size = float(sys.argv[3]) if len(sys.argv) > 3 else 0.25
+    bars = load_bars(datafile)
+    VALUE_AREAS[symbol] = compute_levels(bars["time"], bars["high"], bars["low"], bars["volume"],
+                                         tick_size=tick_size)
+    VALUE_AREAS.save(symbol)
+
+if __name__ == "__main__":
+    main()